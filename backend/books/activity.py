@@ -0,0 +1,71 @@
+import datetime
+from typing import Iterable
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from buybacks.models import Buyback
+from purchase_orders.models import Purchase
+from sales.models import Sale
+
+from .models import BookDailyActivity
+
+# (transaction model, date lookup, quantity rollup field, money field, money rollup field)
+ACTIVITY_SOURCES = [
+    (Sale, 'sales_reconciliation__date', 'units_sold', 'revenue', 'sales_revenue'),
+    (Purchase, 'purchase_order__date', 'units_purchased', 'cost', 'purchase_cost'),
+    (Buyback, 'buyback_order__date', 'units_bought_back', 'revenue', 'buyback_revenue'),
+]
+
+ACTIVITY_FIELDS = ['units_sold', 'sales_revenue', 'units_purchased', 'purchase_cost', 'units_bought_back', 'buyback_revenue']
+
+
+def _aggregate_activity(book_ids=None, dates=None):
+    """Returns {(book_id, date): {rollup_field: value}} computed from the raw line items"""
+    activity = {}
+    for model, date_lookup, quantity_field, money_field, money_rollup_field in ACTIVITY_SOURCES:
+        line_items = model.objects.all()
+        if book_ids is not None:
+            line_items = line_items.filter(book__in=book_ids)
+        if dates is not None:
+            line_items = line_items.filter(**{f'{date_lookup}__in': dates})
+
+        line_items = line_items.values('book', date=F(date_lookup)).annotate(quantity=Sum('quantity'), money=Sum(money_field))
+        for line_item in line_items:
+            totals = activity.setdefault((line_item['book'], line_item['date']), {})
+            totals[quantity_field] = line_item['quantity']
+            totals[money_rollup_field] = round(line_item['money'], 2)
+
+    return activity
+
+
+def _to_rollup_rows(activity):
+    return [BookDailyActivity(book_id=book_id, date=date, **totals) for (book_id, date), totals in activity.items()]
+
+
+def refresh_book_activity(book_ids: Iterable[int], dates: Iterable[datetime.date]):
+    """Recompute the rollup rows of every (book, date) pair in book_ids x dates from the raw line items
+
+    Called after transactions are created, updated or deleted with the books and dates they touched.
+    """
+    book_ids = set(book_ids)
+    dates = set(dates)
+    if len(book_ids) == 0 or len(dates) == 0:
+        return
+
+    activity = _aggregate_activity(book_ids, dates)
+
+    with transaction.atomic():
+        BookDailyActivity.objects.filter(book__in=book_ids, date__in=dates).delete()
+        BookDailyActivity.objects.bulk_create(_to_rollup_rows(activity), update_conflicts=True, unique_fields=['book', 'date'], update_fields=ACTIVITY_FIELDS)
+
+
+def rebuild_book_activity():
+    """Rebuild the whole rollup table from the raw line items"""
+    activity = _aggregate_activity()
+
+    with transaction.atomic():
+        BookDailyActivity.objects.all().delete()
+        BookDailyActivity.objects.bulk_create(_to_rollup_rows(activity), batch_size=1000)
+
+    return len(activity)
@@ -1,3 +1,5 @@
+from case_designer.pdf_cache import PlanogramPDFCache
+
 from .models import Book, BookImage
 
 class BookImageCreator:
@@ -9,25 +11,42 @@ class BookImageCreator:
 
     def bookimage_get_and_create(self, request, isbn_13, setDefaultImage):
         book = Book.objects.filter(isbn_13=isbn_13)
+        image_bytes = None
 
         # This creates an image in static and sends a file
         if setDefaultImage:
             url = self.isbn_toolbox.get_default_image_url()
         elif self.has_image_bytes(request):
-            url = self.isbn_toolbox.commit_image_raw_bytes(request, book[0].id, isbn_13)
+            url, image_bytes = self.isbn_toolbox.commit_image_raw_bytes(request, book[0].id, isbn_13)
         elif self.has_image_url(request):
             url = self.isbn_toolbox.commit_image_url(request, book[0].id, isbn_13)
         else:
             url = self.isbn_toolbox.get_default_image_url()
 
+        # The default image is shared by every book and has no variants
+        is_default_image = url == self.isbn_toolbox.get_default_image_url()
+        processing_status = 'done' if is_default_image else 'pending'
+
         obj, created = BookImage.objects.get_or_create(
             book_id=book[0].id,
-            defaults={'image_url': url},
+            defaults={'image_url': url, 'processing_status': processing_status},
         )
 
         # We need to patch the url if it is a get
         if not created:
+            if obj.image_url == url and image_bytes is None:
+                # The image did not change, so its variants are still valid, unless it failed to be processed
+                if obj.processing_status == 'failed':
+                    self.isbn_toolbox.image_pipeline.schedule_processing(book[0].id, url)
+                return url
             obj.image_url = url
+            obj.thumbnail_url = obj.planogram_url = obj.detail_url = None
+            obj.processing_status, obj.processing_attempts, obj.processing_error = processing_status, 0, None
             obj.save()
+            # Planograms print the image of the book
+            PlanogramPDFCache().invalidate_books([book[0].id])
+
+        if not is_default_image:
+            self.isbn_toolbox.image_pipeline.schedule_processing(book[0].id, url, image_bytes)
 
         return url
@@ -28,4 +28,12 @@ class InventoryCountUnMatchedException(APIException):
 
     def __init__(self, book_name, running_stock, db_stock):
         default_detail = f"InventoryCountUnMatchedError: Book ({book_name}) DB stock ({db_stock}) is inconsistent with running stock ({running_stock})"
-        super().__init__(detail=default_detail, code=self.status_code)
\ No newline at end of file
+        super().__init__(detail=default_detail, code=self.status_code)
+
+
+class ImageUploadException(APIException):
+    status_code = 502
+
+    def __init__(self, file_location, error):
+        default_detail = f"ImageUploadError: Image ({file_location}) could not be uploaded to the image server: {error}"
+        super().__init__(detail=default_detail, code=self.status_code)
@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from django.db import connection
+
+# Shared, bounded thread pools for the blocking calls to external book services.
+# ISBN lookups and the per-source requests they make run in separate pools so that
+# a lookup waiting on its sources can never starve the pool that runs them.
+ISBN_LOOKUP_MAX_WORKERS = 8
+REMOTE_SOURCE_MAX_WORKERS = 16
+# Work that no request waits on, such as refreshing stale cache entries
+BACKGROUND_MAX_WORKERS = 4
+
+isbn_lookup_executor = ThreadPoolExecutor(max_workers=ISBN_LOOKUP_MAX_WORKERS, thread_name_prefix='isbn-lookup')
+remote_source_executor = ThreadPoolExecutor(max_workers=REMOTE_SOURCE_MAX_WORKERS, thread_name_prefix='remote-source')
+background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_MAX_WORKERS, thread_name_prefix='background')
+
+
+def closes_db_connection(func):
+    """Closes the database connection of the worker thread once the task is done
+
+    Django opens one connection per thread, and pool threads outlive the request,
+    so tasks that touch the database must not leave their connection open.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connection.close()
+
+    return wrapper
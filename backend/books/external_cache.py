@@ -0,0 +1,125 @@
+import datetime
+import threading
+from typing import Any, Callable, Iterable, Optional
+
+from django.utils import timezone
+
+from .executors import background_executor, closes_db_connection
+from .models import ExternalBookData
+
+# (time to live of a found result, time to live of a negative result), per source
+SOURCE_TTLS = {
+    ExternalBookData.GOOGLE_BOOKS: (datetime.timedelta(days=30), datetime.timedelta(days=1)),
+    ExternalBookData.OPENLIBRARY_IMAGE: (datetime.timedelta(days=30), datetime.timedelta(days=7)),
+    ExternalBookData.ABEBOOKS_PRICE: (datetime.timedelta(days=1), datetime.timedelta(hours=6)),
+    ExternalBookData.LIBRARYTHING_RELATED: (datetime.timedelta(days=90), datetime.timedelta(days=7)),
+}
+
+# Returned by peek_external_data for entries that are being fetched for the first time
+PENDING = object()
+
+# (source, isbn) pairs with a background refresh already queued in this process
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def store_external_data(source: str, isbn: str, payload: Any):
+    """Writes the result of a fetch to the cache, a None payload being stored as a negative entry"""
+    fetched_at = timezone.now()
+    ttl, negative_ttl = SOURCE_TTLS[source]
+    is_negative = payload is None
+
+    ExternalBookData.objects.bulk_create(
+        [ExternalBookData(
+            source=source,
+            isbn=isbn,
+            payload=payload,
+            is_negative=is_negative,
+            fetched_at=fetched_at,
+            expires_at=fetched_at + (negative_ttl if is_negative else ttl),
+        )],
+        update_conflicts=True,
+        unique_fields=['source', 'isbn'],
+        update_fields=['payload', 'is_negative', 'fetched_at', 'expires_at'],
+    )
+
+
+def refresh_external_data(source: str, isbn: str, fetch: Callable[[str], Any]):
+    payload = fetch(isbn)
+    store_external_data(source, isbn, payload)
+    return payload
+
+
+def schedule_refresh(source: str, isbn: str, fetch: Callable[[str], Any]):
+    """Refreshes the entry on the background pool, at most once at a time per entry"""
+    key = (source, isbn)
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def refresh():
+        try:
+            refresh_external_data(source, isbn, fetch)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    background_executor.submit(closes_db_connection(refresh))
+
+
+def get_external_entries(source: str, isbns: Iterable[str]):
+    """Returns {isbn: ExternalBookData} for the given ISBNs that are in the cache, fresh or stale"""
+    return {entry.isbn: entry for entry in ExternalBookData.objects.filter(source=source, isbn__in=set(isbns))}
+
+
+def get_external_data(source: str, isbn: str, fetch: Callable[[str], Any]) -> Optional[Any]:
+    """Returns the cached result of fetch(isbn) for the given source
+
+    fetch returns the payload to cache, or None for a negative result, and raises on
+    transient failures, which are never cached. Only ISBNs that were never looked up
+    are fetched synchronously; stale entries are served as is while they are refreshed
+    in the background.
+    """
+    entry = ExternalBookData.objects.filter(source=source, isbn=isbn).first()
+
+    if entry is None:
+        return refresh_external_data(source, isbn, fetch)
+
+    if entry.expires_at <= timezone.now():
+        schedule_refresh(source, isbn, fetch)
+
+    return None if entry.is_negative else entry.payload
+
+
+def peek_external_data(source: str, isbn: str, fetch: Callable[[str], Any]) -> Optional[Any]:
+    """Same as get_external_data, but never waits on fetch
+
+    ISBNs that were never looked up are fetched in the background and PENDING is returned meanwhile.
+    """
+    entry = ExternalBookData.objects.filter(source=source, isbn=isbn).first()
+
+    if entry is None or entry.expires_at <= timezone.now():
+        schedule_refresh(source, isbn, fetch)
+
+    if entry is None:
+        return PENDING
+
+    return None if entry.is_negative else entry.payload
+
+
+def refresh_stale_external_data(source: str, isbns: Iterable[str], fetch: Callable[[str], Any]) -> int:
+    """Synchronously fetches the given ISBNs that are missing from the cache or stale, returns how many were fetched"""
+    isbns = set(isbns)
+    fresh_isbns = set(ExternalBookData.objects.filter(source=source, isbn__in=isbns, expires_at__gt=timezone.now()).values_list('isbn', flat=True))
+
+    num_fetched = 0
+    for isbn in isbns - fresh_isbns:
+        try:
+            refresh_external_data(source, isbn, fetch)
+            num_fetched += 1
+        except Exception:
+            # Transient failures are left for the next refresh
+            pass
+
+    return num_fetched
@@ -0,0 +1,181 @@
+import io, os, environ
+from urllib.request import urlopen
+
+import PIL.Image as Image
+from django.db.models import F
+
+from case_designer.pdf_cache import PlanogramPDFCache
+
+from .executors import background_executor, closes_db_connection
+from .models import BookImage
+from .scpconnect import SCPTools
+
+# Formats accepted for book images, checked from the image header only
+ALLOWED_IMAGE_FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+MAX_IMAGE_PIXELS = 40_000_000
+IMAGE_DOWNLOAD_TIMEOUT_SECONDS = 10
+# Images failing this many times in a row are no longer retried by retry_failed_images
+IMAGE_PROCESSING_MAX_ATTEMPTS = 5
+
+# Bounding box of each variant, from the largest to the smallest, and the BookImage field that records it
+IMAGE_VARIANTS = [
+    ('detail', (600, 900), 'detail_url'),
+    ('thumbnail', (160, 240), 'thumbnail_url'),
+    ('planogram', (100, 150), 'planogram_url'),
+]
+VARIANT_JPEG_QUALITY = 80
+
+
+class InvalidImage(Exception):
+    pass
+
+
+class BookImagePipeline:
+    """Stores book images and produces their pre-sized variants in the background
+
+    Requests only check the image header and write the original bytes as they are. Downloading
+    remote images, decoding and resizing all happen on the background pool, which records the
+    variant urls on the BookImage of the book once they are written.
+
+    With BOOK_IMAGE_SCP_UPLOAD, the written files are then uploaded to the image server with
+    SCPTools.send_images, all the files of a call to process_images in the same batches.
+    """
+
+    def __init__(self,):
+        env = environ.Env()
+        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        environ.Env.read_env(os.path.join(BASE_DIR, '.env'))
+
+        self._internal_book_image_absolute_path = env('INTERNAL_BOOK_IMAGE_ABSOLUTE_PATH')
+        self._internal_book_image_url_path = env('INTERNAL_BOOK_IMAGE_URL_PATH')
+        self._host_name = env('HOST_NAME')
+        self._internal_image_base_url = f'https://{self._host_name}{self._internal_book_image_url_path}'
+        self._scp_upload = env.bool('BOOK_IMAGE_SCP_UPLOAD', default=False)
+
+    def validate_image_header(self, image_bytes):
+        """Returns the format of the image, raises InvalidImage without decoding the pixel data"""
+        if image_bytes is None or len(image_bytes) == 0 or len(image_bytes) > MAX_IMAGE_BYTES:
+            raise InvalidImage()
+
+        try:
+            # Image.open only parses the header, the pixels are decoded lazily
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                image_format, (width, height) = image.format, image.size
+        except Exception:
+            raise InvalidImage()
+
+        if image_format not in ALLOWED_IMAGE_FORMATS or width * height > MAX_IMAGE_PIXELS:
+            raise InvalidImage()
+
+        return image_format
+
+    def get_absolute_path(self, filename):
+        return f'{self._internal_book_image_absolute_path}/{filename}'
+
+    def get_url(self, filename):
+        return f'{self._internal_image_base_url}/{filename}'
+
+    def store_original(self, book_id, image_bytes):
+        """Writes the image bytes untouched and returns their url, raises InvalidImage"""
+        image_format = self.validate_image_header(image_bytes)
+        filename = f'{book_id}.{image_format.lower()}'
+
+        with open(self.get_absolute_path(filename), 'wb') as image_file:
+            image_file.write(image_bytes)
+
+        return self.get_url(filename)
+
+    def download_image(self, url):
+        resp = urlopen(url, timeout=IMAGE_DOWNLOAD_TIMEOUT_SECONDS)
+        # Reading one byte past the limit is enough to reject oversized images
+        return resp.read(MAX_IMAGE_BYTES + 1)
+
+    def create_variants(self, book_id, image_bytes):
+        """Decodes the image once and writes every variant, returns {BookImage field: url}"""
+        largest_size = IMAGE_VARIANTS[0][1]
+        variant_urls = {}
+
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # JPEGs can be decoded directly at a reduced scale, which is much faster than a full decode
+            image.draft('RGB', largest_size)
+            image = self.convert_to_rgb(image)
+
+            for variant, size, field in IMAGE_VARIANTS:
+                # Variants go from the largest to the smallest, so each one is resized from the previous one
+                image.thumbnail(size, Image.LANCZOS)
+                filename = f'{book_id}_{variant}.jpeg'
+                image.save(self.get_absolute_path(filename), format='JPEG', quality=VARIANT_JPEG_QUALITY, optimize=True, progressive=True)
+                variant_urls[field] = self.get_url(filename)
+
+        return variant_urls
+
+    def convert_to_rgb(self, image):
+        """Converting straight to RGB turns transparent pixels black, so transparent images are flattened onto white"""
+        if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+
+        return image.convert('RGB')
+
+    def get_local_path(self, url):
+        """Returns the path of the file written by the pipeline for the url, None for remote urls"""
+        if not url.startswith(f'{self._internal_image_base_url}/'):
+            return None
+        return self.get_absolute_path(os.path.basename(url))
+
+    def record_failure(self, book_id, image_url, error):
+        BookImage.objects.filter(book_id=book_id, image_url=image_url).update(processing_status='failed', processing_attempts=F('processing_attempts') + 1,
+                                                                               processing_error=error)
+
+    def process_image(self, book_id, image_url, image_bytes=None):
+        self.process_images([(book_id, image_url, image_bytes)])
+
+    def process_images(self, images):
+        """Produces the variants of the (book id, image url, image bytes or None) images, downloading and storing them first when remote
+
+        Failures are recorded on the BookImage, which keeps its current url until it is processed again.
+        Nothing is recorded for an image of a book that was replaced in the meantime.
+        """
+        # {book id: (image url, variant urls, written files)}
+        processed_images = {}
+        for book_id, image_url, image_bytes in images:
+            try:
+                if image_bytes is None:
+                    image_bytes = self.download_image(image_url)
+                    stored_url = self.store_original(book_id, image_bytes)
+                    if BookImage.objects.filter(book_id=book_id, image_url=image_url).update(image_url=stored_url) == 0:
+                        continue
+                    image_url = stored_url
+
+                variant_urls = self.create_variants(book_id, image_bytes)
+            except Exception as e:
+                self.record_failure(book_id, image_url, f'{type(e).__name__}: {e}')
+                continue
+
+            files = [self.get_local_path(url) for url in [image_url, *variant_urls.values()]]
+            processed_images[book_id] = (image_url, variant_urls, [file for file in files if file is not None])
+
+        if self._scp_upload and processed_images:
+            upload_result = SCPTools().send_images([file for *_, files in processed_images.values() for file in files])
+            for book_id, (image_url, _, files) in list(processed_images.items()):
+                if errors := [upload_result.failed[file] for file in files if file in upload_result.failed]:
+                    self.record_failure(book_id, image_url, f'Upload to the image server failed: {errors[0]}')
+                    del processed_images[book_id]
+
+        for book_id, (image_url, variant_urls, _) in processed_images.items():
+            if BookImage.objects.filter(book_id=book_id, image_url=image_url).update(processing_status='done', processing_attempts=0, processing_error=None,
+                                                                                      **variant_urls) > 0:
+                # Planograms print the planogram variant of the image
+                PlanogramPDFCache().invalidate_books([book_id])
+
+    def schedule_processing(self, book_id, image_url, image_bytes=None):
+        background_executor.submit(closes_db_connection(self.process_image), book_id, image_url, image_bytes)
+
+    def retry_failed_images(self, max_attempts=IMAGE_PROCESSING_MAX_ATTEMPTS):
+        """Processes again the images that failed fewer than max_attempts times, returns their number"""
+        failed_images = list(BookImage.objects.filter(processing_status='failed', processing_attempts__lt=max_attempts).values_list('book_id', 'image_url'))
+        self.process_images([(book_id, image_url, None) for book_id, image_url in failed_images])
+        return len(failed_images)
@@ -1,17 +1,21 @@
 from urllib.request import urlopen
-import json, os, io, environ, urllib
+import json, os, environ, urllib
 from isbnlib import *
 from dateutil import parser
-import PIL.Image as Image
 
-import threading
 from books.related_books import standardize_title, get_related_isbns, get_related_books_data
 
-from books.models import Book, RelatedBookGroup
+from books.models import Book, RelatedBookGroup, ExternalBookData
 from books.serializers import RelatedBookSerializer
 
 from django.db.models import Q
 from .price_suggestion import get_price_suggestion
+from .executors import remote_source_executor, closes_db_connection
+from .image_pipeline import BookImagePipeline, InvalidImage
+from .external_cache import get_external_data, peek_external_data, PENDING
+
+# Seconds to wait on an external book service before giving up on the request
+EXTERNAL_REQUEST_TIMEOUT_SECONDS = 10
 
 
 class ISBNTools:
@@ -28,6 +32,7 @@ class ISBNTools:
         self._default_image_name = env('DEFAULT_IMAGE_NAME')
         self._host_name = env('HOST_NAME')
         self._internal_image_base_url = f'https://{self._host_name}{self._internal_book_image_url_path}'
+        self.image_pipeline = BookImagePipeline()
 
     def is_valid_isbn(
         self,
@@ -44,28 +49,25 @@ class ISBNTools:
 
         parsed_isbn = self.parse_isbn(isbn)
 
-        threads = list()
         metadata = dict()
 
         kwargs = {"isbn": parsed_isbn, "shared_dict": metadata}
 
-        # get retail price suggestion from Abebooks scraping
-        retail_price_suggestion_thread = threading.Thread(target=self.get_retail_price_suggestion, kwargs=kwargs, daemon=True)
-        threads.append(retail_price_suggestion_thread)
-        retail_price_suggestion_thread.start()
-
-        # get book metadata from Google Books API
-        book_metadata_thread = threading.Thread(target=self.get_external_book_metadata, kwargs=kwargs, daemon=True)
-        threads.append(book_metadata_thread)
-        book_metadata_thread.start()
+        # get retail price suggestion from Abebooks scraping, only ever read from the cache
+        self.get_retail_price_suggestion(**kwargs)
 
-        # get book url from openlibrary
-        image_metadata_thread = threading.Thread(target=self.get_external_book_image_url, kwargs=kwargs, daemon=True)
-        threads.append(image_metadata_thread)
-        image_metadata_thread.start()
+        # Each remaining source runs on the shared remote source pool:
+        # book metadata from Google Books API and book url from openlibrary
+        # The sources query the external data cache, so the pool threads close their database connections
+        sources = [self.get_external_book_metadata, self.get_external_book_image_url]
+        futures = [remote_source_executor.submit(closes_db_connection(source), **kwargs) for source in sources]
 
-        for thread in threads:
-            thread.join()
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                # A failing source leaves its fields out of the metadata, the other sources still apply
+                pass
 
         return metadata
 
@@ -74,40 +76,69 @@ class ISBNTools:
         isbn,
         shared_dict,
     ):
-        shared_dict.update({"retail_price_suggestion": get_price_suggestion(isbn)})
+        # The scrape is slow, so it is never waited on: until it completes the suggestion is reported as pending
+        retail_price_suggestion = peek_external_data(ExternalBookData.ABEBOOKS_PRICE, isbn, get_price_suggestion)
+
+        if retail_price_suggestion is PENDING:
+            shared_dict.update({"retail_price_suggestion": None, "retail_price_suggestion_status": "pending"})
+        else:
+            shared_dict.update({"retail_price_suggestion": retail_price_suggestion, "retail_price_suggestion_status": "available"})
 
     def get_external_book_metadata(
         self,
         isbn,
         shared_dict,
     ):
+        data = get_external_data(ExternalBookData.GOOGLE_BOOKS, isbn, self.fetch_external_book_metadata)
+
+        if data is None:
+            shared_dict.update({"Invalid ISBN": isbn})
+            return
+
+        # Related books come from our own DB, so they are never cached with the metadata
+        data["fromDB"] = False
+        data = self.check_for_related_book_group(data)
+        shared_dict.update(data)
+
+    def fetch_external_book_metadata(self, isbn):
+        """Fetch book metadata from Google Books API, returns None if Google Books does not know the ISBN"""
         end_url = self._base_url + isbn
-        try:
-            resp = urlopen(end_url)
-        except:
-            # This is to catch the below error from GoogleBooks
-            # urllib.error.HTTPError: HTTP Error 429: Too Many Requests
-            # urllib will automatically retry the failed request
-            pass
+        # urllib.error.HTTPError: HTTP Error 429: Too Many Requests is raised here when rate limited
+        resp = urlopen(end_url, timeout=EXTERNAL_REQUEST_TIMEOUT_SECONDS)
 
         json_resp = json.load(resp)
         data = self.parse_response(json_resp, isbn)
-        shared_dict.update(data)
+        return None if "Invalid ISBN" in data else data
 
     def get_external_book_image_url(
         self,
         isbn,
         shared_dict,
     ):
+        try:
+            image_url = get_external_data(ExternalBookData.OPENLIBRARY_IMAGE, isbn, self.fetch_external_book_image_url)
+        except Exception:
+            # Transient failures are not cached, so the cover is looked up again on the next search
+            image_url = None
+
+        if image_url is None:
+            image_url = self.get_default_image_url()
+
+        shared_dict.update({'image_url': image_url})
+
+    def fetch_external_book_image_url(self, isbn):
+        """Returns the OpenLibrary cover url of the book, or None if OpenLibrary has no cover for it"""
         end_url = self._image_base_url + f'/{isbn}-L.jpg?default=false'
-        image_dict = dict()
 
-        if self.get_image_raw_bytes(end_url) is None:
-            image_dict['image_url'] = self.get_default_image_url()
-        else:
-            image_dict['image_url'] = end_url
+        try:
+            # Only the status matters, the image itself is not downloaded
+            urlopen(end_url, timeout=EXTERNAL_REQUEST_TIMEOUT_SECONDS).close()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
 
-        shared_dict.update(image_dict)
+        return end_url
 
     def parse_isbn(
         self,
@@ -129,7 +160,7 @@ class ISBNTools:
         selfLink = response['items'][0]['selfLink']
 
         # Google Books are represented differently and for more data need to make a second request
-        j = json.load(urlopen(selfLink))
+        j = json.load(urlopen(selfLink, timeout=EXTERNAL_REQUEST_TIMEOUT_SECONDS))
         info = j['volumeInfo']
 
         relevant_keys = ['title', 'authors', 'publisher', 'pageCount', 'publishedDate', 'industryIdentifiers', 'dimensions']
@@ -150,9 +181,6 @@ class ISBNTools:
                 else:
                     ret[key] = info[key]
 
-        # Set from DB to False
-        ret["fromDB"] = False
-        ret = self.check_for_related_book_group(ret)
         return ret
 
     def check_for_related_book_group(self, data):
@@ -201,66 +229,25 @@ class ISBNTools:
         """
         return [self.parse_isbn(raw_isbn) if self.is_valid_isbn(raw_isbn) else raw_isbn for raw_isbn in isbn_list]
 
-    def get_image_raw_bytes(self, end_url):
-        """Return raw bytes of book image
-
-        Args:
-            end_url: API Endpoint
-
-        Returns:
-            list: Byte array of book from OpenLibrary 
-        """
-        try:
-            resp = urlopen(end_url)
-        except Exception as e:
-            # Case where defualt image does not exist
-            return None
-
-        image_bytes = resp.read()
-
-        return image_bytes
-
-    def create_local_image(self, filename_without_extension, image_bytes):
-        if image_bytes is None:
-            return '', self._default_image_name
-
-        try:
-            image = Image.open(io.BytesIO(image_bytes))
-            filename = f'{filename_without_extension}.{image.format.lower()}'
-            absolute_location = f'{self._internal_book_image_absolute_path}/{filename}'
-            image.save(absolute_location)
-        except Exception as e:
-            # This means that the image_bytes is corrupted revert to default image in this case
-            filename = self._default_image_name
-            absolute_location = ''
-
-        return absolute_location, filename  # Absolute location is used to send the static file to image server
-
     def commit_image_url(self, request, book_id, isbn_13):
         # Get the image url
         end_url = request.data.get('image_url')
 
-        # If the url is the default iamge url no need to download
-        if end_url == self.get_default_image_url():
-            return self.get_default_image_url()
-
-        image_bytes = self.get_image_raw_bytes(end_url)
-        filename_without_extension = f'{book_id}'
-        abs_location, filename = self.create_local_image(filename_without_extension, image_bytes)
-
-        return f"{self._internal_image_base_url}/{filename}"
+        # The image is downloaded and stored by the image pipeline, until then the given url is used as is
+        return end_url
 
     def commit_image_raw_bytes(self, request, book_id, isbn_13):
         # Get the image raw_bytes
         file_uploaded = request.data.get('image_bytes')
-        content_type = file_uploaded.content_type
-        extension = content_type.split('/')[-1].strip()
         file_bytes = file_uploaded.read()
 
-        filename_without_extension = f'{book_id}'
-        absolute_location, filename = self.create_local_image(filename_without_extension, file_bytes)
+        try:
+            url = self.image_pipeline.store_original(book_id, file_bytes)
+        except InvalidImage:
+            # This means that the image_bytes is corrupted revert to default image in this case
+            return self.get_default_image_url(), None
 
-        return f"{self._internal_image_base_url}/{filename}"
+        return url, file_bytes
 
     def get_default_image_url(self,):
         return f'{self._internal_image_base_url}/{self._default_image_name}'
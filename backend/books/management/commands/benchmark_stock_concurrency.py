@@ -0,0 +1,300 @@
+import datetime, multiprocessing, os, random, threading, time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Sum
+
+from authapp.models import User
+from books.metrics import refresh_book_metrics
+from books.models import Book, BookInventoryCorrection
+from buybacks.models import Buyback, BuybackOrder
+from hypothetical_books_backend.version import API_PREFIX
+from purchase_orders.models import Purchase, PurchaseOrder
+from sales.models import Sale, SalesReconciliation
+from sales.reports import invalidate_sales_report_days
+from vendors.models import Vendor
+
+BENCHMARK_NAME = 'Stock Concurrency Benchmark'
+# ISBN-13s of the benchmark books are generated in the 979-0 range, which no book in the store uses
+BENCHMARK_ISBN_PREFIX = '9790'
+# Only requests from this address are accepted by the sales record endpoint
+SALES_RECORD_IP = '152.3.54.108'
+LOCK_SAMPLE_INTERVAL_SECONDS = 0.05
+
+# (operation, relative weight)
+OPERATIONS = [
+    ('sales_reconciliation', 4),
+    ('sales_record', 3),
+    ('purchase_order', 4),
+    ('buyback', 1),
+    ('correction', 2),
+    ('update_purchase_order', 1),
+    ('destroy_sales_reconciliation', 1),
+]
+
+
+def _init_worker():
+    # Worker processes are spawned, not forked, so they set Django up from scratch and share no connections
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hypothetical_books_backend.settings')
+    import django
+    django.setup()
+
+
+def make_isbn_13(number):
+    digits = f'{BENCHMARK_ISBN_PREFIX}{number:08d}'
+    check_digit = (10 - sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(digits)) % 10) % 10
+    return f'{digits}{check_digit}'
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+class BenchmarkWorker:
+    """Sends a random mix of stock-mutating requests through the API views, in its own process
+
+    Requests go through the full view stack with an in-process API client, so no server has
+    to run, but every query hits the configured database as a real request would.
+    """
+
+    def __init__(self, config, seed):
+        from rest_framework.test import APIClient
+
+        self.config = config
+        self.random = random.Random(seed)
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(user=User.objects.get(id=config['user_id']))
+        self.today = datetime.date.today().isoformat()
+        # Transaction groups created by this worker, that it later updates or deletes
+        self.purchase_orders = []
+        self.sales_reconciliations = []
+
+    def random_lines(self, price_name):
+        book_ids = self.random.sample(self.config['book_ids'], self.random.randint(1, min(self.config['lines'], len(self.config['book_ids']))))
+        return [{'book': book_id, 'quantity': self.random.randint(1, 5), price_name: round(self.random.uniform(1, 30), 2)} for book_id in book_ids]
+
+    def sales_reconciliation(self):
+        response = self.client.post(f'/{API_PREFIX}sales/sales_reconciliation/create', {'date': self.today, 'sales': self.random_lines('unit_retail_price')}, format='json')
+        if response.status_code == 201:
+            self.sales_reconciliations.append(response.data['id'])
+        return response
+
+    def sales_record(self):
+        items = ''.join(f'<item><isbn>{self.config["isbns"][sale["book"]]}</isbn><qty>{sale["quantity"]}</qty><price>{sale["unit_retail_price"]}</price></item>'
+                        for sale in self.random_lines('unit_retail_price'))
+        return self.client.post(f'/{API_PREFIX}sales/sales_record', f'<sale date="{self.today}">{items}</sale>', content_type='application/xml', HTTP_X_REAL_IP=SALES_RECORD_IP)
+
+    def purchase_order(self):
+        data = {'date': self.today, 'vendor': self.config['vendor_id'], 'purchases': self.random_lines('unit_wholesale_price')}
+        response = self.client.post(f'/{API_PREFIX}purchase_orders', data, format='json')
+        if response.status_code == 201:
+            self.purchase_orders.append(response.data)
+        return response
+
+    def buyback(self):
+        data = {'date': self.today, 'vendor': self.config['vendor_id'], 'buybacks': self.random_lines('unit_buyback_price')}
+        return self.client.post(f'/{API_PREFIX}buybacks', data, format='json')
+
+    def correction(self):
+        book_id = self.random.choice(self.config['book_ids'])
+        return self.client.post(f'/{API_PREFIX}books/correction/{book_id}', {'adjustment': self.random.randint(-3, 5)})
+
+    def update_purchase_order(self):
+        if not self.purchase_orders:
+            return self.purchase_order()
+        purchase_order = self.random.choice(self.purchase_orders)
+        # Changes the quantity of every purchase and adds a new one
+        purchases = [{
+            'id': purchase['id'],
+            'book': purchase['book'],
+            'quantity': self.random.randint(1, 5),
+            'unit_wholesale_price': purchase['unit_wholesale_price']
+        } for purchase in purchase_order['purchases']]
+        data = {'date': self.today, 'vendor': self.config['vendor_id'], 'purchases': purchases + self.random_lines('unit_wholesale_price')[:1]}
+        return self.client.put(f'/{API_PREFIX}purchase_orders/{purchase_order["id"]}', data, format='json')
+
+    def destroy_sales_reconciliation(self):
+        if not self.sales_reconciliations:
+            return self.sales_reconciliation()
+        sales_reconciliation_id = self.sales_reconciliations.pop(self.random.randrange(len(self.sales_reconciliations)))
+        return self.client.delete(f'/{API_PREFIX}sales/sales_reconciliation/{sales_reconciliation_id}')
+
+    def run(self, num_operations):
+        """Returns [(operation, outcome, latency in seconds)]"""
+        names, weights = zip(*OPERATIONS)
+        results = []
+        for _ in range(num_operations):
+            operation = self.random.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = getattr(self, operation)()
+                outcome = 'ok' if response.status_code < 400 else ('rejected' if response.status_code < 500 else 'error')
+            except Exception as e:
+                outcome = 'deadlock' if 'deadlock detected' in f'{e}' else 'error'
+            results.append((operation, outcome, time.perf_counter() - start))
+        connection.close()
+        return results
+
+
+def run_worker(config, seed, num_operations):
+    return BenchmarkWorker(config, seed).run(num_operations)
+
+
+class LockWaitSampler(threading.Thread):
+    """Periodically counts the lock requests of the database that are waiting to be granted"""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stopped = threading.Event()
+        self.samples = []
+
+    def run(self):
+        with connection.cursor() as cursor:
+            while not self.stopped.is_set():
+                cursor.execute('SELECT count(*) FROM pg_locks WHERE NOT granted AND database = (SELECT oid FROM pg_database WHERE datname = current_database())')
+                self.samples.append(cursor.fetchone()[0])
+                self.stopped.wait(LOCK_SAMPLE_INTERVAL_SECONDS)
+        connection.close()
+
+
+def get_deadlock_count():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()')
+        return cursor.fetchone()[0]
+
+
+class Command(BaseCommand):
+    help = ('Stress the stock-mutating endpoints with concurrent sales reconciliations, sales records, purchase orders, buybacks '
+            'and inventory corrections sent from several worker processes, then check every book stock against its ledger. '
+            'Writes to the configured database, so only run it against a local one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=200, help='Requests sent by each worker')
+        parser.add_argument('--books', type=int, default=20, help='Size of the pool of books the requests draw from, smaller means more contention')
+        parser.add_argument('--lines', type=int, default=5, help='Maximum number of line items per transaction group')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark data instead of deleting it at the end')
+
+    def handle(self, *args, **options):
+        config = self.create_fixtures(options)
+        try:
+            self.run_benchmark(config, options)
+            mismatches = self.verify_ledger(config['book_ids'])
+        finally:
+            if not options['keep']:
+                self.delete_fixtures(config)
+
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} book stocks do not match their ledger')
+        self.stdout.write(self.style.SUCCESS(f'All {len(config["book_ids"])} book stocks match their ledger'))
+
+    def create_fixtures(self, options):
+        if Vendor.objects.filter(name=BENCHMARK_NAME).exists():
+            raise CommandError('Benchmark data from a previous run exists, it was kept with --keep or the run was interrupted')
+
+        user = User.objects.create_user(f'benchmark-{os.getpid()}-{time.time_ns()}', password=None, is_staff=True)
+        vendor = Vendor.objects.create(name=BENCHMARK_NAME, buyback_rate=50)
+        books = Book.objects.bulk_create([
+            Book(title=f'{BENCHMARK_NAME} {i}', isbn_13=make_isbn_13(i), isbn_10='', publisher=BENCHMARK_NAME, publishedDate=2000, retail_price=10)
+            for i in range(options['books'])
+        ])
+        # bulk_create skips the hooks creating the metrics rows
+        refresh_book_metrics([book.id for book in books])
+        config = {
+            'user_id': user.id,
+            'vendor_id': vendor.id,
+            'book_ids': [book.id for book in books],
+            'isbns': {book.id: book.isbn_13 for book in books},
+            'lines': options['lines'],
+        }
+
+        # Sales and buybacks are only accepted for books purchased on or before their date
+        seed_worker = BenchmarkWorker(config, options['seed'])
+        seed_purchases = [{'book': book.id, 'quantity': 50, 'unit_wholesale_price': 5} for book in books]
+        response = seed_worker.client.post(f'/{API_PREFIX}purchase_orders', {
+            'date': (datetime.date.today() - datetime.timedelta(days=1)).isoformat(),
+            'vendor': vendor.id,
+            'purchases': seed_purchases
+        }, format='json')
+        if response.status_code != 201:
+            raise CommandError(f'Could not create the initial purchase order: {response.data}')
+        return config
+
+    def run_benchmark(self, config, options):
+        # Spawned workers open their own connections, the parent's must not be shared
+        connections.close_all()
+        deadlocks_before = get_deadlock_count()
+        lock_wait_sampler = LockWaitSampler()
+        lock_wait_sampler.start()
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers'], mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker) as executor:
+            futures = [executor.submit(run_worker, config, options['seed'] + worker + 1, options['operations']) for worker in range(options['workers'])]
+            results = [result for future in futures for result in future.result()]
+        elapsed = time.perf_counter() - start
+
+        lock_wait_sampler.stopped.set()
+        lock_wait_sampler.join()
+        deadlocks = get_deadlock_count() - deadlocks_before
+
+        self.report(results, elapsed, lock_wait_sampler.samples, deadlocks)
+
+    def report(self, results, elapsed, lock_wait_samples, deadlocks):
+        latencies = defaultdict(list)
+        outcomes = defaultdict(Counter)
+        for operation, outcome, latency in results:
+            latencies[operation].append(latency)
+            latencies['all'].append(latency)
+            outcomes[operation][outcome] += 1
+            outcomes['all'][outcome] += 1
+
+        self.stdout.write(f'{len(results)} requests in {elapsed:.2f}s, {len(results) / elapsed:.1f} requests/s')
+        self.stdout.write(f'{"operation":<30}{"count":>7}{"p50 ms":>10}{"p99 ms":>10}  outcomes')
+        for operation in [name for name, _ in OPERATIONS if name in latencies] + ['all']:
+            operation_latencies = sorted(latencies[operation])
+            self.stdout.write(f'{operation:<30}{len(operation_latencies):>7}{percentile(operation_latencies, 50) * 1000:>10.1f}'
+                              f'{percentile(operation_latencies, 99) * 1000:>10.1f}  {dict(outcomes[operation])}')
+
+        waiting_samples = [sample for sample in lock_wait_samples if sample > 0]
+        self.stdout.write(f'Lock waits: {len(waiting_samples)}/{len(lock_wait_samples)} samples had waiting locks, '
+                          f'at most {max(lock_wait_samples, default=0)} at once')
+        self.stdout.write(f'Deadlocks: {deadlocks} detected by the database')
+
+    def verify_ledger(self, book_ids):
+        """Returns {book id: (stock, ledger stock)} of the books whose stock differs from their transactions"""
+
+        def totals(queryset, quantity_field):
+            return dict(queryset.filter(book__in=book_ids).values_list('book').annotate(total=Sum(quantity_field)).order_by())
+
+        purchased = totals(Purchase.objects, 'quantity')
+        sold = totals(Sale.objects, 'quantity')
+        bought_back = totals(Buyback.objects, 'quantity')
+        corrected = totals(BookInventoryCorrection.objects, 'adjustment')
+
+        mismatches = {}
+        for book_id, stock in Book.objects.filter(id__in=book_ids).values_list('id', 'stock'):
+            ledger_stock = purchased.get(book_id, 0) - sold.get(book_id, 0) - bought_back.get(book_id, 0) + corrected.get(book_id, 0)
+            if stock != ledger_stock:
+                mismatches[book_id] = (stock, ledger_stock)
+                self.stdout.write(self.style.ERROR(f'Book {book_id}: stock is {stock}, its ledger gives {ledger_stock}'))
+        return mismatches
+
+    def delete_fixtures(self, config):
+        book_ids = config['book_ids']
+        dates = set()
+        # Every transaction group with a benchmark book was created by the benchmark
+        for model, line_model, group_name in [(SalesReconciliation, Sale, 'sales_reconciliation'), (PurchaseOrder, Purchase, 'purchase_order'),
+                                              (BuybackOrder, Buyback, 'buyback_order')]:
+            transaction_groups = model.objects.filter(id__in=line_model.objects.filter(book__in=book_ids).values(group_name))
+            dates.update(transaction_groups.values_list('date', flat=True))
+            transaction_groups.delete()
+
+        Book.objects.filter(id__in=book_ids).delete()
+        Vendor.objects.filter(id=config['vendor_id']).delete()
+        User.objects.filter(id=config['user_id']).delete()
+        invalidate_sales_report_days(dates)
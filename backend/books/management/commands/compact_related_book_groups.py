@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from books.related_books import compact_related_book_groups
+
+
+class Command(BaseCommand):
+    help = ('Move the books of merged related book groups to the root group of their family and delete the merged groups. '
+            'Merges only re-point groups, so this should be run periodically to keep membership lookups on a single level.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        num_groups = compact_related_book_groups(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Compacted {num_groups} merged related book groups'))
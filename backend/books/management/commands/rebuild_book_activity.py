@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from books.activity import rebuild_book_activity
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-book daily sales, purchases and buybacks rollup from the raw line items'
+
+    def handle(self, *args, **options):
+        num_rows = rebuild_book_activity()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {num_rows} book daily activity rows'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from books.metrics import rebuild_book_metrics
+
+
+class Command(BaseCommand):
+    help = ('Recompute the inventory metrics of every book used for sorting the book list. '
+            'Should be run daily with --last-month-only, since last month sales and days of supply change as the 30 day window moves.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--last-month-only', action='store_true', help='Only recompute the books whose last month sales can have changed since the previous day')
+
+    def handle(self, *args, **options):
+        num_books = rebuild_book_metrics(batch_size=options['batch_size'], last_month_only=options['last_month_only'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the metrics of {num_books} books'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from books.external_cache import refresh_stale_external_data
+from books.models import Book, ExternalBookData
+from books.price_suggestion import get_price_suggestion
+
+
+class Command(BaseCommand):
+    help = ('Precompute the retail price suggestions of every book in the inventory that are missing or stale, '
+            'so that ISBN searches for them never wait on Abebooks. Meant to be run periodically.')
+
+    def handle(self, *args, **options):
+        isbns = Book.objects.filter(isGhost=False).values_list('isbn_13', flat=True)
+        num_fetched = refresh_stale_external_data(ExternalBookData.ABEBOOKS_PRICE, isbns, get_price_suggestion)
+        self.stdout.write(self.style.SUCCESS(f'Refreshed the price suggestions of {num_fetched} books'))
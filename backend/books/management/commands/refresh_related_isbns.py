@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from books.models import Book
+from books.related_books import prefetch_related_isbns
+
+
+class Command(BaseCommand):
+    help = 'Cache the related ISBNs of every book in the inventory, fetching the unknown edition families from LibraryThing concurrently.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        isbns = list(Book.objects.filter(isGhost=False).order_by('id').values_list('isbn_13', flat=True))
+        batch_size = options['batch_size']
+
+        num_resolved = 0
+        for start in range(0, len(isbns), batch_size):
+            num_resolved += len(prefetch_related_isbns(isbns[start:start + batch_size]))
+
+        self.stdout.write(self.style.SUCCESS(f'Resolved the related ISBNs of {num_resolved} of {len(isbns)} books'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from books.image_pipeline import BookImagePipeline, IMAGE_PROCESSING_MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = ('Process again the book images whose download or variants failed, e.g. because their remote host was down. '
+            'Meant to be run periodically.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-attempts', type=int, default=IMAGE_PROCESSING_MAX_ATTEMPTS)
+
+    def handle(self, *args, **options):
+        num_images = BookImagePipeline().retry_failed_images(max_attempts=options['max_attempts'])
+        self.stdout.write(self.style.SUCCESS(f'Retried the processing of {num_images} book images'))
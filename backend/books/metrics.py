@@ -0,0 +1,172 @@
+import datetime
+
+from django.db.models import F, Q, Sum, Min, Count, prefetch_related_objects
+
+from purchase_orders.models import Purchase
+
+from .models import Book, BookDailyActivity, BookMetrics
+from .related_books import get_related_book_group_roots
+
+DEFAULT_THICKNESS = 0.8
+
+
+def get_last_month_range():
+    end_date = datetime.datetime.now().strftime('%Y-%m-%d')
+    start_date = (datetime.datetime.now() - datetime.timedelta(days=30)).strftime('%Y-%m-%d')
+    return start_date, end_date
+
+
+def load_last_month_sales(book_ids):
+    """Returns {book_id: units sold in the last 30 days} for the books that sold any"""
+    sales = BookDailyActivity.objects.filter(book__in=book_ids, date__range=get_last_month_range())
+    sales = sales.values('book').annotate(num_sold=Sum('units_sold')).values_list('book', 'num_sold')
+
+    return dict(sales)
+
+
+def load_best_buyback_prices(book_ids):
+    """Returns {book_id: best buyback price} over the most recent purchase of each book from each vendor"""
+    purchases = Purchase.objects.filter(book__in=book_ids)
+    purchases = purchases.annotate(vendor_id=F('purchase_order__vendor'), buyback_rate=F('purchase_order__vendor__buyback_rate'))
+    purchases = purchases.order_by('book', 'vendor_id', '-purchase_order__date').distinct('book', 'vendor_id')
+    purchases = purchases.values('book', 'buyback_rate', 'unit_wholesale_price')
+
+    best_buyback_prices = {}
+    for purchase in purchases:
+        if purchase['buyback_rate'] is None:
+            continue
+        buyback_price = purchase['buyback_rate'] * purchase['unit_wholesale_price'] * .01
+        best_buyback_prices[purchase['book']] = max(buyback_price, best_buyback_prices.get(purchase['book'], buyback_price))
+
+    return best_buyback_prices
+
+
+def calculate_shelf_space(thickness, stock):
+    thickness = DEFAULT_THICKNESS if thickness is None else thickness
+    if stock <= 0:
+        return 0.00
+    return round(thickness * stock, 2)
+
+
+def calculate_days_of_supply(stock, last_month_sales):
+    if last_month_sales == 0:
+        return float('inf')
+    if stock <= 0:
+        return 0.00
+    return round((stock / last_month_sales) * 30, 2)
+
+
+class BookMetricsLoader:
+    """Computes the derived fields of BookListAddSerializer for a whole page of books
+
+    Every metric is computed with a single grouped query over all the books in the page,
+    so the number of queries needed to serialize a page does not depend on the page size.
+
+    The loader is handed to the serializer through the serializer context under the 'book_metrics' key.
+    """
+
+    def __init__(self, books):
+        self.books = list(books)
+        self.book_ids = [book.id for book in self.books]
+
+        # authors, genres and image_url are read directly by the serializer fields
+        prefetch_related_objects(self.books, 'authors', 'genres', 'image_url')
+
+        self.last_month_sales = load_last_month_sales(self.book_ids)
+        self.best_buyback_prices = load_best_buyback_prices(self.book_ids)
+        self.related_books = self.load_related_books()
+
+    def load_related_books(self):
+        # Books are grouped by the root of their related book group, see books.models.RelatedBookGroup
+        self.related_book_group_roots = get_related_book_group_roots(book.related_book_group_id for book in self.books)
+        group_members = Book.objects.filter(related_book_group__root__in=set(self.related_book_group_roots.values()))
+        group_members = group_members.annotate(related_book_group_root=F('related_book_group__root')).prefetch_related('authors', 'genres', 'image_url')
+
+        related_books = {}
+        for group_member in group_members:
+            related_books.setdefault(group_member.related_book_group_root, []).append(group_member)
+
+        return related_books
+
+    def get_family(self, book):
+        return self.related_books.get(self.related_book_group_roots.get(book.related_book_group_id), [])
+
+    def get_last_month_sales(self, book):
+        return self.last_month_sales.get(book.id, 0)
+
+    def get_best_buyback_price(self, book):
+        best_buyback_price = self.best_buyback_prices.get(book.id, None)
+        return None if best_buyback_price is None else round(best_buyback_price, 2)
+
+    def get_related_books(self, book):
+        if book.related_book_group_id is None:
+            return []
+        return [related_book for related_book in self.get_family(book) if related_book.id != book.id]
+
+    def get_num_related_books(self, book):
+        if book.related_book_group_id is None:
+            return 0
+        return len(self.get_family(book)) - 1
+
+
+def refresh_book_metrics(book_ids):
+    """Recompute the BookMetrics rows of the given books with a fixed number of grouped queries"""
+    book_ids = set(book_ids)
+    if len(book_ids) == 0:
+        return
+
+    books = list(Book.objects.filter(id__in=book_ids).values('id', 'stock', 'thickness', related_book_group_root=F('related_book_group__root')))
+
+    authors = dict(Book.authors.through.objects.filter(book__in=book_ids).values('book').annotate(name=Min('author__name')).values_list('book', 'name'))
+    genres = dict(Book.genres.through.objects.filter(book__in=book_ids).values('book').annotate(name=Min('genre__name')).values_list('book', 'name'))
+    last_month_sales = load_last_month_sales(book_ids)
+    best_buyback_prices = load_best_buyback_prices(book_ids)
+
+    related_book_group_roots = {book['related_book_group_root'] for book in books if book['related_book_group_root'] is not None}
+    group_sizes = Book.objects.filter(related_book_group__root__in=related_book_group_roots).values('related_book_group__root').annotate(num_books=Count('id'))
+    group_sizes = dict(group_sizes.values_list('related_book_group__root', 'num_books'))
+
+    book_metrics = []
+    for book in books:
+        num_sold = last_month_sales.get(book['id'], 0)
+        best_buyback_price = best_buyback_prices.get(book['id'], None)
+        book_metrics.append(
+            BookMetrics(
+                book_id=book['id'],
+                author=authors.get(book['id'], None),
+                genre=genres.get(book['id'], None),
+                last_month_sales=num_sold,
+                shelf_space=calculate_shelf_space(book['thickness'], book['stock']),
+                days_of_supply=calculate_days_of_supply(book['stock'], num_sold),
+                num_related_books=0 if book['related_book_group_root'] is None else group_sizes.get(book['related_book_group_root'], 1) - 1,
+                best_buyback_price=None if best_buyback_price is None else round(best_buyback_price, 2),
+            ))
+
+    BookMetrics.objects.bulk_create(book_metrics,
+                                    update_conflicts=True,
+                                    unique_fields=['book'],
+                                    update_fields=['author', 'genre', 'last_month_sales', 'shelf_space', 'days_of_supply', 'num_related_books', 'best_buyback_price'])
+
+
+def refresh_related_book_group_metrics(related_book_group_ids):
+    """Recompute the metrics of every book in the families of the given related book groups, e.g. after their membership changed"""
+    related_book_group_roots = set(get_related_book_group_roots(related_book_group_ids).values())
+    refresh_book_metrics(Book.objects.filter(related_book_group__root__in=related_book_group_roots).values_list('id', flat=True))
+
+
+def rebuild_book_metrics(batch_size=1000, last_month_only=False):
+    """Recompute the metrics of every book, in batches
+
+    With last_month_only, only the books whose last month metrics can have changed as the 30 day window moved
+    are recomputed: the ones with sales in the window, or the day before it, and the ones stored with sales.
+    """
+    books = Book.objects.order_by('id')
+    if last_month_only:
+        start_date, end_date = get_last_month_range()
+        start_date = datetime.date.fromisoformat(start_date) - datetime.timedelta(days=1)
+        books = books.filter(Q(metrics__last_month_sales__gt=0) | Q(daily_activity__date__range=(start_date, end_date), daily_activity__units_sold__gt=0)).distinct()
+
+    book_ids = list(books.values_list('id', flat=True))
+    for start in range(0, len(book_ids), batch_size):
+        refresh_book_metrics(book_ids[start:start + batch_size])
+    return len(book_ids)
@@ -0,0 +1,57 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Backfill the rollup from the existing line items
+BACKFILL_BOOK_DAILY_ACTIVITY = """
+INSERT INTO books_bookdailyactivity (book_id, date, units_sold, sales_revenue, units_purchased, purchase_cost, units_bought_back, buyback_revenue)
+SELECT book_id, date, SUM(units_sold), ROUND(SUM(sales_revenue)::numeric, 2), SUM(units_purchased), ROUND(SUM(purchase_cost)::numeric, 2), SUM(units_bought_back), ROUND(SUM(buyback_revenue)::numeric, 2)
+FROM (
+    SELECT s.book_id, sr.date, s.quantity AS units_sold, s.revenue AS sales_revenue, 0 AS units_purchased, 0 AS purchase_cost, 0 AS units_bought_back, 0 AS buyback_revenue
+    FROM sales_sale s JOIN sales_salesreconciliation sr ON s.sales_reconciliation_id = sr.id
+    UNION ALL
+    SELECT p.book_id, po.date, 0, 0, p.quantity, p.cost, 0, 0
+    FROM purchase_orders_purchase p JOIN purchase_orders_purchaseorder po ON p.purchase_order_id = po.id
+    UNION ALL
+    SELECT b.book_id, bo.date, 0, 0, 0, 0, b.quantity, b.revenue
+    FROM buybacks_buyback b JOIN buybacks_buybackorder bo ON b.buyback_order_id = bo.id
+) AS line_items
+GROUP BY book_id, date
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0020_alter_book_stock'),
+        ('sales', '0009_salesreconciliation_user'),
+        ('purchase_orders', '0002_purchaseorder_user'),
+        ('buybacks', '0003_buybackorder_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookDailyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units_sold', models.IntegerField(default=0)),
+                ('sales_revenue', models.FloatField(default=0)),
+                ('units_purchased', models.IntegerField(default=0)),
+                ('purchase_cost', models.FloatField(default=0)),
+                ('units_bought_back', models.IntegerField(default=0)),
+                ('buyback_revenue', models.FloatField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_activity', to='books.book')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='bookdailyactivity',
+            index=models.Index(fields=['date'], name='book_daily_activity_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookdailyactivity',
+            constraint=models.UniqueConstraint(fields=('book', 'date'), name='unique_book_daily_activity'),
+        ),
+        migrations.RunSQL(BACKFILL_BOOK_DAILY_ACTIVITY, reverse_sql=migrations.RunSQL.noop),
+    ]
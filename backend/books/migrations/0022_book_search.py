@@ -0,0 +1,52 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:50
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+import django.db.models.functions.text
+
+# Populate the search document of the existing books
+BACKFILL_SEARCH_VECTOR = """
+UPDATE books_book SET search_vector =
+    setweight(to_tsvector('english', coalesce(books_book.title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce((
+        SELECT string_agg(books_author.name, ' ')
+        FROM books_author JOIN books_book_authors ON books_book_authors.author_id = books_author.id
+        WHERE books_book_authors.book_id = books_book.id
+    ), '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(books_book.publisher, '')), 'C')
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0021_bookdailyactivity'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='author_name_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('title'), name='gin_trgm_ops'), name='book_title_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('publisher'), name='gin_trgm_ops'), name='book_publisher_trgm_idx'),
+        ),
+        migrations.RunSQL(BACKFILL_SEARCH_VECTOR, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Backfill the metrics of the existing books, mirroring books.metrics.refresh_book_metrics
+BACKFILL_BOOK_METRICS = """
+INSERT INTO books_bookmetrics (book_id, author, genre, last_month_sales, shelf_space, days_of_supply, num_related_books, best_buyback_price)
+SELECT
+    b.id,
+    (SELECT MIN(a.name) FROM books_author a JOIN books_book_authors ba ON ba.author_id = a.id WHERE ba.book_id = b.id),
+    (SELECT MIN(g.name) FROM genres_genre g JOIN books_book_genres bg ON bg.genre_id = g.id WHERE bg.book_id = b.id),
+    sales.units_sold,
+    CASE WHEN b.stock <= 0 THEN 0 ELSE ROUND((COALESCE(b.thickness, 0.8) * b.stock)::numeric, 2) END,
+    CASE WHEN sales.units_sold = 0 THEN 'Infinity'::float WHEN b.stock <= 0 THEN 0 ELSE ROUND((b.stock * 30.0 / sales.units_sold)::numeric, 2) END,
+    CASE WHEN b.related_book_group_id IS NULL THEN 0
+         ELSE (SELECT COUNT(*) - 1 FROM books_book r WHERE r.related_book_group_id = b.related_book_group_id) END,
+    (SELECT ROUND(MAX(v.buyback_rate * recent.unit_wholesale_price * 0.01)::numeric, 2)
+     FROM (SELECT DISTINCT ON (po.vendor_id) po.vendor_id, p.unit_wholesale_price
+           FROM purchase_orders_purchase p JOIN purchase_orders_purchaseorder po ON p.purchase_order_id = po.id
+           WHERE p.book_id = b.id
+           ORDER BY po.vendor_id, po.date DESC) AS recent
+     JOIN vendors_vendor v ON v.id = recent.vendor_id)
+FROM books_book b
+CROSS JOIN LATERAL (
+    SELECT COALESCE(SUM(d.units_sold), 0) AS units_sold
+    FROM books_bookdailyactivity d
+    WHERE d.book_id = b.id AND d.date BETWEEN CURRENT_DATE - 30 AND CURRENT_DATE
+) AS sales
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0022_book_search'),
+        ('genres', '0004_remove_genre_book_cnt'),
+        ('vendors', '0002_vendor_buyback_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookMetrics',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='metrics', serialize=False, to='books.book')),
+                ('author', models.CharField(blank=True, db_index=True, default=None, max_length=70, null=True)),
+                ('genre', models.CharField(blank=True, db_index=True, default=None, max_length=30, null=True)),
+                ('last_month_sales', models.IntegerField(db_index=True, default=0)),
+                ('shelf_space', models.FloatField(db_index=True, default=0)),
+                ('days_of_supply', models.FloatField(db_index=True, default=float("inf"))),
+                ('num_related_books', models.IntegerField(db_index=True, default=0)),
+                ('best_buyback_price', models.FloatField(blank=True, db_index=True, default=None, null=True)),
+            ],
+        ),
+        migrations.RunSQL(BACKFILL_BOOK_METRICS, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0023_bookmetrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExternalBookData',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('google_books', 'Google Books'), ('openlibrary_image', 'OpenLibrary Image'), ('abebooks_price', 'Abebooks Price')], max_length=30)),
+                ('isbn', models.CharField(max_length=13)),
+                ('payload', models.JSONField(blank=True, default=None, null=True)),
+                ('is_negative', models.BooleanField(default=False)),
+                ('fetched_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='externalbookdata',
+            constraint=models.UniqueConstraint(fields=('source', 'isbn'), name='unique_external_book_data'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:56
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0024_externalbookdata'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='externalbookdata',
+            name='source',
+            field=models.CharField(choices=[('google_books', 'Google Books'), ('openlibrary_image', 'OpenLibrary Image'), ('abebooks_price', 'Abebooks Price'), ('librarything_related', 'LibraryThing Related ISBNs')], max_length=30),
+        ),
+        migrations.AddIndex(
+            model_name='externalbookdata',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['payload'], name='external_book_data_payload_idx'),
+        ),
+    ]
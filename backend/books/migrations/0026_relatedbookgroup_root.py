@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Every existing group is the root of its own family
+BACKFILL_RELATED_BOOK_GROUP_ROOTS = "UPDATE books_relatedbookgroup SET root_id = id"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0025_externalbookdata_librarything'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='relatedbookgroup',
+            name='root',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='merged_groups', to='books.relatedbookgroup'),
+        ),
+        migrations.RunSQL(BACKFILL_RELATED_BOOK_GROUP_ROOTS, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0026_relatedbookgroup_root'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookimage',
+            name='detail_url',
+            field=models.URLField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='bookimage',
+            name='planogram_url',
+            field=models.URLField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='bookimage',
+            name='thumbnail_url',
+            field=models.URLField(blank=True, default=None, null=True),
+        ),
+    ]
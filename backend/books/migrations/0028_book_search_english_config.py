@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:17
+
+from django.db import migrations
+
+# Rebuild the search documents with the same config as the search queries for the authors and publisher too
+BACKFILL_SEARCH_VECTOR = """
+UPDATE books_book SET search_vector =
+    setweight(to_tsvector('english', coalesce(books_book.title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce((
+        SELECT string_agg(books_author.name, ' ')
+        FROM books_author JOIN books_book_authors ON books_book_authors.author_id = books_author.id
+        WHERE books_book_authors.book_id = books_book.id
+    ), '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(books_book.publisher, '')), 'C')
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0027_bookimage_variants'),
+    ]
+
+    operations = [
+        migrations.RunSQL(BACKFILL_SEARCH_VECTOR, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+# Images processed before their status was recorded have their variants
+MARK_PROCESSED_IMAGES_DONE = "UPDATE books_bookimage SET processing_status = 'done' WHERE detail_url IS NOT NULL"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0028_book_search_english_config'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookimage',
+            name='processing_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bookimage',
+            name='processing_error',
+            field=models.TextField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='bookimage',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10),
+        ),
+        migrations.RunSQL(MARK_PROCESSED_IMAGES_DONE, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -1,14 +1,36 @@
 from django.db import models
+from django.db.models.functions import Upper
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from authapp.models import User
 
 
 class Author(models.Model):
     name = models.CharField(max_length=70, unique=True)
 
+    class Meta:
+        indexes = [
+            # Trigram index used by case-insensitive partial author name matches
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='author_name_trgm_idx'),
+        ]
+
 
 class RelatedBookGroup(models.Model):
+    """Edition family of a set of books
+
+    Groups are merged union-find style: every group points to the root group of its family,
+    and merging families only re-points the groups of the merged families to a new root.
+    Books keep their original group until the compact_related_book_groups command moves them
+    to their root and deletes the merged groups. Members of a family are the books whose
+    group has the family's root, see books.related_books.
+    """
     title = models.CharField(max_length=200)
+    # Always a root group, a root group points to itself. Set by books.related_books.create_related_book_group
+    root = models.ForeignKey('self', related_name='merged_groups', on_delete=models.PROTECT, default=None, null=True, blank=True)
+
+    def get_family_books(self):
+        return Book.objects.filter(related_book_group__root=self.root_id)
 
 
 class Book(models.Model):
@@ -41,17 +63,133 @@ class Book(models.Model):
 
     related_book_group = models.ForeignKey(RelatedBookGroup, related_name='related_books', on_delete=models.CASCADE, default=None, null=True, blank=True)
 
+    # Full text search document of the title, authors and publisher. Maintained by books.search_filters.update_book_search_vectors
+    search_vector = SearchVectorField(default=None, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+            # Trigram indexes used by case-insensitive partial title and publisher matches
+            GinIndex(OpClass(Upper('title'), name='gin_trgm_ops'), name='book_title_trgm_idx'),
+            GinIndex(OpClass(Upper('publisher'), name='gin_trgm_ops'), name='book_publisher_trgm_idx'),
+        ]
+
+
+BOOK_IMAGE_PROCESSING_STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+]
+
 
 class BookImage(models.Model):
     book = models.OneToOneField(Book, related_name='image_url', on_delete=models.CASCADE, primary_key=True)
+    # Original image as uploaded or downloaded
     image_url = models.URLField()
 
+    # Pre-sized variants produced by books.image_pipeline, empty until the image has been processed
+    thumbnail_url = models.URLField(default=None, null=True, blank=True)
+    planogram_url = models.URLField(default=None, null=True, blank=True)
+    detail_url = models.URLField(default=None, null=True, blank=True)
+    # Failed images are processed again by the retry_book_images management command and on the next update of the image
+    processing_status = models.CharField(max_length=10, choices=BOOK_IMAGE_PROCESSING_STATUS_CHOICES, default='pending', db_index=True)
+    processing_attempts = models.PositiveIntegerField(default=0)
+    processing_error = models.TextField(default=None, null=True, blank=True)
+
     def __str__(self):
         return self.image_url
 
+    def get_thumbnail_url(self):
+        return self.thumbnail_url or self.image_url
+
+    def get_planogram_url(self):
+        return self.planogram_url or self.image_url
+
+    def get_detail_url(self):
+        return self.detail_url or self.image_url
+
 
 class BookInventoryCorrection(models.Model):
     date = models.DateField(auto_now_add=True)
     user = models.ForeignKey(User, related_name='inventory_correction_user', on_delete=models.CASCADE)
     book = models.ForeignKey(Book, related_name='inventory_correction_book', on_delete=models.CASCADE)
     adjustment = models.IntegerField()
+
+
+class BookDailyActivity(models.Model):
+    """Rollup of the sales, purchases and buybacks of a book on a given day
+
+    Maintained incrementally by books.activity whenever transactions change, and rebuilt
+    from scratch with the rebuild_book_activity management command.
+    """
+    book = models.ForeignKey(Book, related_name='daily_activity', on_delete=models.CASCADE)
+    date = models.DateField()
+    units_sold = models.IntegerField(default=0)
+    sales_revenue = models.FloatField(default=0)
+    units_purchased = models.IntegerField(default=0)
+    purchase_cost = models.FloatField(default=0)
+    units_bought_back = models.IntegerField(default=0)
+    buyback_revenue = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also serves as the (book, date) index used for per-book date range lookups
+            models.UniqueConstraint(fields=['book', 'date'], name='unique_book_daily_activity'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='book_daily_activity_date_idx'),
+        ]
+
+
+class BookMetrics(models.Model):
+    """Denormalized inventory metrics of a book, indexed so that the book list can be sorted by them
+
+    Refreshed incrementally by books.metrics.refresh_book_metrics on the writes that affect them,
+    and rebuilt with the rebuild_book_metrics management command. last_month_sales and days_of_supply
+    also change as the 30 day window moves, so they are refreshed daily with rebuild_book_metrics --last-month-only.
+    """
+    book = models.OneToOneField(Book, related_name='metrics', on_delete=models.CASCADE, primary_key=True)
+    # First author and genre in alphabetical order
+    author = models.CharField(max_length=70, default=None, null=True, blank=True, db_index=True)
+    genre = models.CharField(max_length=30, default=None, null=True, blank=True, db_index=True)
+    last_month_sales = models.IntegerField(default=0, db_index=True)
+    shelf_space = models.FloatField(default=0, db_index=True)
+    days_of_supply = models.FloatField(default=float('inf'), db_index=True)
+    num_related_books = models.IntegerField(default=0, db_index=True)
+    best_buyback_price = models.FloatField(default=None, null=True, blank=True, db_index=True)
+
+
+class ExternalBookData(models.Model):
+    """Persistent cache of the results of the external book services, one row per (source, isbn)
+
+    Negative entries (unknown ISBN, missing cover, no listed prices, no other editions) are stored with an empty payload.
+    Read and refreshed through books.external_cache.
+    """
+    GOOGLE_BOOKS = 'google_books'
+    OPENLIBRARY_IMAGE = 'openlibrary_image'
+    ABEBOOKS_PRICE = 'abebooks_price'
+    LIBRARYTHING_RELATED = 'librarything_related'
+
+    SOURCE_CHOICES = [
+        (GOOGLE_BOOKS, 'Google Books'),
+        (OPENLIBRARY_IMAGE, 'OpenLibrary Image'),
+        (ABEBOOKS_PRICE, 'Abebooks Price'),
+        (LIBRARYTHING_RELATED, 'LibraryThing Related ISBNs'),
+    ]
+
+    source = models.CharField(max_length=30, choices=SOURCE_CHOICES)
+    isbn = models.CharField(max_length=13)
+    payload = models.JSONField(default=None, null=True, blank=True)
+    is_negative = models.BooleanField(default=False)
+    fetched_at = models.DateTimeField()
+    # Past this time the entry is stale: it is still served, but refreshed in the background
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'isbn'], name='unique_external_book_data'),
+        ]
+        indexes = [
+            # Used to find the cached edition family that contains a given ISBN
+            GinIndex(fields=['payload'], name='external_book_data_payload_idx'),
+        ]
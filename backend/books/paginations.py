@@ -1,5 +1,13 @@
-from utils.paginations import HTTPSNoPortPagination
+from utils.paginations import HTTPSNoPortPagination, HTTPSNoPortCursorPagination
 
 class BookPagination(HTTPSNoPortPagination):
     page_size = 10
     page_size_query_param = 'page_size'
+
+
+class BookCursorPagination(HTTPSNoPortCursorPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    cursor_ordering_fields = [
+        'title', 'isbn_13', 'publisher', 'publishedDate', 'retail_price', 'stock', 'last_month_sales', 'shelf_space', 'days_of_supply', 'num_related_books', 'id'
+    ]
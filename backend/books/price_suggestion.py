@@ -1,13 +1,28 @@
-from bs4 import BeautifulSoup
+import re
+
+import lxml.html
 import requests
 
+PRICE_SUGGESTION_URL = 'https://www.abebooks.com/servlet/SearchResults?sts=t&cm_sp=SearchF-_-home-_-Results&ds=100&an=&tn=&kn=&isbn='
+PRICE_SUGGESTION_TIMEOUT_SECONDS = 10
+
+# Only the listed prices are read from the search results page
+ITEM_PRICE_XPATH = "//*[contains(concat(' ', normalize-space(@class), ' '), ' item-price ')]/text()"
+PRICE_PATTERN = re.compile(r'\d[\d,]*\.\d+')
+
+
+def parse_prices(content):
+    prices = []
+    for text in lxml.html.fromstring(content).xpath(ITEM_PRICE_XPATH):
+        if match := PRICE_PATTERN.search(text):
+            prices.append(float(match.group().replace(',', '')))
+    return prices
+
 
 def get_price_suggestion(isbn):
-    base_url = 'https://www.abebooks.com/servlet/SearchResults?sts=t&cm_sp=SearchF-_-home-_-Results&ds=100&an=&tn=&kn=&isbn='
-    page = requests.get(base_url + str(isbn))
-    soup = BeautifulSoup(page.content, 'html.parser')
-    results = soup.find_all(class_="item-price")
-    prices = [float(x.text[-5:]) for x in results]
+    page = requests.get(PRICE_SUGGESTION_URL + str(isbn), timeout=PRICE_SUGGESTION_TIMEOUT_SECONDS)
+    page.raise_for_status()
+    prices = parse_prices(page.content)
 
     if len(prices) == 0:
         return None
@@ -1,25 +1,87 @@
 import re
 from urllib.request import urlopen
-from typing import List, Dict
+from typing import List, Dict, Iterable, Optional, Set
 from lxml import etree
 from isbnlib import *
 from books.models import Book
 
 from books.serializers import RelatedBookSerializer
-from django.db.models import Q
-from books.models import RelatedBookGroup
+from django.db import transaction
+from django.db.models import F, Q, OuterRef, Subquery
+from django.utils import timezone
+from books.models import RelatedBookGroup, ExternalBookData
+from books.executors import remote_source_executor, closes_db_connection
+from books.external_cache import get_external_data, get_external_entries, refresh_external_data, schedule_refresh
 
 
 def standardize_title(title: str) -> str:
     return re.sub(r'[^a-zA-Z0-9]', '', title).lower()
 
 
-def get_related_isbns(isbn: str) -> List[str]:
+# Seconds to wait on LibraryThing before giving up on the request
+RELATED_ISBNS_TIMEOUT_SECONDS = 10
+
+
+def fetch_related_isbns(isbn: str) -> Optional[List[str]]:
+    """Fetch the other editions of the book from LibraryThing, returns None if it knows of none"""
     related_books_endpoint = f"https://www.librarything.com/api/thingISBN/{isbn}"
-    resp = urlopen(related_books_endpoint)
+    resp = urlopen(related_books_endpoint, timeout=RELATED_ISBNS_TIMEOUT_SECONDS)
     tree = etree.parse(source=resp)
     related_isbns = {parse_isbn(xml_isbn.text) for xml_isbn in tree.getroot()}
     related_isbns.discard(isbn)  # Remove self from related isbns
+    return sorted(related_isbns) if len(related_isbns) > 0 else None
+
+
+def _get_related_isbns_from_family(isbn: str) -> Optional[Set[str]]:
+    """Derives the related ISBNs of a book from the cached edition family of any of its related editions"""
+    entry = ExternalBookData.objects.filter(source=ExternalBookData.LIBRARYTHING_RELATED, payload__contains=[isbn]).first()
+    if entry is None:
+        return None
+
+    related_isbns = set(entry.payload) | {entry.isbn}
+    related_isbns.discard(isbn)
+    ExternalBookData.objects.bulk_create(
+        [ExternalBookData(source=entry.source, isbn=isbn, payload=sorted(related_isbns), fetched_at=entry.fetched_at, expires_at=entry.expires_at)],
+        ignore_conflicts=True,
+    )
+    return related_isbns
+
+
+def get_related_isbns(isbn: str) -> Set[str]:
+    """Returns the ISBN-13s of the other editions of the book, LibraryThing is only asked for unknown edition families"""
+    if not ExternalBookData.objects.filter(source=ExternalBookData.LIBRARYTHING_RELATED, isbn=isbn).exists():
+        if (related_isbns := _get_related_isbns_from_family(isbn)) is not None:
+            return related_isbns
+
+    return set(get_external_data(ExternalBookData.LIBRARYTHING_RELATED, isbn, fetch_related_isbns) or [])
+
+
+def prefetch_related_isbns(isbns: Iterable[str]) -> Dict[str, Set[str]]:
+    """Bulk version of get_related_isbns
+
+    Cached edition families are read with one query, and the missing ones are fetched from
+    LibraryThing concurrently. ISBNs whose fetch failed are left out of the result.
+    """
+    isbns = set(isbns)
+    entries = get_external_entries(ExternalBookData.LIBRARYTHING_RELATED, isbns)
+
+    related_isbns = {isbn: set(entry.payload or []) for isbn, entry in entries.items()}
+    for isbn, entry in entries.items():
+        if entry.expires_at <= timezone.now():
+            schedule_refresh(ExternalBookData.LIBRARYTHING_RELATED, isbn, fetch_related_isbns)
+
+    missing_isbns = isbns - set(entries)
+    futures = {
+        isbn: remote_source_executor.submit(closes_db_connection(refresh_external_data), ExternalBookData.LIBRARYTHING_RELATED, isbn, fetch_related_isbns)
+        for isbn in missing_isbns
+    }
+    for isbn, future in futures.items():
+        try:
+            related_isbns[isbn] = set(future.result() or [])
+        except Exception:
+            # Transient failures are not cached and are retried on the next lookup
+            pass
+
     return related_isbns
 
 
@@ -28,24 +90,51 @@ def parse_isbn(isbn: str) -> str:
 
 
 def _get_related_book_data(related_book_isbns: List[str]) -> List[Dict]:
-    return RelatedBookSerializer(Book.objects.filter(related_book_group__in=Book.objects.filter(Q(isbn_13__in=related_book_isbns) | Q(isbn_10__in=related_book_isbns)).values('related_book_group')),
-                                 many=True).data
+    related_book_roots = Book.objects.filter(Q(isbn_13__in=related_book_isbns) | Q(isbn_10__in=related_book_isbns)).values('related_book_group__root')
+    return RelatedBookSerializer(Book.objects.filter(related_book_group__root__in=related_book_roots), many=True).data
 
 
 def get_related_books_data(isbn: str) -> List[Dict]:
     return _get_related_book_data(get_related_isbns(isbn))
 
 
-def combine_related_books_groups(related_book_group_ids: List[int]):
-    related_books = Book.objects.filter(related_book_group__in=related_book_group_ids)  # Get all books that are in any related book groups
-    # for sake of expected outcomes, let's use the related book group with the lowest id
-    combined_related_book_group_id = min(related_book_group_ids)
-    related_books.update(related_book_group=combined_related_book_group_id)
-    related_book_ids_to_delete = related_book_group_ids.copy()
-    related_book_ids_to_delete.remove(combined_related_book_group_id)
-    _delete_related_books_groups(related_book_ids_to_delete)
+def create_related_book_group(title: str) -> int:
+    related_book_group = RelatedBookGroup.objects.create(title=title)
+    RelatedBookGroup.objects.filter(id=related_book_group.id).update(root=related_book_group.id)
+    return related_book_group.id
+
+
+def get_related_book_group_roots(related_book_group_ids: Iterable[int]) -> Dict[int, int]:
+    """Returns {group id: root group id} for the given groups"""
+    related_book_group_ids = {group_id for group_id in related_book_group_ids if group_id is not None}
+    return dict(RelatedBookGroup.objects.filter(id__in=related_book_group_ids).values_list('id', 'root'))
+
+
+def combine_related_books_groups(related_book_group_ids: Iterable[int]) -> int:
+    """Merges the families of the given groups and returns the root of the merged family
+
+    Only the group rows of the merged families are re-pointed, the books are left untouched.
+    """
+    root_ids = set(get_related_book_group_roots(related_book_group_ids).values())
+    # for sake of expected outcomes, let's use the root group with the lowest id
+    combined_related_book_group_id = min(root_ids)
+    RelatedBookGroup.objects.filter(root__in=root_ids - {combined_related_book_group_id}).update(root=combined_related_book_group_id)
     return combined_related_book_group_id
 
 
-def _delete_related_books_groups(related_book_group_ids: List[int]):
-    RelatedBookGroup.objects.filter(id__in=related_book_group_ids).delete()
+def compact_related_book_groups(batch_size: int = 100) -> int:
+    """Moves the books of merged groups to the root of their family and deletes the merged groups
+
+    Runs in batches of groups so that no transaction holds the locks of many books at once. Groups without a root
+    are left alone, since their books would lose their group. Returns the number of deleted groups.
+    """
+    merged_group_ids = list(RelatedBookGroup.objects.filter(root__isnull=False).exclude(root=F('id')).order_by('id').values_list('id', flat=True))
+
+    for start in range(0, len(merged_group_ids), batch_size):
+        batch = merged_group_ids[start:start + batch_size]
+        with transaction.atomic():
+            root = RelatedBookGroup.objects.filter(id=OuterRef('related_book_group')).values('root')[:1]
+            Book.objects.filter(related_book_group__in=batch).update(related_book_group=Subquery(root))
+            RelatedBookGroup.objects.filter(id__in=batch).delete()
+
+    return len(merged_group_ids)
@@ -1,17 +1,47 @@
-import environ, os, io
-import asyncio, asyncssh, sys
-from datetime import datetime
+import environ, os, logging
+import asyncio, asyncssh, concurrent.futures, threading
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from .exceptions import ImageUploadException
 
 # from .utils import delete_all_files_in_file_location
 
+logger = logging.getLogger(__name__)
+
+# Files copied in a single scp session
+SCP_BATCH_SIZE = 20
+SCP_CONNECT_TIMEOUT_SECONDS = 20
+SCP_UPLOAD_TIMEOUT_SECONDS = 300
+SCP_RETRY_LIMIT = 5
+SCP_RETRY_BASE_DELAY_SECONDS = 0.5
+
+
+@dataclass
+class UploadResult:
+    uploaded: List[str] = field(default_factory=list)
+    # {file location: error of the last attempt}
+    failed: Dict[str, str] = field(default_factory=dict)
+
+
 class SCPTools:
+    """Uploads files to the image server through a pool of long-lived SSH connections
+
+    All the connections live on one event loop running in a background thread, shared by every
+    SCPTools instance of the process. Files are sent in batches, one scp session per batch,
+    and failed batches are retried with exponential backoff on a fresh connection.
+    """
+    _loop = None
+    _loop_lock = threading.Lock()
+    # Only used from the event loop thread
+    _idle_connections = []
+    _session_slots = None
+
     def __init__(
         self,
     ):
-        self.ssh = None
-        self.scp = None
         self.setup_envvar()
-    
+
     def setup_envvar(
         self,
     ):
@@ -22,47 +52,93 @@ class SCPTools:
         self.SCP_HOST = env('SCP_HOST')
         self.SCP_USER= env('SCP_USER')
         self.SCP_PASSWORD = env('SCP_PASSWORD')
+        self.SCP_POOL_SIZE = env.int('SCP_POOL_SIZE', default=3)
         self.INTERNAL_BOOK_IMAGE_ABSOLUTE_PATH=env('INTERNAL_BOOK_IMAGE_ABSOLUTE_PATH')
         self.INTERNAL_BOOK_IMAGE_REMOTE_PATH=env('INTERNAL_BOOK_IMAGE_REMOTE_PATH')
-    
+
     def get_host(self):
         return self.SCP_HOST
-    
+
+    @classmethod
+    def get_loop(cls):
+        with cls._loop_lock:
+            if cls._loop is None:
+                cls._loop = asyncio.new_event_loop()
+                threading.Thread(target=cls._loop.run_forever, name='scp-upload', daemon=True).start()
+        return cls._loop
+
     def send_image_data(
         self,
         file_location: str,
     ):
-        retry = 0
-        retry_limit = 5
-        while True:
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                asyncio.get_event_loop().run_until_complete(self.program(file_location))
-                break
-            except (OSError, asyncssh.Error) as exc:
-                if retry > retry_limit:
-                    sys.exit(f'SSH connection failed after retrying {retry_limit} times ' + str(exc))
-                    
-                retry = retry + 1
-                print(f'SSH connection failed.. retrying {retry}:{file_location}')
-
-        # Delete my sent image
-        os.remove(file_location)
+        result = self.send_images([file_location])
+
+        if result.failed:
+            raise ImageUploadException(file_location, result.failed[file_location])
 
         return self.SCP_HOST + self.INTERNAL_BOOK_IMAGE_REMOTE_PATH
-    
-    async def run_client(self):
-        while True:
-            conn = await asyncio.wait_for(asyncssh.connect(self.SCP_HOST, username=self.SCP_USER, password=self.SCP_PASSWORD, known_hosts = None),20)
-            if conn != None:
-                break
-        return conn
-
-    async def program(self, file_location):
-        await asyncio.gather(self.run_command(file_location))
-
-    async def run_command(self, file_location):    
-        conn = await self.run_client()        
-        await asyncssh.scp(file_location, (conn, self.INTERNAL_BOOK_IMAGE_ABSOLUTE_PATH))
-        conn.close()
+
+    def send_images(self, file_locations: List[str]) -> UploadResult:
+        """Uploads the files and deletes the ones that were sent, never raises on upload failures"""
+        future = asyncio.run_coroutine_threadsafe(self.upload_all(file_locations), self.get_loop())
+        try:
+            result = future.result(timeout=SCP_UPLOAD_TIMEOUT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            # Cancelling the upload also cancels the batches still running on the event loop
+            future.cancel()
+            error = f'Upload timed out after {SCP_UPLOAD_TIMEOUT_SECONDS} seconds'
+            logger.warning('SCP upload of %d files timed out', len(file_locations))
+            return UploadResult(failed={file_location: error for file_location in file_locations})
+
+        # Delete my sent images
+        for file_location in result.uploaded:
+            os.remove(file_location)
+
+        return result
+
+    async def upload_all(self, file_locations):
+        batches = [file_locations[start:start + SCP_BATCH_SIZE] for start in range(0, len(file_locations), SCP_BATCH_SIZE)]
+        result = UploadResult()
+
+        for batch, error in zip(batches, await asyncio.gather(*[self.upload_batch(batch) for batch in batches])):
+            if error is None:
+                result.uploaded.extend(batch)
+            else:
+                result.failed.update({file_location: error for file_location in batch})
+
+        return result
+
+    async def upload_batch(self, batch):
+        """Returns None once the batch is sent, or the error of the last attempt"""
+        cls = type(self)
+        if cls._session_slots is None:
+            cls._session_slots = asyncio.Semaphore(self.SCP_POOL_SIZE)
+
+        for retry in range(SCP_RETRY_LIMIT + 1):
+            if retry > 0:
+                await asyncio.sleep(SCP_RETRY_BASE_DELAY_SECONDS * 2**(retry - 1))
+
+            # At most SCP_POOL_SIZE sessions run at once, each on an idle connection or a new one
+            async with cls._session_slots:
+                conn = None
+                try:
+                    conn = cls._idle_connections.pop() if cls._idle_connections else await self.connect()
+                    await asyncssh.scp(batch, (conn, self.INTERNAL_BOOK_IMAGE_ABSOLUTE_PATH))
+                except (OSError, asyncio.TimeoutError, asyncssh.Error) as exc:
+                    # The connection may be broken, so it is not reused
+                    if conn is not None:
+                        conn.close()
+                    error = f'{exc}'
+                    logger.warning('SCP upload attempt %d/%d failed: %s: %s', retry + 1, SCP_RETRY_LIMIT + 1, batch, error)
+                    continue
+
+                cls._idle_connections.append(conn)
+                return None
+
+        return error
+
+    async def connect(self):
+        return await asyncio.wait_for(
+            asyncssh.connect(self.SCP_HOST, username=self.SCP_USER, password=self.SCP_PASSWORD, known_hosts=None),
+            SCP_CONNECT_TIMEOUT_SECONDS,
+        )
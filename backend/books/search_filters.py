@@ -1,37 +1,105 @@
+from django.db import connection
+from django.db.models import F, Q
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
 from rest_framework import filters
 
+from .models import Book
 from .utils import str2bool
 
+# Used for both the search documents and the queries, so that every word is stemmed the same way on both sides
+SEARCH_CONFIG = 'english'
+
+# Rebuilds the search document of the given books from their title (A), authors (B) and publisher (C)
+UPDATE_SEARCH_VECTOR_SQL = """
+UPDATE books_book SET search_vector =
+    setweight(to_tsvector('english', coalesce(books_book.title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce((
+        SELECT string_agg(books_author.name, ' ')
+        FROM books_author JOIN books_book_authors ON books_book_authors.author_id = books_author.id
+        WHERE books_book_authors.book_id = books_book.id
+    ), '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(books_book.publisher, '')), 'C')
+WHERE books_book.id = ANY(%s)
+"""
+
+
+def update_book_search_vectors(book_ids):
+    """Must be called after a book's title, authors or publisher are saved"""
+    with connection.cursor() as cursor:
+        cursor.execute(UPDATE_SEARCH_VECTOR_SQL, [list(book_ids)])
+
+
+def _books_by_author_name(search):
+    # Subquery on the author trigram index, which avoids the row duplication of joining on authors
+    return Book.authors.through.objects.filter(author__name__icontains=search).values('book_id')
+
+
+def _match_every_term(search, term_condition):
+    """Each whitespace or comma separated term of the search must match, as with DRF's SearchFilter"""
+    condition = Q()
+    for term in search.replace('\x00', '').replace(',', ' ').split():
+        condition &= term_condition(term)
+    return condition
+
+
+def search_books(queryset, query_params, order_by_rank=True):
+    """Filters a Book queryset by the 'search' query param using full text and trigram search
+
+    Supports the title_only, author_only, isbn_only and publisher_only modes.
+    When order_by_rank is set the results are ordered from the most to the least relevant.
+    """
+    search = (query_params.get('search') or '').strip()
+    if search == '':
+        return queryset
+
+    search_query = SearchQuery(search, config=SEARCH_CONFIG, search_type='websearch')
+
+    if str2bool(query_params.get('title_only')):
+        condition = _match_every_term(search, lambda term: Q(title__icontains=term))
+        rank = TrigramSimilarity('title', search)
+    elif str2bool(query_params.get('author_only')):
+        condition = _match_every_term(search, lambda term: Q(id__in=_books_by_author_name(term)))
+        # SearchRank weights are given in [D, C, B, A] order, authors are weighted B
+        rank = SearchRank(F('search_vector'), search_query, weights=[0, 0, 1, 0])
+    elif str2bool(query_params.get('isbn_only')):
+        condition = _match_every_term(search, lambda term: Q(isbn_13__icontains=term) | Q(isbn_10__icontains=term))
+        rank = None
+    elif str2bool(query_params.get('publisher_only')):
+        condition = _match_every_term(search, lambda term: Q(publisher__icontains=term))
+        rank = TrigramSimilarity('publisher', search)
+    else:
+        # Full text matches, or books where every term matches one of the fields, as the search used to work
+        condition = Q(search_vector=search_query) | _match_every_term(
+            search, lambda term: Q(title__icontains=term) | Q(id__in=_books_by_author_name(term)) | Q(publisher__iexact=term) | Q(isbn_13=term) | Q(isbn_10=term))
+        rank = SearchRank(F('search_vector'), search_query) + TrigramSimilarity('title', search)
+
+    queryset = queryset.filter(condition)
+
+    if order_by_rank and rank is not None:
+        queryset = queryset.annotate(search_rank=rank).order_by('-search_rank', 'title')
+
+    return queryset
+
+
 class CustomSearchFilter(filters.SearchFilter):
-    def get_search_fields(self, view, request):
-        if str2bool(request.query_params.get('title_only')):
-            return ['title']
-        elif str2bool(request.query_params.get('author_only')):
-            return ['authors__name']
-        elif str2bool(request.query_params.get('isbn_only')):
-            return ['isbn_10', 'isbn_13']
-        elif str2bool(request.query_params.get('publisher_only')):
-            return ['publisher']
-
-        return super().get_search_fields(view, request)
-    
+
+    def filter_queryset(self, request, queryset, view):
+        # Explicitly requested orderings take precedence over relevance
+        order_by_rank = not request.query_params.get('ordering')
+        return search_books(queryset, request.query_params, order_by_rank=order_by_rank)
+
+
 def generate_filter_from_query_params(query_params):
-    filter_kwargs = {
-        "isGhost": False
-    }
+    filter_kwargs = {"isGhost": False}
 
     if genre := query_params.get('genre', False):
         filter_kwargs['genres__name'] = genre
 
-    search = query_params.get('search')
-
-    if str2bool(query_params.get('title_only', False)):
-        filter_kwargs['title__icontains'] = search
-    elif str2bool(query_params.get('author_only', False)):
-        filter_kwargs['authors__name__icontains'] = search
-    elif str2bool(query_params.get('isbn_only', False)):
-        filter_kwargs['isbn_13__icontains'] = search
-    elif str2bool(query_params.get('publisher_only', False)):
-        filter_kwargs['publisher__icontains'] = search
-    
-    return filter_kwargs
\ No newline at end of file
+    return filter_kwargs
+
+
+def filter_books_from_query_params(queryset, query_params):
+    """Applies the same genre and search filtering as the book list view to a Book queryset"""
+    queryset = queryset.filter(**generate_filter_from_query_params(query_params))
+    order_by_rank = not query_params.get('ordering')
+    return search_books(queryset, query_params, order_by_rank=order_by_rank)
@@ -4,7 +4,7 @@ from collections import OrderedDict
 from rest_framework import serializers
 from django.db.models import F, Sum, Value, CharField
 
-from .models import Book, Author, BookImage, RelatedBookGroup
+from .models import Book, Author, BookImage, RelatedBookGroup, BookDailyActivity
 from genres.models import Genre
 from purchase_orders.models import Purchase
 from sales.models import Sale
@@ -27,6 +27,7 @@ class BookListAddSerializer(serializers.ModelSerializer):
     authors = serializers.SlugRelatedField(queryset=Author.objects.all(), many=True, slug_field='name')
     genres = serializers.SlugRelatedField(queryset=Genre.objects.all(), many=True, slug_field='name')
     image_url = serializers.StringRelatedField()
+    image_thumbnail_url = serializers.CharField(source='image_url.get_thumbnail_url', read_only=True)
     num_related_books = serializers.SerializerMethodField()
     related_books = serializers.SerializerMethodField()
     related_book_group = serializers.PrimaryKeyRelatedField(queryset=RelatedBookGroup.objects.all(), write_only=True)
@@ -39,32 +40,44 @@ class BookListAddSerializer(serializers.ModelSerializer):
         model = Book
         fields = [
             'id', 'title', 'authors', 'genres', 'isbn_13', 'isbn_10', 'publisher', 'publishedDate', 'pageCount', 'width', 'height', 'thickness', 'retail_price', 'isGhost', 'stock', 'image_url',
-            'best_buyback_price', 'last_month_sales', 'shelf_space', 'days_of_supply', 'num_related_books', 'related_books', 'related_book_group' 
+            'image_thumbnail_url', 'best_buyback_price', 'last_month_sales', 'shelf_space', 'days_of_supply', 'num_related_books', 'related_books', 'related_book_group' 
         ]
 
     def to_representation(self, instance):
         result = super(BookListAddSerializer, self).to_representation(instance)
         return OrderedDict([(key, result[key]) for key in result if result[key] is not None])
 
+    def get_book_metrics(self):
+        # Page-level metrics computed by ListCreateBookAPIView, see books.metrics.BookMetricsLoader
+        return self.context.get('book_metrics', None)
+
     def get_related_books(self, instance):
+        if book_metrics := self.get_book_metrics():
+            return RelatedBookSerializer(book_metrics.get_related_books(instance), many=True).data
         if instance.related_book_group == None:
             return []
-        related_books_serializer = RelatedBookSerializer(instance.related_book_group.related_books.all().exclude(id=instance.id), many=True)
+        related_books_serializer = RelatedBookSerializer(instance.related_book_group.get_family_books().exclude(id=instance.id), many=True)
         return related_books_serializer.data
 
     def get_num_related_books(self, instance):
+        if book_metrics := self.get_book_metrics():
+            return book_metrics.get_num_related_books(instance)
         if instance.related_book_group == None:
             return 0
-        return len(Book.objects.filter(related_book_group=instance.related_book_group)) - 1
+        return instance.related_book_group.get_family_books().count() - 1
 
     def get_last_month_sales(self, instance):
+        if book_metrics := self.get_book_metrics():
+            return book_metrics.get_last_month_sales(instance)
         end_date = datetime.datetime.now().strftime('%Y-%m-%d')
         start_date = (datetime.datetime.now() - datetime.timedelta(days=30)).strftime('%Y-%m-%d')
-        last_month_sales = Sale.objects.filter(sales_reconciliation__date__range=(start_date, end_date)).filter(book=instance.id)
-        last_month_sales = last_month_sales.aggregate(Sum('quantity'))['quantity__sum']
+        last_month_sales = BookDailyActivity.objects.filter(date__range=(start_date, end_date)).filter(book=instance.id)
+        last_month_sales = last_month_sales.aggregate(Sum('units_sold'))['units_sold__sum']
         return last_month_sales if last_month_sales else 0
 
     def get_best_buyback_price(self, instance):
+        if book_metrics := self.get_book_metrics():
+            return book_metrics.get_best_buyback_price(instance)
         purchases_of_book = Purchase.objects.filter(book=instance.id)
         purchases_of_book = purchases_of_book.annotate(vendor_id=F('purchase_order__vendor'))
         purchases_of_book = purchases_of_book.annotate(date=F('purchase_order__date'))
@@ -115,6 +128,7 @@ class BookSerializer(serializers.ModelSerializer):
     authors = serializers.SlugRelatedField(queryset=Author.objects.all(), many=True, slug_field='name')
     genres = serializers.SlugRelatedField(queryset=Genre.objects.all(), many=True, slug_field='name')
     image_url = serializers.StringRelatedField()
+    image_detail_url = serializers.CharField(source='image_url.get_detail_url', read_only=True)
     best_buyback_price = serializers.SerializerMethodField()
     last_month_sales = serializers.SerializerMethodField()
     line_items = serializers.SerializerMethodField()
@@ -124,7 +138,7 @@ class BookSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Book
-        fields = '__all__'
+        exclude = ['search_vector']
         read_only_fields = ['title', 'authors', 'isbn_13', 'isbn_10', 'publisher', 'publishedDate', 'image_url', 'best_buyback_price', 'last_month_sales', 'num_related_books', 'related_books']
 
     def to_representation(self, instance):
@@ -134,13 +148,13 @@ class BookSerializer(serializers.ModelSerializer):
     def get_related_books(self, instance):
         if instance.related_book_group == None:
             return []
-        related_books_serializer = RelatedBookSerializer(instance.related_book_group.related_books.all().exclude(id=instance.id), many=True)
+        related_books_serializer = RelatedBookSerializer(instance.related_book_group.get_family_books().exclude(id=instance.id), many=True)
         return related_books_serializer.data
 
     def get_num_related_books(self, instance):
         if instance.related_book_group == None:
             return 0
-        return len(Book.objects.filter(related_book_group=instance.related_book_group)) - 1
+        return instance.related_book_group.get_family_books().count() - 1
 
     def get_best_buyback_price(self, instance):
         purchases_of_book = Purchase.objects.filter(book=instance.id)
@@ -161,8 +175,8 @@ class BookSerializer(serializers.ModelSerializer):
     def get_last_month_sales(self, instance):
         end_date = datetime.datetime.now().strftime('%Y-%m-%d')
         start_date = (datetime.datetime.now() - datetime.timedelta(days=30)).strftime('%Y-%m-%d')
-        last_month_sales = Sale.objects.filter(sales_reconciliation__date__range=(start_date, end_date)).filter(book=instance.id)
-        last_month_sales = last_month_sales.aggregate(Sum('quantity'))['quantity__sum']
+        last_month_sales = BookDailyActivity.objects.filter(date__range=(start_date, end_date)).filter(book=instance.id)
+        last_month_sales = last_month_sales.aggregate(Sum('units_sold'))['units_sold__sum']
         return last_month_sales if last_month_sales else 0
 
     def get_line_items(self, instance):
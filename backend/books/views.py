@@ -1,7 +1,8 @@
 import re, datetime
-import threading
 from collections import OrderedDict
+from concurrent.futures import wait
 
+from django.db import transaction
 from django.db.models import OuterRef, Subquery, F, Case, When, Value, Func, ExpressionWrapper, FloatField, Count
 from django.db.models.functions import Coalesce, Cast, Round
 
@@ -15,18 +16,26 @@ from genres.models import Genre
 from purchase_orders.models import Purchase
 from sales.models import Sale
 from helpers.csv_writer import CSVWriter
+from helpers.stock import apply_stock_changes, lock_books
 from utils.permissions import CustomBasePermission
+from utils.paginations import CursorPaginationOptInMixin
 
 from .serializers import BookListAddSerializer, BookSerializer, ISBNSerializer, BookImageSerializer, BookInventoryCorrectionSerializer, RelatedBookSerializer, RemoteBookSearchSerializer, RemoteBookBodySerializer
 from .isbn import ISBNTools
 from .models import Book, Author, BookImage, BookInventoryCorrection, RelatedBookGroup
-from .paginations import BookPagination
+from .paginations import BookPagination, BookCursorPagination
 from .search_filters import *
 from .utils import str2bool, RemoteAPIRepresentationSwitch
 from .book_images import BookImageCreator
 from .exceptions import *
-from .related_books import standardize_title, combine_related_books_groups, get_related_isbns
+from .related_books import standardize_title, combine_related_books_groups, create_related_book_group, get_related_isbns
 from .remote_books import RemoteSubsidiaryTools
+from .executors import isbn_lookup_executor, closes_db_connection
+from .metrics import BookMetricsLoader, refresh_book_metrics, refresh_related_book_group_metrics
+
+
+# Remote ISBN lookups still running after this many seconds are reported as unresolved
+ISBN_SEARCH_DEADLINE_SECONDS = 30
 
 
 class ISBNSearchView(APIView):
@@ -55,49 +64,47 @@ class ISBNSearchView(APIView):
         data_populated_isbns = {
             "books": [],
             "invalid_isbns": [],
+            "unresolved_isbns": [],
         }
 
         # Fetch from DB if exist or else get from External DB such as Google Books
-        filtered_query_set = Book.objects.filter(isbn_13__in=parsed_isbn_list, isGhost=False)
-
-        threads = list()
-        for index, isbn in enumerate(parsed_isbn_list):
-            kwargs = {
-                "isbn": isbn,
-                "shared_dict": data_populated_isbns,
-                "query_set": filtered_query_set,
-            }
-            thread = threading.Thread(target=self.isbn_search_task, kwargs=kwargs, daemon=True)
-            threads.append(thread)
-            thread.start()
-
-        for index, thread in enumerate(threads):
-            thread.join()
+        # All DB hits are resolved with a single query, indexed by ISBN
+        books_in_db = {
+            book.isbn_13: book
+            for book in Book.objects.filter(isbn_13__in=parsed_isbn_list, isGhost=False).select_related('image_url', 'related_book_group').prefetch_related('authors', 'genres')
+        }
 
-        return Response(data_populated_isbns)
+        # Remote lookups go through the shared bounded executor, once per distinct ISBN
+        remote_isbns = [isbn for isbn in dict.fromkeys(parsed_isbn_list) if isbn not in books_in_db]
+        remote_lookups = {isbn: isbn_lookup_executor.submit(closes_db_connection(self.isbn_toolbox.fetch_isbn_data), isbn) for isbn in remote_isbns}
+        wait(remote_lookups.values(), timeout=ISBN_SEARCH_DEADLINE_SECONDS)
 
-    def isbn_search_task(self, isbn, shared_dict, query_set):
-        isbn_query_set = [book.isbn_13 for book in query_set]
-        # remote_book_data = self.get_remote_book(isbn)
-        book_data = {}
+        # Results are returned in the order the ISBNs were submitted
+        for isbn in parsed_isbn_list:
+            if isbn in books_in_db:
+                data_populated_isbns['books'].append(self.parseDBBookModel(books_in_db[isbn]))
+                continue
+
+            remote_lookup = remote_lookups[isbn]
+            if not remote_lookup.done():
+                # The lookup did not finish before the deadline
+                remote_lookup.cancel()
+                data_populated_isbns['unresolved_isbns'].append(isbn)
+                continue
+
+            try:
+                book_data = remote_lookup.result()
+            except Exception:
+                data_populated_isbns['unresolved_isbns'].append(isbn)
+                continue
+
+            if "Invalid ISBN" in book_data:
+                data_populated_isbns['invalid_isbns'].append(isbn)
+            else:
+                data_populated_isbns['books'].append(book_data)
+
+        return Response(data_populated_isbns)
 
-        if isbn in isbn_query_set:
-            book_data = self.parseDBBookModel(query_set[isbn_query_set.index(isbn)])
-        else:
-            book_data = self.populate_shared_dict_with_isbn_data(isbn, shared_dict)
-        
-        # if remote_book_data:
-        #     book_data['remote_book'] = remote_book_data
-        if book_data:
-            shared_dict['books'].append(book_data)
-
-    def populate_shared_dict_with_isbn_data(self, isbn, shared_dict):
-        external_data = self.isbn_toolbox.fetch_isbn_data(isbn)
-        if "Invalid ISBN" in external_data:
-            shared_dict['invalid_isbns'].append(isbn)
-        else:
-            return external_data
-    
     def get_remote_book(self, isbn):
         response = self.remote_api_caller.get_remote_book_data(isbn)
         return response
@@ -108,6 +115,8 @@ class ISBNSearchView(APIView):
         ret = dict()
 
         for field in book._meta.fields:
+            if field.name == 'search_vector':
+                continue
             if (v := getattr(book, field.name)) is not None:
                 ret[field.name] = v
 
@@ -121,19 +130,17 @@ class ISBNSearchView(APIView):
             ret.setdefault("genres", []).append(genre.name)
 
         # At this point there should be a BookImage associated with the book
-        images = BookImage.objects.filter(book=book)
-
-        if len(images) == 0:
+        try:
+            local_url = book.image_url.image_url
+        except BookImage.DoesNotExist:
             # This is the case where there is no default image associated with the book.
             local_url = self.isbn_toolbox.get_default_image_url()
-        else:
-            local_url = images[0].image_url
 
         ret["image_url"] = local_url
         ret["fromDB"] = True
         if "related_book_group" in ret.keys():
             related_book_group = ret["related_book_group"]
-            ret["related_books"] = RelatedBookSerializer(related_book_group.related_books.all().exclude(id=ret['id']), many=True).data
+            ret["related_books"] = RelatedBookSerializer(related_book_group.get_family_books().exclude(id=ret['id']), many=True).data
             del ret["related_book_group"]
         else:
             ret["related_books"] = []
@@ -143,10 +150,11 @@ class ISBNSearchView(APIView):
         return ret
 
 
-class ListCreateBookAPIView(ListCreateAPIView, BookImageCreator):
+class ListCreateBookAPIView(CursorPaginationOptInMixin, ListCreateAPIView, BookImageCreator):
     serializer_class = BookListAddSerializer
     permission_classes = [CustomBasePermission]
     pagination_class = BookPagination
+    cursor_pagination_class = BookCursorPagination
     filter_backends = [filters.OrderingFilter, CustomSearchFilter]
     ordering_fields = '__all__'
     ordering = ['title']
@@ -159,14 +167,21 @@ class ListCreateBookAPIView(ListCreateAPIView, BookImageCreator):
         page = self.paginate_queryset(queryset)
         if page is not None:
             # make a request for the page
-            serializer = self.get_serializer(page, many=True)
+            serializer = self.get_serializer(page, many=True, context=self.get_book_metrics_context(page))
             # data = self.add_remote_book_data(page, serializer.data)
             return self.get_paginated_response(serializer.data)
 
         # make a request for all books in queryset
-        serializer = self.get_serializer(queryset, many=True)
+        books = list(queryset)
+        serializer = self.get_serializer(books, many=True, context=self.get_book_metrics_context(books))
         # data = self.add_remote_book_data(queryset, serializer.data)
         return Response(serializer.data)
+
+    def get_book_metrics_context(self, books):
+        # Compute the derived book fields for all the books at once instead of per book in the serializer
+        context = self.get_serializer_context()
+        context['book_metrics'] = BookMetricsLoader(books)
+        return context
     
     def queryset_to_isbns(self, queryset):
         return [book.isbn_13 for book in queryset]
@@ -231,7 +246,11 @@ class ListCreateBookAPIView(ListCreateAPIView, BookImageCreator):
             serializer = self.get_serializer(data=data)
 
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        book = serializer.save()
+        update_book_search_vectors([book.id])
+        # Adding a book changes the number of related books of its whole related book group
+        refresh_book_metrics([book.id])
+        refresh_related_book_group_metrics([book.related_book_group_id])
 
         res = serializer.data
 
@@ -246,10 +265,11 @@ class ListCreateBookAPIView(ListCreateAPIView, BookImageCreator):
 
     def get_or_create_related_books_group(self, data):
         related_books_list = get_related_isbns(data['isbn_13'])
-        related_books_in_db = Book.objects.filter(isbn_13__in=related_books_list)
-        related_book_group_ids = {related_book_group_obj['related_book_group'] for related_book_group_obj in related_books_in_db.values('related_book_group')}
+        related_books_in_db = Book.objects.filter(isbn_13__in=related_books_list, related_book_group__isnull=False)
+        # Families are identified by the root of their groups
+        related_book_group_ids = set(related_books_in_db.values_list('related_book_group__root', flat=True))
         if len(related_book_group_ids) == 0:  # No existing related books for this new book, so create new group
-            related_book_group_id = RelatedBookGroup.objects.create(title=standardize_title(data['title'])).id
+            related_book_group_id = create_related_book_group(standardize_title(data['title']))
         elif len(related_book_group_ids) == 1:  # One unified related books group for this book, so add this book to the group
             (related_book_group_id,) = related_book_group_ids
         else:  # multiple related book groups, so must combine them first
@@ -280,37 +300,19 @@ class ListCreateBookAPIView(ListCreateAPIView, BookImageCreator):
             return super().paginate_queryset(queryset)
 
     def get_queryset(self):
-        default_query_set = Book.objects.filter(isGhost=False)
+        # The search document is only used for filtering, so it is not loaded
+        default_query_set = Book.objects.filter(isGhost=False).defer('search_vector')
         # Books have a ManyToMany relationship with Author & Genre
         # A book can have many authors and genres.
-        # We need to define sorting behavior for these fields
-        # Annotating creates a single field where we can order the Books by one of the
-        # elements in the ManyToMany relationship
-        default_query_set = default_query_set.annotate(
-            # We create a subquery for getting a query_set of authors which are related to the book in question
-            author=Subquery(
-                Author.objects.filter(
-                    # We filter the authors by the primary key of the book
-                    book=OuterRef('pk')
-                    # Here we order by the name in ascending order and get the first author from the list
-                ).order_by('name').values('name')[:1]  # [:1] is used to avoid index out of bounds error when the filter returns an empty list
-            ))
-
-        default_query_set = default_query_set.annotate(genre=Subquery(Genre.objects.filter(book=OuterRef('pk')).order_by('name').values('name')[:1]))
+        # Sorting by author and genre sorts by the first author and genre in alphabetical order,
+        # which are kept along the other sorting fields in the denormalized BookMetrics table
+        default_query_set = self.annotate_book_metrics(default_query_set)
 
         # Search for books that a specific vendor has sold
         vendor = self.request.GET.get('vendor')
         if vendor is not None:
             default_query_set = default_query_set.filter(id__in=Purchase.objects.all().annotate(vendor_id=F('purchase_order__vendor')).filter(vendor_id=vendor).values('book')).distinct()
 
-        # Support Sorting by best_buyback_price, last_month_sales, shelf_space, days_of_supply
-        # The rationale for replicating the filter in the serializer is that it is the most efficient way to support sorting is using DRF's sorting filter
-        # default_query_set = self.annotate_best_buyback_price(default_query_set)
-        default_query_set = self.annotate_last_month_sales(default_query_set)
-        default_query_set = self.annotate_shelf_space(default_query_set)
-        default_query_set = self.annotate_days_of_supply(default_query_set)
-        default_query_set = self.annotate_num_related_books(default_query_set)
-
         # Filter for a specific genre
         # If a genre exists, the default query_set needs to be filtered by that specific genre
         if genre := self.request.query_params.get('genre'):
@@ -320,59 +322,22 @@ class ListCreateBookAPIView(ListCreateAPIView, BookImageCreator):
 
         return default_query_set
 
-    def annotate_best_buyback_price(self, query_set):
-        pass
-        # subquery = Purchase.objects.filter(book=107).annotate(vendor_id=F('purchase_order__vendor'))
-        # subquery = Purchase.objects.filter(book=OuterRef('pk')).annotate(vendor_id=F('purchase_order__vendor'))
-
-        # subquery = subquery.annotate(buyback_rate=Case(When(purchase_order__vendor__buyback_rate__isnull=False, then=F('purchase_order__vendor__buyback_rate')), default=Value(0)))
+    def annotate_book_metrics(self, query_set):
+        """Support sorting by author, genre, best_buyback_price, last_month_sales, shelf_space, days_of_supply and num_related_books
 
-        # subquery = subquery.order_by('vendor_id', '-purchase_order__date').distinct('vendor_id')
-
-        # results_pk = list(subquery.values_list(flat=True))
-
-        # query_set = query_set.alias(
-        #     testing=subquery
-        # )
-
-        # subquery2 = Purchase.objects.filter(book=OuterRef('pk'), pk__in=results_pk)
-        # subquery = subquery.order_by('vendor_id', '-purchase_order__date')
-
-        # subquery = subquery.values('buyback_rate', 'unit_wholesale_price', 'vendor_id')
-
-        # subquery = subquery.annotate(buyback_price=ExpressionWrapper(Round(F('buyback_rate') * F('unit_wholesale_price') * .01, precision=2), output_field=FloatField())).order_by('-buyback_price').values('buyback_price')[:1]
-
-        # query_set = query_set.annotate(best_buyback_price=subquery2)
-        # return query_set
-
-    def annotate_days_of_supply(self, query_set):
-        query_set = query_set.annotate(
-            days_of_supply=Case(When(last_month_sales=0, then=Value(float('inf'))),
-                                default=ExpressionWrapper(Round(Cast('stock', output_field=FloatField()) * Value(30) / F('last_month_sales'), precision=2), output_field=FloatField())))
-        return query_set
-
-    def annotate_last_month_sales(self, query_set):
-        end_date = datetime.datetime.now().strftime('%Y-%m-%d')
-        start_date = (datetime.datetime.now() - datetime.timedelta(days=30)).strftime('%Y-%m-%d')
-
-        subquery = Sale.objects.filter(book=OuterRef('pk'), sales_reconciliation__date__range=(start_date, end_date)).values_list(Coalesce(Func(
-            'quantity',
-            function='SUM',
-        ), 0),)
-
-        query_set = query_set.annotate(last_month_sales=subquery)
-        return query_set
-
-    def annotate_shelf_space(self, query_set):
-        default_thickness = 0.8
-
-        query_set = query_set.annotate(null_defaulted_thickness=Case(When(thickness__isnull=False, then=F('thickness')), default=Value(default_thickness)))
-
-        return query_set.annotate(shelf_space=F('null_defaulted_thickness') * F('stock'))
-
-    def annotate_num_related_books(self, query_set):
-        query_set = query_set.annotate(num_related_books=Count('related_book_group__related_books') - 1)
-        return query_set
+        The values are read from the indexed BookMetrics table instead of being computed per request,
+        so that sorting by any of them does not need to compute them for the whole catalog.
+        Books without a BookMetrics row sort with the default metrics.
+        """
+        return query_set.annotate(
+            author=F('metrics__author'),
+            genre=F('metrics__genre'),
+            best_buyback_price=F('metrics__best_buyback_price'),
+            last_month_sales=Coalesce(F('metrics__last_month_sales'), 0),
+            shelf_space=Coalesce(F('metrics__shelf_space'), 0.0),
+            days_of_supply=Coalesce(F('metrics__days_of_supply'), float('inf')),
+            num_related_books=Coalesce(F('metrics__num_related_books'), 0),
+        )
 
 
 class RetrieveUpdateDestroyBookAPIView(RetrieveUpdateDestroyAPIView, BookImageCreator):
@@ -414,6 +379,8 @@ class RetrieveUpdateDestroyBookAPIView(RetrieveUpdateDestroyAPIView, BookImageCr
         serializer = self.get_serializer(instance, data=data, partial=partial)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
+        update_book_search_vectors([instance.id])
+        refresh_book_metrics([instance.id])
 
         if getattr(instance, '_prefetched_objects_cache', None):
             # If 'prefetch_related' has been applied to a queryset, we need to
@@ -454,10 +421,13 @@ class RetrieveUpdateDestroyBookAPIView(RetrieveUpdateDestroyAPIView, BookImageCr
 
         # If book can be destroyed, we just make the isGhost=True and do not delete in database. Then remove it from the related book group
         partial = True
+        previous_related_book_group_id = instance.related_book_group_id
         data = {"isGhost": True, "related_book_group": None}
         serializer = self.get_serializer(instance, data=data, partial=partial)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        refresh_book_metrics([instance.id])
+        refresh_related_book_group_metrics([previous_related_book_group_id])
 
         return Response({"status": f"Book: {instance.title}(id:{instance.id}) is now a ghost"}, status=status.HTTP_204_NO_CONTENT)
 
@@ -495,12 +465,19 @@ class CreateBookInventoryCorrectionAPIView(CreateAPIView):
 
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
 
-        # Increment Book Stock Count
-        book = Book.objects.get(id=book_id)
-        book.stock += adjustment
-        book.save()
+        with transaction.atomic():
+            # The book row is locked like on every other stock write, so that no concurrent change of the stock is lost
+            book = lock_books([book_id])[int(book_id)]
+            # The stock may have changed since the adjustment was validated
+            if book.stock + adjustment < 0:
+                raise InventoryAdjustmentBelowZeroException(adjustment, book.stock)
+
+            serializer.save()
+            # Increment Book Stock Count
+            apply_stock_changes({book.id: adjustment})
+
+        refresh_book_metrics([book.id])
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -18,7 +18,10 @@ class Buyback(models.Model):
     buyback_order = models.ForeignKey(BuybackOrder, related_name='buybacks', on_delete=models.CASCADE)
     revenue = models.FloatField()
 
-    def save(self, *args, **kwargs):
+    def calculate_revenue(self):
         self.revenue = round(self.quantity * self.unit_buyback_price, 2)
         self.unit_buyback_price = round(self.unit_buyback_price, 2)
+
+    def save(self, *args, **kwargs):
+        self.calculate_revenue()
         super(Buyback, self).save(*args, **kwargs)
@@ -1,6 +1,12 @@
-from utils.paginations import HTTPSNoPortPagination
+from utils.paginations import HTTPSNoPortPagination, HTTPSNoPortCursorPagination
 
 
 class BuybackPagination(HTTPSNoPortPagination):
     page_size = 10
-    page_size_query_param = 'page_size'
\ No newline at end of file
+    page_size_query_param = 'page_size'
+
+
+class BuybackCursorPagination(HTTPSNoPortCursorPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    cursor_ordering_fields = ['date', 'total_revenue', 'num_books', 'num_unique_books', 'id']
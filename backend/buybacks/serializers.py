@@ -28,12 +28,7 @@ class BuybackOrderSerializer(TransactionGroupBaseSerializer):
 
     def get_is_deletable(self, instance):
         # only way you can't delete is a buyback is if the book is ghost
-        buybacks_to_delete = Buyback.objects.filter(buyback_order=instance.id)
-        for buyback in buybacks_to_delete:
-            book_to_remove_buyback = Book.objects.filter(id=buyback.book.id).get()
-            if (book_to_remove_buyback.isGhost):
-                return False
-        return True
+        return not any(buyback.book.isGhost for buyback in self.get_transactions(instance))
 
     def get_price_name(self) -> str:
         return "unit_buyback_price"
@@ -57,9 +52,6 @@ class BuybackOrderSerializer(TransactionGroupBaseSerializer):
     def get_total_revenue(self, instance):
         return super().get_total_of_transactions(instance)
 
-    def update_transaction(self, instance, transaction_data, transaction_id) -> None:
-        self.__update_buyback(instance, transaction_data, transaction_id)
-
     def get_vendor_name(self, instance):
         return instance.vendor.name
 
@@ -98,10 +90,3 @@ class BuybackOrderSerializer(TransactionGroupBaseSerializer):
         instance.date = validated_data.get('date', instance.date)
         instance.vendor = validated_data.get('vendor', instance.vendor)
         instance.save()
-
-    def __update_buyback(self, instance, buyback_data, buyback_id):
-        buyback = Buyback.objects.get(id=buyback_id, buyback_order=instance)
-        buyback.book = buyback_data.get('book', buyback.book)
-        buyback.quantity = buyback_data.get('quantity', buyback.quantity)
-        buyback.unit_buyback_price = buyback_data.get('unit_buyback_price', buyback.unit_buyback_price)
-        buyback.save()
\ No newline at end of file
@@ -1,6 +1,8 @@
 import datetime, pytz
 from datetime import datetime
-from django.db.models import Sum, OuterRef, Subquery, Func, Count, F
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Func, Count, F, Prefetch
+from django.db.models.functions import Coalesce
 
 from rest_framework import status, filters
 from rest_framework.permissions import IsAuthenticated
@@ -9,19 +11,22 @@ from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
 
-from books.models import Book
 from helpers.csv_reader import CSVReader
+from helpers.stock import apply_stock_changes, get_book_quantities, lock_books, lock_transaction_group
+from helpers.transaction_hooks import handle_transactions_changed
 from utils.permissions import CustomBasePermission
+from utils.paginations import CursorPaginationOptInMixin
 
-from .paginations import BuybackPagination
+from .paginations import BuybackPagination, BuybackCursorPagination
 from .models import Buyback, BuybackOrder
 from .serializers import BuybackOrderSerializer
 
-class ListCreateBuybackAPIView(ListCreateAPIView):
+class ListCreateBuybackAPIView(CursorPaginationOptInMixin, ListCreateAPIView):
     permission_classes = [CustomBasePermission]
     serializer_class = BuybackOrderSerializer
     queryset = BuybackOrder.objects.all()
     pagination_class = BuybackPagination
+    cursor_pagination_class = BuybackCursorPagination
     filter_backends = [filters.OrderingFilter, filters.SearchFilter]
     ordering_fields = '__all__'
     ordering = ['-date']
@@ -45,7 +50,8 @@ class ListCreateBuybackAPIView(ListCreateAPIView):
         return Response(response_data, status=status.HTTP_201_CREATED)
 
     def get_queryset(self):
-        default_query_set = BuybackOrder.objects.all()
+        # The transactions and their books are loaded in one query per page rather than per transaction group
+        default_query_set = BuybackOrder.objects.select_related('user', 'vendor').prefetch_related(Prefetch('buybacks', queryset=Buyback.objects.select_related('book')))
 
         # Create a subquery to aggregate the 'revenue' value for each buyback in BuybackOrder
         revenue_subquery = Buyback.objects.filter(buyback_order=OuterRef('id')).values_list(Func(
@@ -53,12 +59,13 @@ class ListCreateBuybackAPIView(ListCreateAPIView):
             function='SUM',
         ),)
 
-        default_query_set = default_query_set.annotate(total_revenue=Subquery(revenue_subquery))
+        # Totals are never NULL, so that they can be cursor pagination keys
+        default_query_set = default_query_set.annotate(total_revenue=Coalesce(Subquery(revenue_subquery), 0.0))
 
         # Filter by quantity of books in BuybackOrder
         num_books_subquery = Buyback.objects.filter(buyback_order=OuterRef('id')).values_list(Func('quantity', function='SUM'),)
 
-        default_query_set = default_query_set.annotate(num_books=Subquery(num_books_subquery))
+        default_query_set = default_query_set.annotate(num_books=Coalesce(Subquery(num_books_subquery), 0))
 
         default_query_set = default_query_set.annotate(num_unique_books=Count('buybacks__book', distinct=True))
 
@@ -139,7 +146,7 @@ class RetrieveUpdateDestroyBuybackAPIView(RetrieveUpdateDestroyAPIView):
     pagination_class = BuybackPagination
 
     def get_queryset(self):
-        return BuybackOrder.objects.filter(id=self.kwargs['id'])
+        return BuybackOrder.objects.select_related('user', 'vendor').prefetch_related(Prefetch('buybacks', queryset=Buyback.objects.select_related('book'))).filter(id=self.kwargs['id'])
 
     def retrieve(self, request, *args, **kwargs):
         invalid_id_response = self.verify_existance()
@@ -158,6 +165,8 @@ class RetrieveUpdateDestroyBuybackAPIView(RetrieveUpdateDestroyAPIView):
         serializer = self.get_serializer(buyback_order, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        # The prefetched transactions no longer match the updated ones
+        buyback_order._prefetched_objects_cache = {}
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def verify_existance(self):
@@ -166,12 +175,16 @@ class RetrieveUpdateDestroyBuybackAPIView(RetrieveUpdateDestroyAPIView):
         return None
 
     def destroy(self, request, *args, **kwargs):
-        buyback_book_quantities = Buyback.objects.filter(buyback_order=self.get_object().id).values('book').annotate(num_books=Sum('quantity')).values('book', 'num_books')
-        for buyback_book_quantity in buyback_book_quantities:
-            book_to_remove_buyback = Book.objects.filter(id=buyback_book_quantity['book']).get()
-            book_to_remove_buyback.stock += buyback_book_quantity['num_books']
-            book_to_remove_buyback.save()
-        return super().destroy(request, *args, **kwargs)
+        instance = self.get_object()
+        with transaction.atomic():
+            lock_transaction_group(instance)
+            buyback_book_quantities = get_book_quantities(Buyback.objects.filter(buyback_order=instance.id))
+            lock_books(buyback_book_quantities.keys())
+            # The bought back books go back in stock
+            apply_stock_changes(buyback_book_quantities)
+            response = super().destroy(request, *args, **kwargs)
+        handle_transactions_changed(buyback_book_quantities.keys(), [instance.date])
+        return response
 
 
 class CSVBuybackAPIView(APIView):
@@ -0,0 +1,132 @@
+import hashlib, os, environ, tempfile, threading
+from concurrent.futures import wait
+
+import requests
+
+from books.executors import remote_source_executor
+
+IMAGE_DOWNLOAD_TIMEOUT_SECONDS = 10
+# Same limit as the book image pipeline, larger images are never cached
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+IMAGE_DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+class PlanogramImageCache:
+    """Resolves book image urls to local files for the planogram generator
+
+    Images served by our own image host are read straight from the local media directory.
+    Other images are downloaded once into a bounded on-disk cache, evicting the least
+    recently used files when it grows past its size limit.
+    """
+    _eviction_lock = threading.Lock()
+
+    def __init__(self,):
+        env = environ.Env()
+        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        environ.Env.read_env(os.path.join(BASE_DIR, '.env'))
+
+        self._internal_book_image_absolute_path = env('INTERNAL_BOOK_IMAGE_ABSOLUTE_PATH')
+        self._internal_image_base_url = f"https://{env('HOST_NAME')}{env('INTERNAL_BOOK_IMAGE_URL_PATH')}/"
+        self._default_image_path = os.path.join(self._internal_book_image_absolute_path, env('DEFAULT_IMAGE_NAME'))
+        self._cache_path = env.str('PLANOGRAM_IMAGE_CACHE_PATH', default=os.path.join(tempfile.gettempdir(), 'planogram_image_cache'))
+        self._cache_max_bytes = env.int('PLANOGRAM_IMAGE_CACHE_MAX_BYTES', default=200 * 1024 * 1024)
+        os.makedirs(self._cache_path, exist_ok=True)
+
+    def get_default_image_url(self):
+        return self._internal_image_base_url + os.path.basename(self._default_image_path)
+
+    def get_local_media_path(self, url):
+        if not url.startswith(self._internal_image_base_url):
+            return None
+        media_root = os.path.realpath(self._internal_book_image_absolute_path)
+        path = os.path.realpath(os.path.join(media_root, url[len(self._internal_image_base_url):].split('?')[0]))
+        # Image urls come from users, so they must not reach outside of the media directory, e.g. with '..'
+        if os.path.commonpath([media_root, path]) != media_root:
+            return None
+        return path if os.path.isfile(path) else None
+
+    def get_cache_file_path(self, url):
+        return os.path.join(self._cache_path, hashlib.sha256(url.encode()).hexdigest())
+
+    def get_cached_path(self, url):
+        path = self.get_cache_file_path(url)
+        if not os.path.isfile(path):
+            return None
+        # The modification time is the recency used for eviction
+        os.utime(path)
+        return path
+
+    def download(self, url):
+        """Downloads the image into the cache and returns its path, raises ImageTooLarge past MAX_IMAGE_BYTES"""
+        path = self.get_cache_file_path(url)
+        # Written under a temporary name so that readers never see a partial file
+        fd, temporary_path = tempfile.mkstemp(dir=self._cache_path)
+        try:
+            with os.fdopen(fd, 'wb') as cache_file, requests.get(url, timeout=IMAGE_DOWNLOAD_TIMEOUT_SECONDS, stream=True) as resp:
+                resp.raise_for_status()
+                if int(resp.headers.get('Content-Length') or 0) > MAX_IMAGE_BYTES:
+                    raise ImageTooLarge(url)
+
+                # The body is read in chunks, so that a response without or with a wrong Content-Length is cut at the limit
+                num_bytes = 0
+                for chunk in resp.iter_content(IMAGE_DOWNLOAD_CHUNK_BYTES):
+                    num_bytes += len(chunk)
+                    if num_bytes > MAX_IMAGE_BYTES:
+                        raise ImageTooLarge(url)
+                    cache_file.write(chunk)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+        os.replace(temporary_path, path)
+
+        self.evict()
+        return path
+
+    def evict(self):
+        with self._eviction_lock:
+            entries = []
+            for entry in os.scandir(self._cache_path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_bytes <= self._cache_max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+
+    def get_path(self, url):
+        return self.get_local_media_path(url) or self.get_cached_path(url)
+
+    def fetch_all(self, urls):
+        """Returns {url: local file path} for the given urls, downloading the missing ones concurrently
+
+        Urls that could not be downloaded are mapped to the default image, if it exists.
+        """
+        paths = {}
+        missing_urls = []
+        for url in set(urls):
+            if path := self.get_path(url):
+                paths[url] = path
+            else:
+                missing_urls.append(url)
+
+        downloads = {url: remote_source_executor.submit(self.download, url) for url in missing_urls}
+        wait(downloads.values())
+
+        default_image_path = self._default_image_path if os.path.isfile(self._default_image_path) else None
+        for url, download in downloads.items():
+            paths[url] = default_image_path if download.exception() else download.result()
+
+        return paths
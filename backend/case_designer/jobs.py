@@ -0,0 +1,89 @@
+import datetime, multiprocessing, os, environ
+from concurrent.futures import ProcessPoolExecutor
+
+from django.utils import timezone
+
+from books.executors import closes_db_connection
+
+from .models import Bookcase, PlanogramJob, Shelf
+from .pdf_cache import PlanogramPDFCache
+from .planogram import PlanogramGenerator
+
+env = environ.Env()
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+environ.Env.read_env(os.path.join(BASE_DIR, '.env'))
+
+# Maximum number of planograms rendered at the same time by each API worker process. The pool is not
+# shared between processes, so e.g. 2 gunicorn workers render up to 2 * PLANOGRAM_WORKERS planograms at once.
+PLANOGRAM_WORKERS = env.int('PLANOGRAM_WORKERS', default=2)
+# Unfinished jobs are updated on every rendered shelf, jobs not updated for this long lost their worker
+# process, e.g. to a restart of the API worker owning the pool, and are failed
+PLANOGRAM_JOB_TIMEOUT = datetime.timedelta(minutes=10)
+
+_executor = None
+
+
+def _init_worker():
+    # Worker processes are spawned, not forked, so they set Django up from scratch and share no connections
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hypothetical_books_backend.settings')
+    import django
+    django.setup()
+
+
+def get_planogram_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PLANOGRAM_WORKERS, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker)
+    return _executor
+
+
+def render_planogram_job(job_id):
+    """Runs in a worker process, renders the planogram of the job into the PDF cache"""
+    job = PlanogramJob.objects.select_related('bookcase').get(id=job_id)
+    total_shelves = Shelf.objects.filter(bookcase=job.bookcase).count()
+    # update() does not set auto_now fields, so updated_at is set explicitly: it is the heartbeat of the job
+    PlanogramJob.objects.filter(id=job_id).update(status='running', total_shelves=total_shelves, updated_at=timezone.now())
+
+    def on_shelf_complete(completed_shelves):
+        PlanogramJob.objects.filter(id=job_id).update(completed_shelves=completed_shelves, updated_at=timezone.now())
+
+    try:
+        planogram_generator = PlanogramGenerator(job.bookcase, on_shelf_complete=on_shelf_complete)
+        pdf_path = PlanogramPDFCache().store(job.bookcase.id, job.cache_key, planogram_generator.build_pdf)
+    except Exception as e:
+        PlanogramJob.objects.filter(id=job_id).update(status='failed', error=f'{e}', updated_at=timezone.now())
+        return
+
+    PlanogramJob.objects.filter(id=job_id).update(status='done', pdf_path=pdf_path, completed_shelves=total_shelves, updated_at=timezone.now())
+
+
+def _on_job_finished(job_id, future):
+    # Failures of the pool itself, e.g. a crashed worker process, never reach render_planogram_job
+    if (e := future.exception()) is not None:
+        PlanogramJob.objects.filter(id=job_id).exclude(status='done').update(status='failed', error=f'{e}', updated_at=timezone.now())
+
+
+def fail_stale_planogram_jobs(jobs):
+    """Fails the unfinished jobs among the given ones that were not updated within PLANOGRAM_JOB_TIMEOUT"""
+    jobs.filter(status__in=['pending', 'running'], updated_at__lt=timezone.now() - PLANOGRAM_JOB_TIMEOUT).update(
+        status='failed', error='The planogram job timed out, its worker process stopped', updated_at=timezone.now())
+
+
+def submit_planogram_job(bookcase: Bookcase, pdf_cache: PlanogramPDFCache):
+    """Returns a job rendering the current revision of the bookcase, reusing cached PDFs and unfinished jobs"""
+    cache_key = pdf_cache.get_cache_key(bookcase)
+
+    if pdf_path := pdf_cache.get(bookcase.id, cache_key):
+        total_shelves = Shelf.objects.filter(bookcase=bookcase).count()
+        return PlanogramJob.objects.create(bookcase=bookcase, cache_key=cache_key, status='done', pdf_path=pdf_path, total_shelves=total_shelves, completed_shelves=total_shelves)
+
+    # A stale job is never reused, so the revision is rendered again by a new job
+    fail_stale_planogram_jobs(PlanogramJob.objects.filter(bookcase=bookcase, cache_key=cache_key))
+    unfinished_job = PlanogramJob.objects.filter(bookcase=bookcase, cache_key=cache_key, status__in=['pending', 'running']).order_by('-id').first()
+    if unfinished_job is not None:
+        return unfinished_job
+
+    job = PlanogramJob.objects.create(bookcase=bookcase, cache_key=cache_key)
+    future = get_planogram_executor().submit(render_planogram_job, job.id)
+    future.add_done_callback(lambda future: closes_db_connection(_on_job_finished)(job.id, future))
+    return job
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('case_designer', '0007_alter_bookcase_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanogramJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cache_key', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('total_shelves', models.PositiveIntegerField(default=0)),
+                ('completed_shelves', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default=None, null=True)),
+                ('pdf_path', models.CharField(blank=True, default=None, max_length=500, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('bookcase', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='planogram_jobs', to='case_designer.bookcase')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='planogramjob',
+            index=models.Index(fields=['bookcase', 'cache_key'], name='planogram_job_revision_idx'),
+        ),
+    ]
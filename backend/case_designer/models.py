@@ -23,4 +23,31 @@ class DisplayedBook(models.Model):
     book=models.ForeignKey(Book, on_delete=models.CASCADE)
     display_mode=models.CharField(max_length=50, choices=DISPLAY_MODE_CHOICES)
     display_count=models.PositiveIntegerField()
-    display_order=models.PositiveIntegerField()
\ No newline at end of file
+    display_order=models.PositiveIntegerField()
+
+
+PLANOGRAM_JOB_STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+]
+
+
+class PlanogramJob(models.Model):
+    """Planogram rendered asynchronously by case_designer.jobs"""
+    bookcase=models.ForeignKey(Bookcase, related_name="planogram_jobs", on_delete=models.CASCADE)
+    # Revision of the bookcase being rendered, see case_designer.pdf_cache
+    cache_key=models.CharField(max_length=64)
+    status=models.CharField(max_length=10, choices=PLANOGRAM_JOB_STATUS_CHOICES, default='pending')
+    total_shelves=models.PositiveIntegerField(default=0)
+    completed_shelves=models.PositiveIntegerField(default=0)
+    error=models.TextField(default=None, null=True, blank=True)
+    pdf_path=models.CharField(max_length=500, default=None, null=True, blank=True)
+    created_at=models.DateTimeField(auto_now_add=True)
+    updated_at=models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bookcase', 'cache_key'], name='planogram_job_revision_idx'),
+        ]
@@ -0,0 +1,83 @@
+import datetime, glob, hashlib, json, os, environ, tempfile
+
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from books.models import Book
+from .models import Bookcase, DisplayedBook, PlanogramJob
+
+# PDFs of finished planogram jobs stay downloadable for this long after the bookcase changes
+PLANOGRAM_JOB_PDF_RETENTION = datetime.timedelta(hours=1)
+
+
+class PlanogramPDFCache:
+    """On-disk cache of generated planogram PDFs
+
+    A cached PDF is keyed by its bookcase id, the bookcase's last edit date and a digest of
+    every piece of book data printed on it, so any change to them yields a new key. The
+    invalidate methods delete the PDFs that can no longer be served, except the ones that
+    finished planogram jobs still reference, which are kept for PLANOGRAM_JOB_PDF_RETENTION.
+    """
+
+    def __init__(self,):
+        env = environ.Env()
+        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        environ.Env.read_env(os.path.join(BASE_DIR, '.env'))
+
+        self._cache_path = env.str('PLANOGRAM_PDF_CACHE_PATH', default=os.path.join(tempfile.gettempdir(), 'planogram_pdf_cache'))
+        os.makedirs(self._cache_path, exist_ok=True)
+
+    def get_cache_key(self, bookcase: Bookcase):
+        displayed_books = DisplayedBook.objects.filter(shelf__bookcase=bookcase).order_by('shelf__shelf_order', 'display_order', 'id')
+        displayed_books = list(
+            displayed_books.values_list('shelf__shelf_order', 'book', 'display_mode', 'display_count', 'book__title', 'book__isbn_13',
+                                        Coalesce(F('book__image_url__planogram_url'), F('book__image_url__image_url'))))
+        authors = list(
+            Book.authors.through.objects.filter(book__in={displayed_book[1] for displayed_book in displayed_books}).order_by('book', 'author__name').values_list(
+                'book', 'author__name'))
+
+        digest = hashlib.sha256(json.dumps([bookcase.name, displayed_books, authors]).encode()).hexdigest()
+        return hashlib.sha256(f'{bookcase.id}:{bookcase.last_edit_date.isoformat()}:{digest}'.encode()).hexdigest()
+
+    def get_file_path(self, bookcase_id, cache_key):
+        return os.path.join(self._cache_path, f'{bookcase_id}-{cache_key}.pdf')
+
+    def get(self, bookcase_id, cache_key):
+        path = self.get_file_path(bookcase_id, cache_key)
+        return path if os.path.isfile(path) else None
+
+    def store(self, bookcase_id, cache_key, build_pdf):
+        """Writes the PDF built by build_pdf(file) to the cache, replacing the older PDFs of the bookcase"""
+        self.invalidate_bookcases([bookcase_id])
+
+        # Written under a temporary name so that readers never see a partial file
+        fd, temporary_path = tempfile.mkstemp(dir=self._cache_path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as pdf_file:
+            build_pdf(pdf_file)
+
+        path = self.get_file_path(bookcase_id, cache_key)
+        os.replace(temporary_path, path)
+        return path
+
+    def invalidate_bookcases(self, bookcase_ids):
+        bookcase_ids = set(bookcase_ids)
+        retained_paths = self.get_retained_job_paths(bookcase_ids)
+
+        for bookcase_id in bookcase_ids:
+            for path in glob.glob(os.path.join(self._cache_path, f'{bookcase_id}-*.pdf')):
+                if path in retained_paths:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def get_retained_job_paths(self, bookcase_ids):
+        """Paths of the PDFs referenced by jobs that finished within PLANOGRAM_JOB_PDF_RETENTION"""
+        retained_since = timezone.now() - PLANOGRAM_JOB_PDF_RETENTION
+        return set(PlanogramJob.objects.filter(bookcase__in=bookcase_ids, status='done', updated_at__gte=retained_since).values_list('pdf_path', flat=True))
+
+    def invalidate_books(self, book_ids):
+        """Invalidates the PDFs of every bookcase displaying any of the given books"""
+        self.invalidate_bookcases(DisplayedBook.objects.filter(book__in=book_ids).values_list('shelf__bookcase', flat=True).distinct())
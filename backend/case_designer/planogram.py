@@ -1,10 +1,10 @@
-import io
 from django.http import HttpResponse
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Image, Spacer, PageBreak
-import requests
 from reportlab.lib.styles import ParagraphStyle
 
+from books.models import BookImage
+from .image_cache import PlanogramImageCache
 from .models import Bookcase
 
 class PlanogramGenerator:
@@ -34,19 +34,42 @@ class PlanogramGenerator:
     # Used for creating vertical space between document elements
     default_spacer = Spacer(300, 20)
 
-    def __init__(self, bookcase: Bookcase) -> None:
+    def __init__(self, bookcase: Bookcase, on_shelf_complete=None) -> None:
         self.bookcase = bookcase
-        self.shelves = bookcase.shelves.all()
+        # Called with the number of completed shelves as the layout tables are built
+        self.on_shelf_complete = on_shelf_complete
+        self.shelves = bookcase.shelves.prefetch_related('displayed_books__book__authors', 'displayed_books__book__image_url')
+        self.image_cache = PlanogramImageCache()
+        self.image_paths = self.load_book_image_paths()
+
+    def load_book_image_paths(self):
+        """Returns {book id: local image file} for every displayed book, fetching each image once"""
+        book_image_urls = {}
+        for shelf in self.shelves:
+            for display_book in shelf.displayed_books.all():
+                book_image_urls[display_book.book.id] = self.get_book_image_url(display_book.book)
+
+        paths = self.image_cache.fetch_all(book_image_urls.values())
+        return {book_id: paths.get(url) for book_id, url in book_image_urls.items()}
+
+    def get_book_image_url(self, book):
+        try:
+            return book.image_url.get_planogram_url()
+        except BookImage.DoesNotExist:
+            return self.image_cache.get_default_image_url()
 
     def generate_planogram(self):
         response = HttpResponse(
             content_type='application/pdf',
             headers={'Content-Disposition': 'attachment; filename="planogram.pdf"'}
         )
-        doc = SimpleDocTemplate(response)
-        doc.build(self.create_document_elements()) 
+        self.build_pdf(response)
         return response
 
+    def build_pdf(self, file):
+        doc = SimpleDocTemplate(file)
+        doc.build(self.create_document_elements())
+
     def create_document_elements(self):
         elements = []
         elements.extend(self.create_bookcase_info())
@@ -78,7 +101,7 @@ class PlanogramGenerator:
         return [*display_books_dict.values()]
 
     def create_display_book_row(self, display_book):
-        authors = ", ".join(list(display_book.book.authors.all().values_list('name', flat=True)))
+        authors = ", ".join([author.name for author in display_book.book.authors.all()])
         img = self.get_display_book_image(display_book)
         return [img, Paragraph(display_book.book.title), Paragraph(authors), display_book.book.isbn_13, display_book.display_count]
 
@@ -89,6 +112,8 @@ class PlanogramGenerator:
         tables = []
         for idx, shelf in enumerate(self.shelves):
             tables.extend(self.create_shelf_layout_table_and_headers(shelf, idx+1))
+            if self.on_shelf_complete:
+                self.on_shelf_complete(idx+1)
         headers = [Paragraph("Bookcase Shelves", style=self.header_style),
                              Paragraph("""*Each table shows a shelf on the bookcase
                              with the books organized from left to right""",
@@ -108,7 +133,10 @@ class PlanogramGenerator:
         return (img, Paragraph(display_book.book.title), display_book.display_count, display_book.display_mode)
         
     def get_display_book_image(self, display_book):
-        resp = requests.get(display_book.book.image_url)
-        img = Image(io.BytesIO(resp.content))
+        path = self.image_paths.get(display_book.book.id)
+        if path is None:
+            return ""
+        # Images drawn from the same file are embedded once in the PDF, however many tables show them
+        img = Image(path)
         img._restrictSize(50, 50)
         return img
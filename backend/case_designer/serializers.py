@@ -2,7 +2,7 @@ from rest_framework import serializers
 from authapp.models import User
 from books.models import Book, BookImage
 
-from .models import Bookcase, Shelf, DisplayedBook
+from .models import Bookcase, Shelf, DisplayedBook, PlanogramJob
 
 class DisplayedBookSerializer(serializers.ModelSerializer):
     book = serializers.PrimaryKeyRelatedField(queryset=Book.objects.all())
@@ -22,7 +22,7 @@ class DisplayedBookSerializer(serializers.ModelSerializer):
         return instance.book.title
 
     def get_book_url(self, instance):
-        return BookImage.objects.get(book=instance.book).image_url
+        return BookImage.objects.get(book=instance.book).get_planogram_url()
     
     def get_book_stock(self, instance):
         return instance.book.stock
@@ -124,4 +124,10 @@ class BookcaseSerializer(serializers.ModelSerializer):
             for idx, book in enumerate(shelf['displayed_books']):
                 book['book'] = book['book'].id
 
-    
\ No newline at end of file
+
+class PlanogramJobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = PlanogramJob
+        fields = ['id', 'bookcase', 'status', 'total_shelves', 'completed_shelves', 'error', 'created_at', 'updated_at']
+        read_only_fields = fields
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from .views import ListCreateBookcaseAPIView, RetrieveUpdateDestroyBookcaseAPIView, PlanogramPDFView
+from .views import ListCreateBookcaseAPIView, RetrieveUpdateDestroyBookcaseAPIView, PlanogramPDFView, PlanogramJobCreateView, PlanogramJobView, PlanogramJobPDFView
 
 app_name = 'case_designer'
 
@@ -8,4 +8,7 @@ urlpatterns = [
     path('', ListCreateBookcaseAPIView.as_view()),
     path('/<id>', RetrieveUpdateDestroyBookcaseAPIView.as_view()),
     path('/planogram/<id>', PlanogramPDFView.as_view()),
+    path('/planogram/<id>/jobs', PlanogramJobCreateView.as_view()),
+    path('/planogram/jobs/<job_id>', PlanogramJobView.as_view()),
+    path('/planogram/jobs/<job_id>/pdf', PlanogramJobPDFView.as_view()),
 ]
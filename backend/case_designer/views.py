@@ -4,14 +4,28 @@ from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIV
 from rest_framework.response import Response
 from rest_framework import status, filters
 
+import os, time
+
+from django.http import FileResponse, HttpResponseNotModified
+from rest_framework.exceptions import NotFound
+
 from .planogram import PlanogramGenerator
-from .models import Bookcase
+from .pdf_cache import PlanogramPDFCache
+from .jobs import fail_stale_planogram_jobs, submit_planogram_job
+from .models import Bookcase, PlanogramJob
 from .paginations import BookcasePagination
-from .serializers import BookcaseSerializer
+from .serializers import BookcaseSerializer, PlanogramJobSerializer
 from rest_framework.views import APIView
 from utils.permissions import CustomBasePermission
 
 
+# Long polls of planogram jobs are capped so that they never hold a sync API worker for long,
+# unfinished jobs tell the client when to poll again instead
+PLANOGRAM_JOB_MAX_WAIT_SECONDS = 2
+PLANOGRAM_JOB_POLL_INTERVAL_SECONDS = 0.5
+PLANOGRAM_JOB_RETRY_AFTER_SECONDS = 2
+
+
 class ListCreateBookcaseAPIView(ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = BookcaseSerializer
@@ -47,6 +61,7 @@ class RetrieveUpdateDestroyBookcaseAPIView(RetrieveUpdateDestroyAPIView):
     serializer_class = BookcaseSerializer
     lookup_field = 'id'
     pagination_class = BookcasePagination
+    pdf_cache = PlanogramPDFCache()
 
     def get_queryset(self):
         return Bookcase.objects.filter(id=self.kwargs['id'])
@@ -74,14 +89,101 @@ class RetrieveUpdateDestroyBookcaseAPIView(RetrieveUpdateDestroyAPIView):
         serializer = self.get_serializer(bookcase, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        self.pdf_cache.invalidate_bookcases([bookcase.id])
         return Response(serializer.data, status=status.HTTP_200_OK)
-    
+
     # the default destroy method is used for deleting a bookcase
+    def perform_destroy(self, instance):
+        bookcase_id = instance.id
+        super().perform_destroy(instance)
+        self.pdf_cache.invalidate_bookcases([bookcase_id])
 
 class PlanogramPDFView(APIView):
     permission_classes = [CustomBasePermission]
+    pdf_cache = PlanogramPDFCache()
 
     def get(self, request, *args, **kwargs):
         bookcase = Bookcase.objects.get(id=self.kwargs['id'])
-        planogram_generator = PlanogramGenerator(bookcase)
-        return planogram_generator.generate_planogram()
\ No newline at end of file
+        cache_key = self.pdf_cache.get_cache_key(bookcase)
+        etag = f'"{cache_key}"'
+
+        # The client already has this revision of the planogram
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            return HttpResponseNotModified(headers={'ETag': etag})
+
+        # Only generate the planogram if it is not cached yet
+        path = self.pdf_cache.get(bookcase.id, cache_key)
+        if path is None:
+            planogram_generator = PlanogramGenerator(bookcase)
+            path = self.pdf_cache.store(bookcase.id, cache_key, planogram_generator.build_pdf)
+
+        response = FileResponse(open(path, 'rb'), as_attachment=True, filename='planogram.pdf', content_type='application/pdf')
+        response['ETag'] = etag
+        return response
+
+
+class PlanogramJobCreateView(APIView):
+    """
+    Submits the rendering of a planogram to the planogram worker processes
+
+    * Returns the job, whose status can be polled with PlanogramJobView
+    * Each API worker process has its own pool of PLANOGRAM_WORKERS render processes, the cap is not global
+    """
+    permission_classes = [CustomBasePermission]
+    pdf_cache = PlanogramPDFCache()
+
+    def post(self, request, *args, **kwargs):
+        bookcase = Bookcase.objects.get(id=self.kwargs['id'])
+        job = submit_planogram_job(bookcase, self.pdf_cache)
+        return Response(PlanogramJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class PlanogramJobView(APIView):
+    """
+    Status and progress of a planogram job
+
+    * With the 'wait' query param (in seconds, at most PLANOGRAM_JOB_MAX_WAIT_SECONDS), waits until the job is finished or the time is up
+    * Unfinished jobs are returned with a Retry-After header
+    """
+    permission_classes = [CustomBasePermission]
+
+    def get(self, request, *args, **kwargs):
+        job = self.get_job()
+        try:
+            wait_seconds = min(float(request.query_params.get('wait', 0)), PLANOGRAM_JOB_MAX_WAIT_SECONDS)
+        except ValueError:
+            wait_seconds = 0
+        deadline = time.monotonic() + wait_seconds
+
+        while job.status in ['pending', 'running'] and time.monotonic() < deadline:
+            time.sleep(PLANOGRAM_JOB_POLL_INTERVAL_SECONDS)
+            job.refresh_from_db()
+
+        response = Response(PlanogramJobSerializer(job).data, status=status.HTTP_200_OK)
+        if job.status in ['pending', 'running']:
+            response['Retry-After'] = PLANOGRAM_JOB_RETRY_AFTER_SECONDS
+        return response
+
+    def get_job(self):
+        # Jobs whose worker process stopped would otherwise stay unfinished forever
+        fail_stale_planogram_jobs(PlanogramJob.objects.filter(id=self.kwargs['job_id']))
+        try:
+            return PlanogramJob.objects.get(id=self.kwargs['job_id'])
+        except PlanogramJob.DoesNotExist:
+            raise NotFound("No planogram job with queried id.")
+
+
+class PlanogramJobPDFView(PlanogramJobView):
+    """
+    PDF of a finished planogram job
+    """
+
+    def get(self, request, *args, **kwargs):
+        job = self.get_job()
+
+        if job.status != 'done' or not os.path.isfile(job.pdf_path):
+            return Response({"error": f"Planogram job {job.id} has no PDF, its status is {job.status}"}, status=status.HTTP_409_CONFLICT)
+
+        response = FileResponse(open(job.pdf_path, 'rb'), as_attachment=True, filename='planogram.pdf', content_type='application/pdf')
+        response['ETag'] = f'"{job.cache_key}"'
+        return response
@@ -10,6 +10,7 @@ from .models import Genre
 from .paginations import GenrePagination
 
 from books.models import Book
+from books.metrics import refresh_book_metrics
 from utils.permissions import CustomBasePermission
 
 class ListCreateGenreAPIView(ListCreateAPIView):
@@ -98,6 +99,9 @@ class RetrieveUpdateDestroyGenreAPIView(RetrieveUpdateDestroyAPIView):
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
 
+        # Books are sorted by the name of their first genre
+        refresh_book_metrics(instance.book_set.values_list('id', flat=True))
+
         if getattr(instance, '_prefetched_objects_cache', None):
             # If 'prefetch_related' has been applied to a queryset, we need to
             # forcibly invalidate the prefetch cache on the instance.
@@ -1,9 +1,13 @@
 from rest_framework import serializers
 from rest_framework.exceptions import APIException
 from books.models import Book
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Sum
 from abc import abstractmethod
 
+from .stock import apply_stock_changes, bulk_create_transactions, lock_books, lock_transaction_group
+from .transaction_hooks import handle_transactions_changed
+
 
 class TransactionBaseSerializer(serializers.ModelSerializer):
     book = serializers.PrimaryKeyRelatedField(queryset=Book.objects.all())
@@ -46,10 +50,6 @@ class TransactionGroupBaseSerializer(serializers.ModelSerializer):
     def get_transaction_name(self, plural=False) -> str:
         pass
 
-    @abstractmethod
-    def update_transaction(self, instance, transaction_data, transaction_id) -> None:
-        pass
-
     @abstractmethod
     def update_non_nested_fields(self, instance, validated_data):
         pass
@@ -58,82 +58,114 @@ class TransactionGroupBaseSerializer(serializers.ModelSerializer):
     def validate_before_creation(self, transaction_quantities, data):
         pass
 
+    def get_transactions(self, instance):
+        """Returns the transactions of the group, reusing them if the view prefetched them"""
+        return getattr(instance, self.get_transaction_name(plural=True)).all()
+
+    def get_transaction_totals(self, instance):
+        """Returns the number of books, number of unique books and total measure of the transaction group
+
+        List views annotate these on their queryset, in which case they are used as is. Otherwise they
+        are computed in one grouped query for every transaction group serialized alongside this one.
+        """
+        total_name = f'total_{self.get_measure_name()}'
+        if all(hasattr(instance, name) for name in ('num_books', 'num_unique_books', total_name)):
+            return instance.num_books or 0, instance.num_unique_books or 0, getattr(instance, total_name) or 0
+
+        transaction_totals = getattr(self, '_transaction_totals', {})
+        if instance.id not in transaction_totals:
+            # With many=True, every transaction group of the page is loaded at once
+            if isinstance(self.parent, serializers.ListSerializer) and self.parent.instance is not None:
+                transaction_group_ids = [transaction_group.id for transaction_group in self.parent.instance]
+            else:
+                transaction_group_ids = [instance.id]
+            transaction_totals = self._transaction_totals = self.load_transaction_totals(transaction_group_ids)
+
+        return transaction_totals.get(instance.id, (0, 0, 0))
+
+    def load_transaction_totals(self, transaction_group_ids):
+        transaction_group_name = self.get_transaction_group_name()
+        totals = self.get_transaction_model().objects.filter(**{f'{transaction_group_name}__in': transaction_group_ids}).values(transaction_group_name).annotate(
+            num_books=Sum('quantity'),
+            num_unique_books=Count('book', distinct=True),
+            total=Sum(self.get_measure_name()),
+        )
+        return {total[transaction_group_name]: (total['num_books'], total['num_unique_books'], total['total']) for total in totals}
+
     def get_num_books(self, instance):
-        num_books = 0
-        transactions = self.get_transaction_model().objects.filter(**{self.get_transaction_group_name(): instance.id})
-        for transaction in transactions:
-            num_books += transaction.quantity
+        num_books, _, _ = self.get_transaction_totals(instance)
         return num_books
 
     def get_num_unique_books(self, instance):
-        unique_books = set()
-        transactions = self.get_transaction_model().objects.filter(**{self.get_transaction_group_name(): instance.id})
-        for transaction in transactions:
-            unique_books.add(transaction.book)
-        return len(unique_books)
+        _, num_unique_books, _ = self.get_transaction_totals(instance)
+        return num_unique_books
 
     def get_total_of_transactions(self, instance):
-        total = 0
-        transactions = self.get_transaction_model().objects.filter(**{self.get_transaction_group_name(): instance.id})
-        for transaction in transactions:
-            total += getattr(transaction, self.get_measure_name())
+        _, _, total = self.get_transaction_totals(instance)
         return round(total, 2)
 
     def update(self, instance, validated_data):
         transactions_update_data = validated_data.pop(self.get_transaction_name(plural=True))  # Get list of transaction info to use to do update
-
-        existing_transactions = self.get_transaction_model().objects.filter(**{self.get_transaction_group_name(): instance.id})  # Get the existing transactions in this transaction group
-
-        # Check to make sure no books in the transaction group that is being updated have been deleted
-        # Will block this operation if this is the case, even if that specific transaction isn't being changed.
-        self.check_for_ghost_books([t['book'] for t in transactions_update_data])
-        self.check_for_ghost_books([t.book for t in existing_transactions])
-
-        existing_transactions_ids = set([transaction.id for transaction in existing_transactions])
-        transactions_to_delete_ids = existing_transactions_ids.copy()  # set of ids which at the end will contain the ids of transactions to delete. We will remove ids that shouldn't be deleted
-        books_stock_change = {}  # Holds how a given book's stock will change due to this update, which will be used to check validity later
-        for transaction_data in transactions_update_data:
-            transaction_id = transaction_data.get('id', None)
-            if transaction_id:  # transaction already exists
-                self.handle_existing_transaction(transactions_to_delete_ids, books_stock_change, transaction_data, transaction_id)
-            else:
-                books_stock_change[transaction_data['book'].id] = self.calculate_updated_stock_on_new_transaction(books_stock_change, transaction_data)
-
-        # For the transactions to delete, determine the book stock resulting from deleting each of them
-        for transaction_to_delete_id in transactions_to_delete_ids:
-            transaction_to_delete = self.get_transaction_model().objects.get(id=transaction_to_delete_id)
-            book = transaction_to_delete.book
-            quantity = transaction_to_delete.quantity
-            books_stock_change[book.id] = books_stock_change.get(book.id, 0) + (quantity * (-1 if self.get_measure_name() == "cost" else 1))
-
-        # Check if transactions would create negative book inventory
-        for book_id, stock_diff in books_stock_change.items():
-            if Book.objects.get(id=book_id).stock + stock_diff < 0:
-                raise APIException("Cannot do update because would cause a book stock to become negative.")
-
-        # ****** IF THIS POINT IS REACHED, WE HAVE DETERMINED THAT THE UPDATE CAN BE DONE SUCCESSFULLY ******
-
-        for transaction_data in transactions_update_data:  # For each transaction data given, actually update the database now
-            transaction_id = transaction_data.get('id', None)
-            if transaction_id:  # Transaction already exists
-                self.update_transaction(instance, transaction_data, transaction_id)
-                existing_transactions_ids.remove(transaction_id)
-            else:  # Transaction doesn't exist, so create it
-                self.get_transaction_model().objects.create(**{self.get_transaction_group_name(): instance}, **transaction_data)
-
-        # Delete any old transactions in database
-        for old_transaction_id in existing_transactions_ids:
-            old_transaction = self.get_transaction_model().objects.get(id=old_transaction_id)
-            old_transaction.delete()
-
-        # update book stocks in database
-        for book_id, stock_diff in books_stock_change.items():
-            book_to_update = Book.objects.get(id=book_id)
-            book_to_update.stock += stock_diff
-            book_to_update.save()
-
-        # Update the non-nested fields in the database (e.g. date)
-        self.update_non_nested_fields(instance, validated_data)
+        previous_date = instance.date
+        price_name = self.get_price_name()
+        stock_sign = self.get_stock_sign()
+
+        with transaction.atomic():
+            lock_transaction_group(instance)
+            # Get the existing transactions in this transaction group, the ones left in the dict at the end are deleted
+            existing_transactions = {t.id: t for t in self.get_transaction_model().objects.filter(**{self.get_transaction_group_name(): instance.id}).select_related('book')}
+            affected_book_ids = {t.book_id for t in existing_transactions.values()} | {t['book'].id for t in transactions_update_data}
+            books = lock_books(affected_book_ids)
+
+            # Check to make sure no books in the transaction group that is being updated have been deleted
+            # Will block this operation if this is the case, even if that specific transaction isn't being changed.
+            self.check_for_ghost_books([t['book'] for t in transactions_update_data])
+            self.check_for_ghost_books([t.book for t in existing_transactions.values()])
+
+            books_stock_change = {}  # Holds how a given book's stock will change due to this update, which will be used to check validity later
+            transactions_to_update = []
+            transactions_to_create_data = []
+            for transaction_data in transactions_update_data:
+                transaction_id = transaction_data.get('id', None)
+                if transaction_id:  # transaction already exists, its old quantity is given back before the new one is taken
+                    if transaction_id not in existing_transactions:
+                        raise serializers.ValidationError(f'{self.get_transaction_name()} {transaction_id} is not part of this {self.get_transaction_group_name()}.')
+                    existing_transaction = existing_transactions.pop(transaction_id)
+                    books_stock_change[existing_transaction.book_id] = books_stock_change.get(existing_transaction.book_id, 0) - stock_sign * existing_transaction.quantity
+
+                    existing_transaction.book = transaction_data.get('book', existing_transaction.book)
+                    existing_transaction.quantity = transaction_data.get('quantity', existing_transaction.quantity)
+                    setattr(existing_transaction, price_name, transaction_data.get(price_name, getattr(existing_transaction, price_name)))
+                    getattr(existing_transaction, f'calculate_{self.get_measure_name()}')()
+                    transactions_to_update.append(existing_transaction)
+                else:
+                    transactions_to_create_data.append(transaction_data)
+                books_stock_change[transaction_data['book'].id] = books_stock_change.get(transaction_data['book'].id, 0) + stock_sign * transaction_data['quantity']
+
+            # For the transactions to delete, determine the book stock resulting from deleting each of them
+            for transaction_to_delete in existing_transactions.values():
+                books_stock_change[transaction_to_delete.book_id] = books_stock_change.get(transaction_to_delete.book_id, 0) - stock_sign * transaction_to_delete.quantity
+
+            # Check if transactions would create negative book inventory
+            for book_id, stock_diff in books_stock_change.items():
+                if books[book_id].stock + stock_diff < 0:
+                    raise APIException("Cannot do update because would cause a book stock to become negative.")
+
+            # ****** IF THIS POINT IS REACHED, WE HAVE DETERMINED THAT THE UPDATE CAN BE DONE SUCCESSFULLY ******
+
+            self.get_transaction_model().objects.bulk_update(transactions_to_update, ['book', 'quantity', price_name, self.get_measure_name()])
+            bulk_create_transactions(self.get_transaction_model(), self.get_transaction_group_name(), instance, transactions_to_create_data, self.get_measure_name())
+            # Delete any old transactions in database
+            self.get_transaction_model().objects.filter(id__in=existing_transactions.keys()).delete()
+
+            # update book stocks in database
+            apply_stock_changes(books_stock_change)
+
+            # Update the non-nested fields in the database (e.g. date)
+            self.update_non_nested_fields(instance, validated_data)
+
+        # Both the books previously in the transaction group and the books now in it, on both the old and the new date
+        handle_transactions_changed(affected_book_ids, {previous_date, instance.date})
         return instance
 
     def check_for_ghost_books(self, books_list):
@@ -141,25 +173,9 @@ class TransactionGroupBaseSerializer(serializers.ModelSerializer):
             if book.isGhost:
                 raise serializers.ValidationError(f'{book.title} was previously deleted. Please add it to books list again.')
 
-    def handle_existing_transaction(self, transactions_to_delete_ids, books_stock_change, transaction_data, transaction_id):
-        # Two possible cases may occur:
-        update_transaction_book = transaction_data["book"]
-        previous_transaction_book = self.get_transaction_model().objects.get(id=transaction_data["id"]).book
-        # Case 1. Book isn't being changed
-        if (previous_transaction_book.id == update_transaction_book.id):
-            transactions_to_delete_ids.discard(transaction_id)
-            new_quantity = transaction_data['quantity']
-            old_quantity = self.get_transaction_model().objects.get(id=transaction_id).quantity
-            lose_books = old_quantity - new_quantity
-            gain_books = -lose_books
-            books_stock_change[
-                update_transaction_book.id] = gain_books if self.get_measure_name() == "cost" else lose_books  # if it cost you money, you bought books. If you made money, you sold books
-        else:  # Case 2. Book is being changed, so treat transaction as a packaged operation of a deletion followed by a creation
-            books_stock_change[transaction_data['book'].id] = self.calculate_updated_stock_on_new_transaction(books_stock_change, transaction_data)
-
-    def calculate_updated_stock_on_new_transaction(self, books_stock_change, transaction_data):
-        """Determines what the stock of a given book will be after a given transaction is updated"""
-        return books_stock_change.get(transaction_data['book'].id, 0) + (transaction_data['quantity'] * (-1 if self.get_measure_name() == "revenue" else 1))
+    def get_stock_sign(self):
+        """1 if the transactions add their books to stock, -1 if they remove them"""
+        return 1 if self.get_measure_name() == "cost" else -1  # if it cost you money, you bought books. If you made money, you sold books
 
     def create(self, data):
         transactions_data = data.pop(self.get_transaction_name(plural=True))
@@ -168,24 +184,24 @@ class TransactionGroupBaseSerializer(serializers.ModelSerializer):
             transaction_quantities[transaction_data['book'].id] = transaction_quantities.get(transaction_data['book'].id, 0) + (
                 transaction_data['quantity'] * (-1 if self.get_measure_name() == "revenue" else 1))  # negative if sale, positive if purchase
 
-        self.validate_before_creation(transaction_quantities, data)
+        with transaction.atomic():
+            # Validation reads the stock of the locked books, so it cannot change until the transaction group is saved
+            books = lock_books(transaction_quantities.keys())
+            self.validate_before_creation(transaction_quantities, data)
 
-        #Check that books aren't ghosted
-        for transaction_data in transactions_data:
-            book_obj = transaction_data['book']
-            if book_obj.isGhost:
+            #Check that books aren't ghosted
+            if any(book.isGhost for book in books.values()):
                 raise APIException()  # exception based on casey
 
-        # AT THIS POINT, WE HAVE CONFIRMED WE CAN CREATE THE TRANSACTION GROUP
+            # AT THIS POINT, WE HAVE CONFIRMED WE CAN CREATE THE TRANSACTION GROUP
 
-        transaction_group = self.get_transaction_group_model().objects.create(**data)
-        for transaction_data in transactions_data:
-            self.get_transaction_model().objects.create(**{self.get_transaction_group_name(): transaction_group}, **transaction_data)
+            transaction_group = self.get_transaction_group_model().objects.create(**data)
+            bulk_create_transactions(self.get_transaction_model(), self.get_transaction_group_name(), transaction_group, transactions_data, self.get_measure_name())
+
+            # Update book stocks
+            apply_stock_changes(transaction_quantities)
 
-        # Update book stocks
-        for book_id, transaction_quantity in transaction_quantities.items():
-            book = Book.objects.get(id=book_id)
-            book.stock += transaction_quantity
-            book.save()
+        # Deferred until the transaction group is committed, when the group is created inside an outer transaction
+        transaction.on_commit(lambda: handle_transactions_changed(transaction_quantities.keys(), [transaction_group.date]))
 
-        return transaction_group
\ No newline at end of file
+        return transaction_group
@@ -1,16 +1,28 @@
 import csv
 
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 
 from rest_framework.request import Request
 from rest_framework.response import Response
 
 from books.models import Book
-from books.search_filters import generate_filter_from_query_params
+from books.search_filters import filter_books_from_query_params
 from books.serializers import BookListAddSerializer
 from books.remote_books import RemoteSubsidiaryTools
+from books.metrics import BookMetricsLoader
+from utils.general import str2bool
 from .csv_export_formatter import CSVExportFormatter
 
+# Number of books read from the database cursor and serialized at a time when streaming
+STREAMING_CHUNK_SIZE = 500
+
+
+class EchoBuffer:
+    """Pseudo file for csv.writer that returns the written row instead of storing it"""
+
+    def write(self, value):
+        return value
+
 
 class CSVWriter:
     def __init__(self, csv_export_type: str) -> None:
@@ -22,15 +34,10 @@ class CSVWriter:
         return getattr(self, 'write_csv_' + self.csv_export_type, lambda: default)(request)
     
     def write_csv_books(self, request: Request):
-        # Turn request.query_params to filter
-        filter_kwargs = generate_filter_from_query_params(request.query_params.dict())
-        books = Book.objects.filter(**filter_kwargs)
-
-        # Order queryset by given ordering default is title
-        ordering = request.query_params.dict().get('ordering', 'title')
-        if ordering == '': ordering = 'title'
+        books = self.get_books(request)
 
-        books = books.order_by(ordering)
+        if str2bool(request.query_params.get('stream')):
+            return self.stream_csv_books(books)
 
         response = HttpResponse(
             content_type='text/csv',
@@ -50,7 +57,52 @@ class CSVWriter:
             writer.writerow(row)
 
         return response
-    
+
+    def get_books(self, request: Request):
+        # Turn request.query_params to filter, using the same search engine as the book list view
+        query_params = request.query_params.dict()
+        books = filter_books_from_query_params(Book.objects.defer('search_vector'), query_params)
+
+        # Order queryset by given ordering. Searches without an ordering are ordered by relevance, the default is title
+        ordering = query_params.get('ordering', '')
+        if ordering != '':
+            books = books.order_by(ordering)
+        elif not query_params.get('search'):
+            books = books.order_by('title')
+
+        return books
+
+    def stream_csv_books(self, books):
+        """Streams the CSV rows as they are produced instead of building the whole file in memory"""
+        response = StreamingHttpResponse(
+            self.generate_csv_book_rows(books),
+            content_type='text/csv',
+            headers={'Content-Disposition': 'attachment; filename="books.csv"'}
+        )
+        return response
+
+    def generate_csv_book_rows(self, books):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(self.csv_export_formatter.get_export_headers())
+
+        # Books are read from a server-side cursor, and the metrics and remote data are fetched in bulk per chunk
+        for chunk in self.chunk_queryset(books, STREAMING_CHUNK_SIZE):
+            remote_dict = self.get_remote_books(self.queryset_to_isbns(chunk))
+            serializer = BookListAddSerializer(chunk, many=True, context={'book_metrics': BookMetricsLoader(chunk)})
+            for book_data in serializer.data:
+                data = self.add_remote_books(remote_dict, book_data)
+                yield writer.writerow(self.csv_export_formatter.format_book(data))
+
+    def chunk_queryset(self, queryset, chunk_size):
+        chunk = []
+        for instance in queryset.iterator(chunk_size=chunk_size):
+            chunk.append(instance)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if len(chunk) != 0:
+            yield chunk
+
     def add_remote_books(self, remote_dict, data):
         if found := remote_dict.get(data['isbn_13'], None):
             data['remote_inventory_count'] = found['inventoryCount']
@@ -0,0 +1,51 @@
+from typing import Dict, Iterable
+
+from django.db import models
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from books.models import Book
+
+# Every write path that changes stock takes its locks in the same order: the transaction group row
+# first, then the book rows by ascending id. Concurrent writes touching the same books therefore
+# wait on each other instead of deadlocking or losing stock updates.
+# All of these must be called inside transaction.atomic().
+
+
+def lock_transaction_group(transaction_group: models.Model) -> None:
+    """Locks the row of the transaction group until the end of the database transaction"""
+    list(type(transaction_group).objects.select_for_update().filter(id=transaction_group.id).values_list('id', flat=True))
+
+
+def lock_books(book_ids: Iterable[int]) -> Dict[int, Book]:
+    """Locks the rows of the books and returns {book id: book} with their current stock"""
+    return {book.id: book for book in Book.objects.select_for_update().filter(id__in=set(book_ids)).order_by('id')}
+
+
+def get_book_quantities(transactions: models.QuerySet) -> Dict[int, int]:
+    """Returns {book id: total quantity} of the transactions"""
+    return {book_quantity['book']: book_quantity['num_books'] for book_quantity in transactions.values('book').annotate(num_books=Sum('quantity')).order_by()}
+
+
+def apply_stock_changes(stock_changes: Dict[int, int]) -> None:
+    """Adds {book id: stock difference} to the stock of the books in a single UPDATE
+
+    The book rows must have been locked with lock_books.
+    """
+    stock_changes = {book_id: stock_diff for book_id, stock_diff in stock_changes.items() if stock_diff != 0}
+    if not stock_changes:
+        return
+
+    stock_diff = Case(*[When(id=book_id, then=Value(diff)) for book_id, diff in stock_changes.items()], default=Value(0), output_field=IntegerField())
+    Book.objects.filter(id__in=stock_changes.keys()).update(stock=F('stock') + stock_diff)
+
+
+def bulk_create_transactions(transaction_model: models.Model, transaction_group_name: str, transaction_group: models.Model, transactions_data, measure_name: str) -> list:
+    """Inserts the transactions of the group in a single query
+
+    bulk_create does not call save(), so the measure (revenue or cost) and the rounded unit price
+    that save() would set are computed here.
+    """
+    transactions = [transaction_model(**{transaction_group_name: transaction_group}, **transaction_data) for transaction_data in transactions_data]
+    for transaction in transactions:
+        getattr(transaction, f'calculate_{measure_name}')()
+    return transaction_model.objects.bulk_create(transactions)
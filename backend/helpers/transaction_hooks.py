@@ -0,0 +1,18 @@
+from books.activity import refresh_book_activity
+from books.metrics import refresh_book_metrics
+from sales.reports import invalidate_sales_report_days
+
+
+def handle_transactions_changed(book_ids, dates):
+    """Keeps the data derived from transactions up to date
+
+    Must be called whenever sales, purchases or buybacks are created, updated or deleted,
+    with the ids of the books and the dates that the change touched.
+    """
+    book_ids = set(book_ids)
+    dates = set(dates)
+
+    refresh_book_activity(book_ids, dates)
+    invalidate_sales_report_days(dates)
+    # Stock and sales changed, so do the inventory metrics of the books
+    refresh_book_metrics(book_ids)
@@ -57,6 +57,9 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
 
+    # PostgreSQL specific fields, indexes and full text search used by the book catalog search
+    'django.contrib.postgres',
+
     # Register Custom Apps
     'books',
     "genres",
@@ -16,7 +16,10 @@ class Purchase(models.Model):
     purchase_order = models.ForeignKey(PurchaseOrder, related_name='purchases', on_delete=models.CASCADE)
     cost = models.FloatField()
 
-    def save(self, *args, **kwargs):
+    def calculate_cost(self):
         self.cost = float(f'{self.quantity * self.unit_wholesale_price:.2f}')
         self.unit_wholesale_price = float(f'{self.unit_wholesale_price:.2f}')
+
+    def save(self, *args, **kwargs):
+        self.calculate_cost()
         super(Purchase, self).save(*args, **kwargs)
@@ -1,7 +1,13 @@
 from rest_framework import pagination
-from utils.paginations import HTTPSNoPortPagination
+from utils.paginations import HTTPSNoPortPagination, HTTPSNoPortCursorPagination
 
 
 class PurchaseOrderPagination(HTTPSNoPortPagination):
     page_size = 10
-    page_size_query_param = 'page_size'
\ No newline at end of file
+    page_size_query_param = 'page_size'
+
+
+class PurchaseOrderCursorPagination(HTTPSNoPortCursorPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    cursor_ordering_fields = ['date', 'total_cost', 'num_books', 'num_unique_books', 'id']
@@ -2,8 +2,6 @@ from rest_framework import serializers
 from django.db import models
 from .models import Purchase, PurchaseOrder
 from helpers.base_serializers import TransactionBaseSerializer, TransactionGroupBaseSerializer
-from django.db.models import Sum
-from books.models import Book
 
 
 class PurchaseSerializer(TransactionBaseSerializer):
@@ -25,10 +23,15 @@ class PurchaseOrderSerializer(TransactionGroupBaseSerializer):
         read_only_fields = ['id']
 
     def get_is_deletable(self, instance):
-        purchase_book_quantities = Purchase.objects.filter(purchase_order=instance.id).values('book').annotate(num_books=Sum('quantity')).values('book', 'num_books')
-        for purchase_book_quantity in purchase_book_quantities:
-            book_to_remove_purchase = Book.objects.filter(id=purchase_book_quantity['book']).get()
-            if (book_to_remove_purchase.stock < purchase_book_quantity['num_books']) or (book_to_remove_purchase.isGhost):
+        purchase_book_quantities = {}
+        books_to_remove_purchase = {}
+        for purchase in self.get_transactions(instance):
+            purchase_book_quantities[purchase.book_id] = purchase_book_quantities.get(purchase.book_id, 0) + purchase.quantity
+            books_to_remove_purchase[purchase.book_id] = purchase.book
+
+        for book_id, num_books in purchase_book_quantities.items():
+            book_to_remove_purchase = books_to_remove_purchase[book_id]
+            if (book_to_remove_purchase.stock < num_books) or (book_to_remove_purchase.isGhost):
                 return False
         return True
 
@@ -57,9 +60,6 @@ class PurchaseOrderSerializer(TransactionGroupBaseSerializer):
     def get_total_cost(self, instance):
         return super().get_total_of_transactions(instance)
 
-    def update_transaction(self, instance, transaction_data, transaction_id) -> None:
-        self.__update_purchase(instance, transaction_data, transaction_id)
-
     def get_vendor_name(self, instance):
         return instance.vendor.name
     
@@ -70,10 +70,3 @@ class PurchaseOrderSerializer(TransactionGroupBaseSerializer):
         instance.date = validated_data.get('date', instance.date)
         instance.vendor = validated_data.get('vendor', instance.vendor)
         instance.save()
-
-    def __update_purchase(self, instance, purchase_data, purchase_id):
-        purchase = Purchase.objects.get(id=purchase_id, purchase_order=instance)
-        purchase.book = purchase_data.get('book', purchase.book)
-        purchase.quantity = purchase_data.get('quantity', purchase.quantity)
-        purchase.unit_wholesale_price = purchase_data.get('unit_wholesale_price', purchase.unit_wholesale_price)
-        purchase.save()
@@ -1,6 +1,8 @@
 import datetime, pytz
 
-from django.db.models import OuterRef, Subquery, Func, Count, F, Sum
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Func, Count, F, Prefetch
+from django.db.models.functions import Coalesce
 
 from rest_framework import status, filters
 from rest_framework.response import Response
@@ -8,19 +10,22 @@ from rest_framework.views import APIView
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.request import Request
 
-from books.models import Book
 from utils.permissions import CustomBasePermission
+from utils.paginations import CursorPaginationOptInMixin
 from helpers.csv_reader import CSVReader
+from helpers.stock import apply_stock_changes, get_book_quantities, lock_books, lock_transaction_group
+from helpers.transaction_hooks import handle_transactions_changed
 
 from .models import Purchase, PurchaseOrder
-from .paginations import PurchaseOrderPagination
+from .paginations import PurchaseOrderPagination, PurchaseOrderCursorPagination
 from .serializers import PurchaseOrderSerializer
 
-class ListCreatePurchaseOrderAPIView(ListCreateAPIView):
+class ListCreatePurchaseOrderAPIView(CursorPaginationOptInMixin, ListCreateAPIView):
     permission_classes = [CustomBasePermission]
     serializer_class = PurchaseOrderSerializer
     queryset = PurchaseOrder.objects.all()
     pagination_class = PurchaseOrderPagination
+    cursor_pagination_class = PurchaseOrderCursorPagination
     filter_backends = [filters.OrderingFilter, filters.SearchFilter]
     ordering_fields = '__all__'
     ordering = ['-date']
@@ -42,7 +47,8 @@ class ListCreatePurchaseOrderAPIView(ListCreateAPIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def get_queryset(self):
-        default_query_set = PurchaseOrder.objects.all()
+        # The transactions and their books are loaded in one query per page rather than per transaction group
+        default_query_set = PurchaseOrder.objects.select_related('user', 'vendor').prefetch_related(Prefetch('purchases', queryset=Purchase.objects.select_related('book')))
 
         # Create a subquery to aggregate the 'cost' value for each purchase in PurchaseOrder
         cost_subquery = Purchase.objects.filter(purchase_order=OuterRef('id')).values_list(Func(
@@ -50,12 +56,13 @@ class ListCreatePurchaseOrderAPIView(ListCreateAPIView):
             function='SUM',
         ),)
 
-        default_query_set = default_query_set.annotate(total_cost=Subquery(cost_subquery))
+        # Totals are never NULL, so that they can be cursor pagination keys
+        default_query_set = default_query_set.annotate(total_cost=Coalesce(Subquery(cost_subquery), 0.0))
 
         # Filter by quantity of books in PurchaseOrder
         num_books_subquery = Purchase.objects.filter(purchase_order=OuterRef('id')).values_list(Func('quantity', function='SUM'),)
 
-        default_query_set = default_query_set.annotate(num_books=Subquery(num_books_subquery))
+        default_query_set = default_query_set.annotate(num_books=Coalesce(Subquery(num_books_subquery), 0))
 
         default_query_set = default_query_set.annotate(num_unique_books=Count('purchases__book', distinct=True))
 
@@ -131,7 +138,7 @@ class RetrieveUpdateDestroyPurchaseOrderAPIView(RetrieveUpdateDestroyAPIView):
     pagination_class = PurchaseOrderPagination
 
     def get_queryset(self):
-        return PurchaseOrder.objects.filter(id=self.kwargs['id'])
+        return PurchaseOrder.objects.select_related('user', 'vendor').prefetch_related(Prefetch('purchases', queryset=Purchase.objects.select_related('book'))).filter(id=self.kwargs['id'])
 
     def retrieve(self, request, *args, **kwargs):
         invalid_id_response = self.verify_existance()
@@ -150,32 +157,37 @@ class RetrieveUpdateDestroyPurchaseOrderAPIView(RetrieveUpdateDestroyAPIView):
         serializer = self.get_serializer(purchase_order, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        # The prefetched transactions no longer match the updated ones
+        purchase_order._prefetched_objects_cache = {}
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def destroy(self, request, *args, **kwargs):
-        purchase_book_quantities = Purchase.objects.filter(purchase_order=self.get_object().id).values('book').annotate(num_books=Sum('quantity')).values('book', 'num_books')
-        for purchase_book_quantity in purchase_book_quantities:
-            book_to_remove_purchase = Book.objects.filter(id=purchase_book_quantity['book']).get()
-            if (book_to_remove_purchase.stock < purchase_book_quantity['num_books']) or (book_to_remove_purchase.isGhost):
-                return Response(
-                    {
-                        "error": {
-                            "msg": "Cannot delete purchase order, as doing so would cause book stock to become negative.",
-                            "details": {
-                                "book_id": purchase_book_quantity['book'],
-                                "book_stock": book_to_remove_purchase.stock,
-                                "quantity_request_for_delete": purchase_book_quantity['num_books']
+        instance = self.get_object()
+        with transaction.atomic():
+            lock_transaction_group(instance)
+            purchase_book_quantities = get_book_quantities(Purchase.objects.filter(purchase_order=instance.id))
+            books = lock_books(purchase_book_quantities.keys())
+            for book_id, num_books in purchase_book_quantities.items():
+                book_to_remove_purchase = books[book_id]
+                if (book_to_remove_purchase.stock < num_books) or (book_to_remove_purchase.isGhost):
+                    return Response(
+                        {
+                            "error": {
+                                "msg": "Cannot delete purchase order, as doing so would cause book stock to become negative.",
+                                "details": {
+                                    "book_id": book_id,
+                                    "book_stock": book_to_remove_purchase.stock,
+                                    "quantity_request_for_delete": num_books
+                                }
                             }
-                        }
-                    },
-                    status=status.HTTP_403_FORBIDDEN)
-
-        # If we get here, we know we can successfully delete all the purchases, so we will do that
-        for purchase_book_quantity in purchase_book_quantities:
-            book_to_remove_purchase = Book.objects.filter(id=purchase_book_quantity['book']).get()
-            book_to_remove_purchase.stock -= purchase_book_quantity['num_books']
-            book_to_remove_purchase.save()
-        return super().destroy(request, *args, **kwargs)
+                        },
+                        status=status.HTTP_403_FORBIDDEN)
+
+            # If we get here, we know we can successfully delete all the purchases, so we will do that
+            apply_stock_changes({book_id: -num_books for book_id, num_books in purchase_book_quantities.items()})
+            response = super().destroy(request, *args, **kwargs)
+        handle_transactions_changed(purchase_book_quantities.keys(), [instance.date])
+        return response
 
     def verify_existance(self):
         if (len(self.get_queryset()) == 0):
@@ -0,0 +1,99 @@
+import datetime, hashlib, io, traceback
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import SalesRecordSubmission
+from .parsers import XMLParser
+from .serializers import SalesRecordSerializer
+
+# Submissions failing with unexpected errors, e.g. a lost database connection, are retried this many times
+SUBMISSION_MAX_ATTEMPTS = 3
+# Submissions still processing after this long were claimed by a worker that died, so they are queued again
+SUBMISSION_PROCESSING_TIMEOUT = datetime.timedelta(minutes=10)
+DEFAULT_BATCH_SIZE = 20
+
+
+def submit_sales_record(payload: bytes, idempotency_key: str = None):
+    """Durably queues the raw XML sales record, returns (submission, created)
+
+    Resubmitting the same payload, or any payload with the same idempotency key, returns the
+    existing submission instead of queueing the record again.
+    """
+    idempotency_key = idempotency_key or hashlib.sha256(payload).hexdigest()
+    return SalesRecordSubmission.objects.get_or_create(idempotency_key=idempotency_key, defaults={'payload': payload})
+
+
+def claim_submissions(batch_size):
+    """Marks the next pending submissions as processing and returns them
+
+    Rows locked by other workers are skipped, so several workers can share the queue. Submissions
+    whose sales record was already written are never claimed again.
+    """
+    SalesRecordSubmission.objects.filter(status='processing', updated_at__lt=timezone.now() - SUBMISSION_PROCESSING_TIMEOUT,
+                                         sales_reconciliation__isnull=True).update(status='pending')
+
+    with transaction.atomic():
+        submissions = SalesRecordSubmission.objects.select_for_update(skip_locked=True).filter(status='pending', sales_reconciliation__isnull=True)
+        submissions = list(submissions.order_by('id')[:batch_size])
+        SalesRecordSubmission.objects.filter(id__in=[submission.id for submission in submissions]).update(status='processing', updated_at=timezone.now())
+    return submissions
+
+
+def process_submission(submission: SalesRecordSubmission):
+    """Parses and writes the sales record of the submission, recording the outcome on it
+
+    The sales record and the done status of the submission are committed together, so a record
+    is never written twice. The hooks updating the data derived from the sales only run once
+    both are committed, and their failures never queue the submission again.
+    """
+    committed = False
+
+    def mark_committed():
+        nonlocal committed
+        committed = True
+
+    try:
+        with transaction.atomic():
+            # Registered before the hooks of the sales record, so it runs first once the transaction is committed
+            transaction.on_commit(mark_committed)
+
+            locked_submission = SalesRecordSubmission.objects.select_for_update().get(id=submission.id)
+            if locked_submission.sales_reconciliation_id is not None:
+                # Written by an earlier attempt
+                SalesRecordSubmission.objects.filter(id=submission.id).update(status='done', updated_at=timezone.now())
+                return
+
+            sales_record = XMLParser().parse(io.BytesIO(submission.payload))
+            serializer = SalesRecordSerializer(data=sales_record)
+            serializer.is_valid(raise_exception=True)
+            sales_reconciliation = serializer.save()
+
+            SalesRecordSubmission.objects.filter(id=submission.id).update(status='done', error=None, attempts=submission.attempts + 1,
+                                                                          sales_reconciliation=sales_reconciliation, updated_at=timezone.now())
+    except serializers.ValidationError as e:
+        # The record itself is invalid, so retrying would fail the same way
+        SalesRecordSubmission.objects.filter(id=submission.id).update(status='failed', error=e.detail, attempts=submission.attempts + 1, updated_at=timezone.now())
+    except Exception as e:
+        error = {'error': f'{e}', 'traceback': traceback.format_exc()}
+        if committed:
+            # The sales record is written, only the data derived from it failed to update, see the rebuild_* management commands
+            SalesRecordSubmission.objects.filter(id=submission.id).update(error=error, updated_at=timezone.now())
+            return
+
+        attempts = submission.attempts + 1
+        status = 'failed' if attempts >= SUBMISSION_MAX_ATTEMPTS else 'pending'
+        SalesRecordSubmission.objects.filter(id=submission.id).update(status=status, error=error, attempts=attempts, updated_at=timezone.now())
+
+
+def process_sales_record_submissions(batch_size=DEFAULT_BATCH_SIZE):
+    """Processes one batch of queued submissions, returns the number processed
+
+    Each record is written in its own database transaction, so an invalid record never holds
+    back the others of its batch.
+    """
+    submissions = claim_submissions(batch_size)
+    for submission in submissions:
+        process_submission(submission)
+    return len(submissions)
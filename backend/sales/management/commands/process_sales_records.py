@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from sales.ingestion import DEFAULT_BATCH_SIZE, process_sales_record_submissions
+
+
+class Command(BaseCommand):
+    help = ('Ingest the sales records queued through the sales record submissions endpoint, in batches. '
+            'Runs until interrupted unless --once is given, several workers can run at the same time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Process the queued records and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            num_processed = process_sales_record_submissions(batch_size=options['batch_size'])
+            if num_processed > 0:
+                self.stdout.write(f'Processed {num_processed} sales records')
+                continue
+
+            if options['once']:
+                break
+            # Idle workers do not keep a connection open
+            connection.close()
+            time.sleep(options['poll_interval'])
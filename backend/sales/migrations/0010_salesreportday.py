@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0009_salesreconciliation_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesReportDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('sales_revenue', models.FloatField(default=0)),
+                ('buybacks_revenue', models.FloatField(default=0)),
+                ('cost', models.FloatField(default=0)),
+            ],
+        ),
+    ]
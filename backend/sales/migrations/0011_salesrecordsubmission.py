@@ -0,0 +1,32 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0010_salesreportday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRecordSubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.CharField(max_length=255, unique=True)),
+                ('payload', models.BinaryField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.JSONField(blank=True, default=None, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('sales_reconciliation', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='submissions', to='sales.salesreconciliation')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='salesrecordsubmission',
+            index=models.Index(fields=['status', 'id'], name='sales_record_submission_queue'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0011_salesrecordsubmission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesreportday',
+            name='is_stale',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='salesreportday',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
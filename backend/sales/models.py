@@ -17,7 +17,52 @@ class Sale(models.Model):
     sales_reconciliation = models.ForeignKey(SalesReconciliation, related_name='sales', on_delete=models.CASCADE)
     revenue = models.FloatField()
 
-    def save(self, *args, **kwargs):
+    def calculate_revenue(self):
         self.revenue = float(f'{self.quantity*self.unit_retail_price:.2f}')
         self.unit_retail_price = float(f'{self.unit_retail_price:.2f}')
+
+    def save(self, *args, **kwargs):
+        self.calculate_revenue()
         super(Sale, self).save(*args, **kwargs)
+
+
+class SalesReportDay(models.Model):
+    """Cached totals of one past day of the sales report
+
+    Maintained by sales.reports: entries are computed on first use and marked stale whenever
+    transactions of their date change. The current day is never cached.
+    """
+    date = models.DateField(unique=True)
+    sales_revenue = models.FloatField(default=0)
+    buybacks_revenue = models.FloatField(default=0)
+    cost = models.FloatField(default=0)
+    # Incremented on every invalidation, so that totals computed before it are never cached
+    version = models.PositiveIntegerField(default=0)
+    is_stale = models.BooleanField(default=False)
+
+
+SALES_RECORD_SUBMISSION_STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('processing', 'Processing'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+]
+
+
+class SalesRecordSubmission(models.Model):
+    """Raw XML sales record accepted for asynchronous ingestion by sales.ingestion"""
+    # Either the Idempotency-Key header of the submission or the digest of its payload
+    idempotency_key = models.CharField(max_length=255, unique=True)
+    payload = models.BinaryField()
+    status = models.CharField(max_length=10, choices=SALES_RECORD_SUBMISSION_STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # Validation errors of the record, or the last unexpected error
+    error = models.JSONField(default=None, null=True, blank=True)
+    sales_reconciliation = models.ForeignKey(SalesReconciliation, related_name='submissions', on_delete=models.SET_NULL, default=None, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='sales_record_submission_queue'),
+        ]
@@ -1,10 +1,14 @@
+import os
+
 from rest_framework.parsers import BaseParser
 from books.models import Book
 from books.isbn import ISBNTools
-from django.core.exceptions import ObjectDoesNotExist
 from rest_framework import serializers
 from lxml import etree
 
+# Compiled once per process, the schema is validated as the record is streamed in
+XML_SCHEMA = etree.XMLSchema(etree.parse(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xmlschema.xsd')))
+
 
 class XMLParser(BaseParser):
     media_type = 'application/xml'
@@ -17,58 +21,47 @@ class XMLParser(BaseParser):
         return data
 
     def parse(self, stream, media_type=None, parser_context=None):
+        sales_record = {}
+        sale_items = []
         try:
-            tree = etree.parse(source=stream)
-        except Exception as e:
-            raise serializers.ValidationError(e)
-
-        # check structure
-        with open("sales/xmlschema.xsd") as f:
-            xmlschema_doc = etree.parse(f)
-        xmlschema = etree.XMLSchema(xmlschema_doc)
-        try:
-            xmlschema.assertValid(tree)
+            # Items are read one at a time and discarded once read, so memory does not grow with the size of the record
+            for event, element in etree.iterparse(stream, events=('start', 'end'), schema=XML_SCHEMA):
+                if event == 'start' and element.tag == 'sale':
+                    sales_record['date'] = element.attrib.get('date')
+                elif event == 'end' and element.tag == 'item':
+                    sale_items.append(self.parse_sale_item(self.xml_sale_to_dict(element)))
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
         except Exception as e:
             raise serializers.ValidationError(e)
-        # if not xmlschema.validate(tree):
-        #     raise serializers.ValidationError("")
 
-        root = tree.getroot()
-        sales_record = {}
-        sales_record['date'] = root.attrib['date']
-        sales_record['sales'] = []
-        for item in root:
-            sale_data = self.xml_sale_to_dict(item)
-            sale = {}
+        # Items with an invalid ISBN, quantity or price are discarded
+        sale_items = [sale_item for sale_item in sale_items if sale_item is not None]
 
-            # Check if valid ISBN
-            # If not a valid ISBN, don't add to sales_record because discard line item
-            if not self.isbn_tool.is_valid_isbn(sale_data['isbn']):
-                continue
+        # Books of every item are looked up at once, items whose ISBN isn't in the database are discarded
+        book_ids = dict(Book.objects.filter(isbn_13__in={isbn for isbn, _ in sale_items}).values_list('isbn_13', 'id'))
+        sales_record['sales'] = [dict(sale, book=book_ids[isbn]) for isbn, sale in sale_items if isbn in book_ids]
 
-            # Check if ISBN in database
-            # If not in databaase, don't add to sales_record because discard line item
-            try:
-                sale['book'] = Book.objects.filter(isbn_13=self.isbn_tool.parse_isbn(sale_data['isbn'])).get().id
-            except ObjectDoesNotExist as odne:
-                continue
-
-            try:
-                sale['quantity'] = int(sale_data['qty'])
-            except ValueError:
-                continue
-
-            try:
-                sale['unit_retail_price'] = float(sale_data['price'])
-            except ValueError:
-                continue
-
-            sales_record['sales'].append(sale)
         # Handle no valid sales in record
         if len(sales_record['sales']) == 0:
             raise serializers.ValidationError("No valid sales, sales record not added.")
         return sales_record
 
+    def parse_sale_item(self, sale_data):
+        """Returns (ISBN-13, sale without its book) of the item, or None if the item is invalid"""
+        # Check if valid ISBN
+        if not self.isbn_tool.is_valid_isbn(sale_data['isbn']):
+            return None
+
+        try:
+            quantity = int(sale_data['qty'])
+            unit_retail_price = float(sale_data['price'])
+        except ValueError:
+            return None
+
+        return self.isbn_tool.parse_isbn(sale_data['isbn']), {'quantity': quantity, 'unit_retail_price': unit_retail_price}
+
 
 """
 Format of XML:
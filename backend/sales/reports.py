@@ -0,0 +1,112 @@
+import datetime
+
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from books.models import BookDailyActivity
+from buybacks.models import Buyback
+from purchase_orders.models import Purchase
+
+from .models import Sale, SalesReportDay
+
+# (report field, line item model, date lookup, money field)
+DAILY_TOTAL_SOURCES = [
+    ('sales_revenue', Sale, 'sales_reconciliation__date', 'revenue'),
+    ('buybacks_revenue', Buyback, 'buyback_order__date', 'revenue'),
+    ('cost', Purchase, 'purchase_order__date', 'cost'),
+]
+
+
+def dates_range(start_date: datetime.date, end_date: datetime.date):
+    return [start_date + datetime.timedelta(days=num_days) for num_days in range((end_date - start_date).days + 1)]
+
+
+def _aggregate_daily_totals(dates):
+    """Returns {date: {report field: total}} computed from the line items, with one grouped-by-date query per transaction type"""
+    daily_totals = {date: {field: 0 for field, *_ in DAILY_TOTAL_SOURCES} for date in dates}
+    if len(daily_totals) == 0:
+        return daily_totals
+
+    for field, model, date_lookup, money_field in DAILY_TOTAL_SOURCES:
+        totals = model.objects.filter(**{f'{date_lookup}__in': daily_totals.keys()}).values(date=F(date_lookup)).annotate(total=Sum(money_field))
+        for total in totals:
+            daily_totals[total['date']][field] = round(total['total'], 2)
+
+    return daily_totals
+
+
+def load_daily_totals(start_date: datetime.date, end_date: datetime.date):
+    """Returns {date: {'sales_revenue', 'buybacks_revenue', 'cost', 'profit'}} for every day of the range
+
+    Past days are read from the SalesReportDay cache and only the days missing from it or stale
+    are aggregated, days without transactions are zero-filled.
+    """
+    fields = [field for field, *_ in DAILY_TOTAL_SOURCES]
+    dates = dates_range(start_date, end_date)
+    cached_days = {cached_day.pop('date'): cached_day for cached_day in SalesReportDay.objects.filter(date__range=(start_date, end_date)).values('date', 'version', 'is_stale', *fields)}
+    daily_totals = {date: {field: cached_day[field] for field in fields} for date, cached_day in cached_days.items() if not cached_day['is_stale']}
+
+    missing_daily_totals = _aggregate_daily_totals([date for date in dates if date not in daily_totals])
+    daily_totals.update(missing_daily_totals)
+
+    # Transactions can still be added to the current day, so it is always recomputed
+    today = timezone.localdate()
+    missing_daily_totals = {date: totals for date, totals in missing_daily_totals.items() if date < today}
+    # The days invalidated while they were aggregated have a new version or already exist, so they are left stale
+    SalesReportDay.objects.bulk_create([SalesReportDay(date=date, **totals) for date, totals in missing_daily_totals.items() if date not in cached_days], ignore_conflicts=True)
+    for date, totals in missing_daily_totals.items():
+        if date in cached_days:
+            SalesReportDay.objects.filter(date=date, version=cached_days[date]['version']).update(is_stale=False, **totals)
+
+    daily_totals = {date: daily_totals[date] for date in dates}
+    for totals in daily_totals.values():
+        totals['profit'] = round(totals['sales_revenue'] + totals['buybacks_revenue'] - totals['cost'], 2)
+
+    return daily_totals
+
+
+def invalidate_sales_report_days(dates):
+    """Must be called with the dates of transactions that are created, updated or deleted
+
+    The days are marked stale rather than deleted, and their version is incremented, so that a
+    report computing them concurrently from the previous transactions cannot cache its totals.
+    """
+    dates = set(dates)
+    SalesReportDay.objects.bulk_create([SalesReportDay(date=date, is_stale=True) for date in dates], ignore_conflicts=True)
+    SalesReportDay.objects.filter(date__in=dates).update(version=F('version') + 1, is_stale=True)
+
+
+# Books without any purchase are costed at this fraction of their retail price
+ESTIMATED_COST_RETAIL_FRACTION = .7
+DEFAULT_TOP_BOOKS = 10
+
+
+def load_most_recent_wholesale_prices(book_ids, end_date: datetime.date):
+    """Returns {book_id: unit wholesale price of its most recent purchase up to end_date} in a single DISTINCT ON query"""
+    purchases = Purchase.objects.filter(book__in=book_ids, purchase_order__date__lte=end_date)
+    purchases = purchases.order_by('book', '-purchase_order__date', '-purchase_order__id', '-id').distinct('book')
+    return dict(purchases.values_list('book', 'unit_wholesale_price'))
+
+
+def load_top_books(start_date: datetime.date, end_date: datetime.date, top: int = DEFAULT_TOP_BOOKS):
+    """Returns the top selling books of the range with their revenue, cost basis and profit, with a fixed number of queries"""
+    # Read from the per book daily rollup, which is kept up to date as transactions change
+    top_books = BookDailyActivity.objects.filter(date__range=(start_date, end_date), units_sold__gt=0)
+    top_books = top_books.values('book_id', book_title=F('book__title'), book_retail_price=F('book__retail_price'))
+    top_books = list(top_books.annotate(num_books_sold=Sum('units_sold'), book_revenue=Sum('sales_revenue')).order_by('-num_books_sold', 'book_id')[:top])
+
+    wholesale_prices = load_most_recent_wholesale_prices([book_sale['book_id'] for book_sale in top_books], end_date)
+
+    for book_sale in top_books:
+        retail_price = book_sale.pop('book_retail_price')
+        if book_sale['book_id'] in wholesale_prices:
+            most_recent_unit_wholesale_price = wholesale_prices[book_sale['book_id']]
+            book_sale['is_estimated_cost_most_recent'] = False
+        else:
+            # use 70% of retail price, since book has not been previously documented as being purchased
+            most_recent_unit_wholesale_price = ESTIMATED_COST_RETAIL_FRACTION * retail_price
+            book_sale['is_estimated_cost_most_recent'] = True
+        book_sale['total_cost_most_recent'] = round(most_recent_unit_wholesale_price * book_sale['num_books_sold'], 2)
+        book_sale['book_profit'] = round(book_sale['book_revenue'] - book_sale['total_cost_most_recent'], 2)
+
+    return top_books
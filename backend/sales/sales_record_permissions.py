@@ -1,5 +1,8 @@
 from rest_framework import permissions
 
+# Sales records are parsed incrementally, so the cap bounds the request time rather than the memory used
+MAX_SALES_RECORD_MB = 20
+
 
 class SalesRecordsWhitelistPermission(permissions.BasePermission):
 
@@ -9,8 +12,8 @@ class SalesRecordsWhitelistPermission(permissions.BasePermission):
 
 
 class BodySizePermission(permissions.BasePermission):
-    message = "Body must be under 1MB."
+    message = f"Body must be under {MAX_SALES_RECORD_MB}MB."
     code = 413
 
     def has_permission(self, request, view):
-        return int(request.META["CONTENT_LENGTH"]) <= 1024 * 1024
+        return int(request.META["CONTENT_LENGTH"]) <= MAX_SALES_RECORD_MB * 1024 * 1024
@@ -8,7 +8,7 @@ from helpers.base_serializers import TransactionBaseSerializer, TransactionGroup
 from books.models import Book
 from purchase_orders.models import PurchaseOrder, Purchase
 
-from .models import Sale, SalesReconciliation
+from .models import Sale, SalesReconciliation, SalesRecordSubmission
 
 class SaleSerializer(TransactionBaseSerializer):
 
@@ -35,12 +35,7 @@ class SalesReconciliationSerializer(TransactionGroupBaseSerializer):
 
     def get_is_deletable(self, instance):
         # only way you can't delete is a sale is if the book is ghost
-        sales_to_delete = Sale.objects.filter(sales_reconciliation=instance.id)
-        for sale in sales_to_delete:
-            book_to_remove_sale = Book.objects.filter(id=sale.book.id).get()
-            if (book_to_remove_sale.isGhost):
-                return False
-        return True
+        return not any(sale.book.isGhost for sale in self.get_transactions(instance))
 
     def get_price_name(self):
         return "unit_retail_price"
@@ -70,9 +65,6 @@ class SalesReconciliationSerializer(TransactionGroupBaseSerializer):
     def get_total_revenue(self, instance):
         return super().get_total_of_transactions(instance)
 
-    def update_transaction(self, instance, transaction_data, transaction_id) -> None:
-        self.__update_sale(instance, transaction_data, transaction_id)
-
     def validate_before_creation(self, transaction_quantities, data):
         date = data['date']
         # Currently just says first sale with issue, but can tell all sales with issues after Casey defines errors
@@ -100,16 +92,17 @@ class SalesReconciliationSerializer(TransactionGroupBaseSerializer):
         instance.date = validated_data.get('date', instance.date)
         instance.save()
 
-    def __update_sale(self, instance, sale_data, sale_id):
-        sale = Sale.objects.get(id=sale_id, sales_reconciliation=instance)
-        sale.book = sale_data.get('book', sale.book)
-        sale.quantity = sale_data.get('quantity', sale.quantity)
-        sale.unit_retail_price = sale_data.get('unit_retail_price', sale.unit_retail_price)
-        sale.save()
-
 
 class SalesRecordSerializer(SalesReconciliationSerializer):
     is_sales_record = serializers.BooleanField(required=False, default=True)
 
     def validate_before_creation(self, transaction_quantities, data):
         pass
+
+
+class SalesRecordSubmissionSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = SalesRecordSubmission
+        fields = ['id', 'status', 'attempts', 'error', 'sales_reconciliation', 'created_at', 'updated_at']
+        read_only_fields = fields
@@ -1,25 +1,28 @@
 from rest_framework.permissions import IsAuthenticated
-from .serializers import SalesReconciliationSerializer, SalesRecordSerializer
+from .serializers import SalesReconciliationSerializer, SalesRecordSerializer, SalesRecordSubmissionSerializer
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework import status, filters
 from rest_framework.views import APIView
-from .models import SalesReconciliation, Sale
+from rest_framework.exceptions import NotFound
+from .models import SalesReconciliation, Sale, SalesRecordSubmission
 from rest_framework.generics import ListAPIView, RetrieveUpdateDestroyAPIView, CreateAPIView
-from .paginations import SalesReconciliationPagination
-from django.db.models import OuterRef, Subquery, Func, Count, Sum, F
-from purchase_orders.models import Purchase, PurchaseOrder
-from purchase_orders.serializers import PurchaseOrderSerializer
-from buybacks.serializers import BuybackOrderSerializer
+from .paginations import SalesReconciliationPagination, SalesReconciliationCursorPagination
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Func, Count, F, Prefetch
+from django.db.models.functions import Coalesce
 import datetime, pytz
-from datetime import datetime, timedelta
-from books.models import Book
+from datetime import datetime
 from helpers.csv_reader import CSVReader
-from buybacks.models import BuybackOrder
+from helpers.stock import apply_stock_changes, get_book_quantities, lock_books, lock_transaction_group
+from helpers.transaction_hooks import handle_transactions_changed
 from utils.permissions import CustomBasePermission
+from utils.paginations import CursorPaginationOptInMixin
 from .parsers import XMLParser
 from .sales_record_permissions import SalesRecordsWhitelistPermission, BodySizePermission
 from .ordering_filters import CustomOrderingFilter
+from .reports import load_daily_totals, load_top_books, DEFAULT_TOP_BOOKS
+from .ingestion import submit_sales_record
 
 class CreateSalesReconciliationAPIView(CreateAPIView):
     permission_classes = [CustomBasePermission]
@@ -59,11 +62,51 @@ class CreateSalesRecordAPIView(CreateAPIView):
         return Response(response_data, status=status.HTTP_201_CREATED)
 
 
-class ListSalesRecordAPIView(ListAPIView):
+class CreateSalesRecordSubmissionAPIView(APIView):
+    """
+    Queues an XML sales record for asynchronous ingestion by the process_sales_records worker
+
+    * Returns 202 with the submission, whose status can be polled with RetrieveSalesRecordSubmissionAPIView
+    * Resubmitting the same record, or any record with the same Idempotency-Key header, returns the existing submission with 200
+    """
+    permission_classes = [SalesRecordsWhitelistPermission, BodySizePermission]
+    authentication_classes = []
+
+    def post(self, request, *args, **kwargs):
+        # The payload is stored as sent, it is only parsed by the worker
+        payload = request.stream.read() if request.stream is not None else b''
+        if len(payload) == 0:
+            return Response({"error": "Sales record is empty."}, status=status.HTTP_400_BAD_REQUEST)
+
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key is not None and len(idempotency_key) > SalesRecordSubmission._meta.get_field('idempotency_key').max_length:
+            return Response({"error": "Idempotency-Key is too long."}, status=status.HTTP_400_BAD_REQUEST)
+
+        submission, created = submit_sales_record(payload, idempotency_key)
+        return Response(SalesRecordSubmissionSerializer(submission).data, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+
+class RetrieveSalesRecordSubmissionAPIView(APIView):
+    """
+    Status of a queued sales record, with its errors if it could not be ingested
+    """
+    permission_classes = [SalesRecordsWhitelistPermission]
+    authentication_classes = []
+
+    def get(self, request, *args, **kwargs):
+        try:
+            submission = SalesRecordSubmission.objects.get(id=self.kwargs['id'])
+        except SalesRecordSubmission.DoesNotExist:
+            raise NotFound("No sales record submission with queried id.")
+        return Response(SalesRecordSubmissionSerializer(submission).data, status=status.HTTP_200_OK)
+
+
+class ListSalesRecordAPIView(CursorPaginationOptInMixin, ListAPIView):
     permission_classes = [CustomBasePermission]
     serializer_class = SalesRecordSerializer
     queryset = SalesReconciliation.objects.all()
     pagination_class = SalesReconciliationPagination
+    cursor_pagination_class = SalesReconciliationCursorPagination
     filter_backends = [CustomOrderingFilter, filters.SearchFilter]
     ordering_fields = '__all__'
     ordering = ['-date']
@@ -75,7 +118,8 @@ class ListSalesRecordAPIView(ListAPIView):
             return super().paginate_queryset(queryset)
 
     def get_queryset(self):
-        default_query_set = SalesReconciliation.objects.all()
+        # The transactions and their books are loaded in one query per page rather than per transaction group
+        default_query_set = SalesReconciliation.objects.select_related('user').prefetch_related(Prefetch('sales', queryset=Sale.objects.select_related('book')))
 
         # Create a subquery to aggregate the 'revenue' value for each sale in SalesReconciliation
         revenue_subquery = Sale.objects.filter(sales_reconciliation=OuterRef('id')).values_list(Func(
@@ -83,12 +127,13 @@ class ListSalesRecordAPIView(ListAPIView):
             function='SUM',
         ),)
 
-        default_query_set = default_query_set.annotate(total_revenue=Subquery(revenue_subquery))
+        # Totals are never NULL, so that they can be cursor pagination keys
+        default_query_set = default_query_set.annotate(total_revenue=Coalesce(Subquery(revenue_subquery), 0.0))
 
         # Filter by quantity of books in SalesReconciliation
         num_books_subquery = Sale.objects.filter(sales_reconciliation=OuterRef('id')).values_list(Func('quantity', function='SUM'),)
 
-        default_query_set = default_query_set.annotate(num_books=Subquery(num_books_subquery))
+        default_query_set = default_query_set.annotate(num_books=Coalesce(Subquery(num_books_subquery), 0))
 
         default_query_set = default_query_set.annotate(num_unique_books=Count('sales__book', distinct=True))
 
@@ -162,7 +207,7 @@ class RetrieveUpdateDestroySalesReconciliationAPIView(RetrieveUpdateDestroyAPIVi
     pagination_class = SalesReconciliationPagination
 
     def get_queryset(self):
-        return SalesReconciliation.objects.filter(id=self.kwargs['id'])
+        return SalesReconciliation.objects.select_related('user').prefetch_related(Prefetch('sales', queryset=Sale.objects.select_related('book'))).filter(id=self.kwargs['id'])
 
     def retrieve(self, request, *args, **kwargs):
         invalid_id_response = self.verify_existance()
@@ -181,15 +226,21 @@ class RetrieveUpdateDestroySalesReconciliationAPIView(RetrieveUpdateDestroyAPIVi
         serializer = self.get_serializer(sales_reconciliation, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        # The prefetched transactions no longer match the updated ones
+        sales_reconciliation._prefetched_objects_cache = {}
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def destroy(self, request, *args, **kwargs):
-        sale_book_quantities = Sale.objects.filter(sales_reconciliation=self.get_object().id).values('book').annotate(num_books=Sum('quantity')).values('book', 'num_books')
-        for sale_book_quantity in sale_book_quantities:
-            book_to_remove_sale = Book.objects.filter(id=sale_book_quantity['book']).get()
-            book_to_remove_sale.stock += sale_book_quantity['num_books']
-            book_to_remove_sale.save()
-        return super().destroy(request, *args, **kwargs)
+        instance = self.get_object()
+        with transaction.atomic():
+            lock_transaction_group(instance)
+            sale_book_quantities = get_book_quantities(Sale.objects.filter(sales_reconciliation=instance.id))
+            lock_books(sale_book_quantities.keys())
+            # The sold books go back in stock
+            apply_stock_changes(sale_book_quantities)
+            response = super().destroy(request, *args, **kwargs)
+        handle_transactions_changed(sale_book_quantities.keys(), [instance.date])
+        return response
 
     def verify_existance(self):
         if (len(self.get_queryset()) == 0):
@@ -201,48 +252,27 @@ class RetrieveSalesReportAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, start_date, end_date):
-        daily_sales = {}
-        daily_purchases = {}
-        daily_profits = {}
-        daily_buybacks = {}
-
-        # Get range of dates from starting date to ending date
-        dates = self.dates_range(start_date, end_date)
-
-        for date in dates:
-            date_str = date.strftime("%Y-%m-%d")
-            self.get_daily_sales(daily_sales, date_str)
-            self.get_daily_purchases(daily_purchases, date_str)
-            self.get_daily_buybacks(daily_buybacks, date_str)
-            daily_profits[date_str] = round(daily_sales[date_str] + daily_buybacks[date_str] - daily_purchases[date_str], 2)
-
-        total_cost = round(sum(daily_purchases.values()), 2)
-        total_sales_revenue = round(sum(daily_sales.values()), 2)
-        total_buybacks_revenue = round(sum(daily_buybacks.values()), 2)
-        total_revenue = round(sum(list(daily_sales.values()) + list(daily_buybacks.values())), 2)
+        start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+
+        # Number of top selling books to report
+        try:
+            top = int(request.query_params.get('top', DEFAULT_TOP_BOOKS))
+        except ValueError:
+            top = -1
+        if top < 1:
+            return Response({"top": "top must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Totals of every day of the range, computed with one grouped query per transaction type
+        daily_totals = load_daily_totals(start_date, end_date)
+
+        total_cost = round(sum(totals['cost'] for totals in daily_totals.values()), 2)
+        total_sales_revenue = round(sum(totals['sales_revenue'] for totals in daily_totals.values()), 2)
+        total_buybacks_revenue = round(sum(totals['buybacks_revenue'] for totals in daily_totals.values()), 2)
+        total_revenue = round(total_sales_revenue + total_buybacks_revenue, 2)
         total_profit = round(total_revenue - total_cost, 2)
 
-        sales_data_by_book = list(
-            SalesReconciliation.objects.filter(date__range=(start_date, end_date)).values(book_id=F('sales__book')).exclude(book_id=None).annotate(num_books_sold=Sum('sales__quantity')).annotate(
-                book_revenue=Sum('sales__revenue')).order_by('-num_books_sold'))[:10]
-
-        for book_sale in list(sales_data_by_book):
-            try:
-                most_recent_unit_wholesale_price = PurchaseOrder.objects.filter(date__lte=end_date).order_by('-date', '-id').annotate(
-                    book_wholesale_price=Subquery(Purchase.objects.filter(purchase_order=OuterRef('id')).filter(
-                        book=book_sale['book_id']).order_by('-id')[:1].values('unit_wholesale_price'))).values('book_wholesale_price').exclude(
-                            book_wholesale_price=None).first()['book_wholesale_price']
-                book_sale['is_estimated_cost_most_recent'] = False
-            except:
-                # use 70% of retail price, since book has not been previously documented as being purchased
-                most_recent_unit_wholesale_price = .7 * Book.objects.get(id=book_sale['book_id']).retail_price
-                book_sale['is_estimated_cost_most_recent'] = True
-            book_sale['total_cost_most_recent'] = round(most_recent_unit_wholesale_price * book_sale['num_books_sold'], 2)
-
-        for book_sale in sales_data_by_book:
-            book_sale['book_title'] = Book.objects.filter(id=book_sale['book_id']).get().title
-
-            book_sale['book_profit'] = round(book_sale['book_revenue'] - book_sale['total_cost_most_recent'], 2)
+        sales_data_by_book = load_top_books(start_date, end_date, top)
 
         return Response({
             "total_summary": {
@@ -254,61 +284,17 @@ class RetrieveSalesReportAPIView(APIView):
             },
             "daily_summary":  # date, revenue, cost, profit
                 [{
-                    "date": date,
-                    "sales_revenue": sales_revenue,
-                    "buybacks_revenue": buybacks_revenue,
-                    "cost": cost,
-                    "profit": profit
-                } for (date, sales_revenue, buybacks_revenue, cost, profit) in zip(daily_sales.keys(), daily_sales.values(), daily_buybacks.values(), daily_purchases.values(), daily_profits.values())
+                    "date": date.strftime("%Y-%m-%d"),
+                    "sales_revenue": totals['sales_revenue'],
+                    "buybacks_revenue": totals['buybacks_revenue'],
+                    "cost": totals['cost'],
+                    "profit": totals['profit']
+                } for date, totals in daily_totals.items()
                 ],
             "top_books":  # title, quantity, total_revenue, total_cost, total_profit
                 sales_data_by_book
         })
 
-    def get_daily_buybacks(self, daily_buybacks, date: str):
-        buyback_orders = BuybackOrder.objects.filter(date=date)
-        if len(buyback_orders) == 0:
-            daily_buybacks[date] = 0
-            return
-        for buyback_order in buyback_orders:
-            serializer = BuybackOrderSerializer(buyback_order)
-            if date not in daily_buybacks.keys():
-                daily_buybacks[date] = serializer.data['total_revenue']
-            else:
-                daily_buybacks[date] += serializer.data['total_revenue']
-
-    def get_daily_purchases(self, daily_costs, date: str):
-        purchase_orders = PurchaseOrder.objects.filter(date=date)
-        if len(purchase_orders) == 0:
-            daily_costs[date] = 0
-            return
-        for purchase_order in purchase_orders:  # sum the total costs for the day
-            serializer = PurchaseOrderSerializer(purchase_order)
-            if date not in daily_costs.keys():
-                daily_costs[date] = serializer.data['total_cost']
-            else:
-                daily_costs[date] += serializer.data['total_cost']
-
-    def get_daily_sales(self, daily_revenues, date: str):
-        sales_reconciliations = SalesReconciliation.objects.filter(date=date)
-        if len(sales_reconciliations) == 0:
-            daily_revenues[date] = 0
-            return
-        for sales_reconciliation in sales_reconciliations:  # sum the total revenue for the day
-            serializer = SalesReconciliationSerializer(sales_reconciliation)
-            if date not in daily_revenues.keys():
-                daily_revenues[date] = serializer.data['total_revenue']
-            else:
-                daily_revenues[date] += serializer.data['total_revenue']
-
-    def dates_range(self, start: str, end: str):
-        date_format = "%Y-%m-%d"
-        start_date = datetime.strptime(start, date_format)
-        end_date = datetime.strptime(end, date_format)
-        delta = end_date - start_date
-        days = [start_date + timedelta(days=num_days) for num_days in range(delta.days + 1)]
-        return days
-
 
 class CSVSaleAPIView(APIView):
     permission_classes = [CustomBasePermission]
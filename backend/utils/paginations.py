@@ -1,4 +1,14 @@
-from rest_framework.pagination import PageNumberPagination 
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from books.utils import reformat_uri_to_hostname
@@ -48,4 +58,174 @@ class HTTPSNoPortPagination(PageNumberPagination):
         if page_number == 1:
             return remove_query_param(reformat_url, self.page_query_param)
         return replace_query_param(reformat_url, self.page_query_param, page_number)
-    
\ No newline at end of file
+
+
+class HTTPSNoPortCursorPagination(BasePagination):
+    """Composite keyset pagination with the same HTTPS and no port link rewriting as HTTPSNoPortPagination
+
+       Pages are fetched with a WHERE clause on every ordering field instead of an OFFSET, and no
+       COUNT query is run, so deep pages cost the same as the first one. id is always appended to the
+       ordering as a unique tiebreaker and stored in the cursor with the other fields, so rows with
+       equal sort values are never skipped or repeated.
+
+       Only orderings made of cursor_ordering_fields are supported. These must never be NULL, since
+       NULL cannot be compared in the WHERE clause.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = None
+    cursor_query_param = 'cursor'
+    cursor_ordering_fields = ['id']
+    invalid_cursor_message = 'Invalid cursor'
+    env = environ.Env()
+    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environ.Env.read_env(os.path.join(BASE_DIR, '.env'))
+    host_name = env('HOST_NAME')
+
+    def get_ordering(self, request, queryset, view):
+        """Returns the requested ordering with the id tiebreaker, or None if it cannot be used as a cursor key"""
+        ordering_filter = next((backend() for backend in view.filter_backends if issubclass(backend, OrderingFilter)), None)
+        ordering = list(ordering_filter.get_ordering(request, queryset, view) if ordering_filter else getattr(view, 'ordering', None) or [])
+
+        if any(field.lstrip('-') not in self.cursor_ordering_fields for field in ordering):
+            return None
+        if 'id' not in [field.lstrip('-') for field in ordering]:
+            ordering.append('id')
+        return ordering
+
+    def supports_request(self, request, queryset, view):
+        # Searches without an explicit ordering are ordered by relevance, which has no keyset
+        if request.query_params.get(api_settings.SEARCH_PARAM) and not request.query_params.get(api_settings.ORDERING_PARAM):
+            return False
+        return self.get_ordering(request, queryset, view) is not None
+
+    def get_unsupported_message(self, request):
+        if request.query_params.get(api_settings.SEARCH_PARAM) and not request.query_params.get(api_settings.ORDERING_PARAM):
+            return {'pagination': 'Searches ordered by relevance do not support cursor pagination, an ordering is required'}
+        return {'pagination': f'Ordering {request.query_params.get(api_settings.ORDERING_PARAM)} does not support cursor pagination, '
+                              f'the supported fields are {", ".join(self.cursor_ordering_fields)}'}
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size) if self.max_page_size else page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        if self.ordering is None:
+            raise ValidationError(self.get_unsupported_message(request))
+
+        position, self.reverse = self.decode_cursor(request)
+
+        # Previous pages are fetched backwards from the first row of the current page
+        ordering = [self.flip(field) for field in self.ordering] if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_condition(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+
+        self.has_next = has_more if not self.reverse else position is not None
+        self.has_previous = has_more if self.reverse else position is not None
+        return self.page
+
+    def flip(self, field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def get_keyset_condition(self, ordering, position):
+        """Rows after the position: (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ..."""
+        condition = None
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            term = Q(**{f'{name}__{"lt" if field.startswith("-") else "gt"}': position[i]})
+            for previous_field, value in zip(ordering[:i], position[:i]):
+                term &= Q(**{previous_field.lstrip('-'): value})
+            condition = term if condition is None else condition | term
+        return condition
+
+    def get_position(self, instance):
+        return [getattr(instance, field.lstrip('-')) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        """Returns (position, reverse), position is None for the first page"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position, reverse = cursor['p'], bool(cursor['r'])
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        """Returns the link to the page at the cursor, with HTTPS and no explicit port numbering
+
+        Returns:
+            link: "https://${server_name}/${request_uri}
+
+        """
+        encoded = b64encode(json.dumps({'p': position, 'r': int(reverse)}, cls=DjangoJSONEncoder).encode('utf-8')).decode('ascii')
+        url = replace_query_param(self.base_url, self.cursor_query_param, encoded)
+        return reformat_uri_to_hostname(url, self.host_name)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class CursorPaginationOptInMixin:
+    """Mixin for list views to opt in to cursor pagination per request
+
+       The view uses its cursor_pagination_class instead of its pagination_class when the request
+       has pagination=cursor or a cursor query param (which the next and previous links of a cursor page carry).
+       Such requests with an ordering the cursor pagination does not support are rejected with a 400.
+    """
+    cursor_pagination_class = None
+
+    def uses_cursor_pagination(self):
+        query_params = self.request.query_params
+        if query_params.get('pagination') != 'cursor' and 'cursor' not in query_params:
+            return False
+
+        cursor_pagination = self.cursor_pagination_class()
+        if not cursor_pagination.supports_request(self.request, self.get_queryset(), self):
+            raise ValidationError(cursor_pagination.get_unsupported_message(self.request))
+        return True
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            pagination_class = self.pagination_class
+            if self.cursor_pagination_class is not None and self.uses_cursor_pagination():
+                pagination_class = self.cursor_pagination_class
+            self._paginator = None if pagination_class is None else pagination_class()
+        return self._paginator
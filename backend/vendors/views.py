@@ -10,6 +10,7 @@ from .serializers import VendorSerializer
 from .models import Vendor
 from .paginations import VendorPagination
 from books.models import Book
+from books.metrics import refresh_book_metrics
 
 from purchase_orders.models import PurchaseOrder, Purchase
 from utils.general import str2bool
@@ -78,6 +79,9 @@ class RetrieveUpdateDestroyVendorAPIView(RetrieveUpdateDestroyAPIView):
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
 
+        # The buyback rate determines the best buyback price of the books purchased from this vendor
+        refresh_book_metrics(Purchase.objects.filter(purchase_order__vendor=instance).values_list('book', flat=True).distinct())
+
         if getattr(instance, '_prefetched_objects_cache', None):
             # If 'prefetch_related' has been applied to a queryset, we need to
             # forcibly invalidate the prefetch cache on the instance.